@@ -0,0 +1,120 @@
+"""Benchmarks of the stages of a run on synthetic grids of 300 to 20 000 nodes, see
+project_code/synthetic_grid.py. Run with pytest-benchmark:
+
+    python -m pytest benchmarks/bench_stages.py [--grid-sizes 300,1000] [--benchmark-json FILE]
+
+Countries hold about NODES_PER_COUNTRY nodes each, the control area being the first country. Each
+stage is first run once with tracemalloc, which provides the inputs of the next stages, and then
+timed. The peak of memory allocated by the stage (tracemalloc, numpy arrays included), the peak RSS
+of the process and the sizes of the grid and the sets are stored in the extra_info of the benchmark.
+compute_IFs scales with |I| * |R| * |T|: on the largest grids, it runs for hours."""
+import tracemalloc
+
+import pytest
+
+from project_code.compute_influence_factors import compile_kernels, compute_IFs, compute_IFs_generators
+from project_code.instrumentation import get_peak_rss_MB
+from project_code.main import read_grid, create_and_preprocess_topology, create_system_matrices, \
+    create_sets
+from project_code.matrix_and_set_functions import compute_LODF_for_generators
+from project_code.settings import SettingsEnum, get_settings
+from project_code.synthetic_grid import COUNTRY_CODES, create_synthetic_uct, get_country_codes
+
+NODES_PER_COUNTRY = 500
+STAGES = ['read_grid', 'create_and_preprocess_topology', 'create_system_matrices', 'create_sets',
+          'compute_IFs', 'compute_IFs_generators']
+
+
+@pytest.fixture(scope='session', autouse=True)
+def kernels():
+    compile_kernels()
+
+
+# noinspection PyShadowingNames
+@pytest.fixture(scope='module')
+def case(n_nodes):
+    countries = get_country_codes(min(len(COUNTRY_CODES), max(2, n_nodes // NODES_PER_COUNTRY)))
+    settings = get_settings(SettingsEnum.UCT0)
+    settings.input_file_name = f'synthetic_{n_nodes}.uct'
+    settings.countries = countries
+    return {'country': countries[0], 'settings': settings, 'stages_run': [],
+            'file_contents': create_synthetic_uct(n_nodes, countries)}
+
+
+def get_stage_call(case, stage):
+    """Returns the function of a stage and its arguments, taken from the outputs of the previous
+    stages."""
+    settings, country, epsilon = case['settings'], case['country'], case['settings'].eps
+    if stage == 'read_grid':
+        return read_grid, (case['file_contents'], settings)
+    elif stage == 'create_and_preprocess_topology':
+        # the grid is modified in place, so each call starts from a grid read again
+        branches, generators, nodes = read_grid(case['file_contents'], settings)
+        return create_and_preprocess_topology, (branches, generators, nodes, country, settings)
+    elif stage == 'create_system_matrices':
+        return create_system_matrices, (case['branches'], case['nodes'], country, epsilon)
+    elif stage == 'create_sets':
+        return create_sets, (case['branches'], case['generators'], case['LODF'], case['PATL'],
+                             country, epsilon, settings)
+    elif stage == 'compute_IFs':
+        return compute_IFs, (case['setI'], case['setT'], case['setR'], case['LODF'], case['PATL'],
+                             case['PTDF'])
+    elif stage == 'compute_IFs_generators':
+        if 'LODF_gens' not in case:
+            case['LODF_gens'] = compute_LODF_for_generators(case['setR_gens'], case['ISF'],
+                                                            case['generator_arrays'])
+        return compute_IFs_generators, (case['branches'], case['setT'], case['setI'],
+                                        case['setR_gens'], case['LODF'], case['LODF_gens'],
+                                        case['PATL'], case['generator_arrays'])
+    raise ValueError(f"Unknown stage {stage}.")
+
+
+def store_stage_outputs(case, stage, arguments, outputs):
+    if stage == 'create_and_preprocess_topology':
+        case['branches'], case['nodes'], case['generator_arrays'] = outputs
+        case['generators'] = arguments[1]
+    elif stage == 'create_system_matrices':
+        case['ISF'], case['PTDF'], case['LODF'], case['PATL'] = outputs
+    elif stage == 'create_sets':
+        case['setI'], case['setT'], case['setR'], case['setR_gens'] = outputs
+
+
+def run_stage(case, stage):
+    """Runs a stage once with tracemalloc, after the stages it depends on, keeps its outputs and
+    returns its peak of traced memory in MB."""
+    for previous_stage in STAGES[:STAGES.index(stage)]:
+        if previous_stage not in case['stages_run']:
+            run_stage(case, previous_stage)
+    function, arguments = get_stage_call(case, stage)
+    tracemalloc.start()
+    try:
+        outputs = function(*arguments)
+        peak_traced = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    store_stage_outputs(case, stage, arguments, outputs)
+    case['stages_run'].append(stage)
+    return peak_traced / 1024 ** 2
+
+
+def get_case_sizes(case):
+    sizes = {}
+    for name in ['nodes', 'branches', 'setI', 'setT', 'setR', 'setR_gens']:
+        if name in case:
+            sizes[f'n_{name}'] = len(case[name])
+    return sizes
+
+
+@pytest.mark.parametrize('stage', STAGES)
+def test_stage(benchmark, case, stage, n_nodes):
+    benchmark.extra_info['peak_traced_MB'] = run_stage(case, stage)
+    benchmark.extra_info['peak_rss_MB'] = get_peak_rss_MB()
+    benchmark.extra_info.update(get_case_sizes(case))
+    benchmark.group = stage
+
+    def setup():
+        function, arguments = get_stage_call(case, stage)
+        return (function,) + arguments, {}
+
+    benchmark.pedantic(lambda function, *arguments: function(*arguments), setup=setup,
+                       rounds=3 if n_nodes <= 3000 else 1)
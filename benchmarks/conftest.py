@@ -0,0 +1,21 @@
+import pytest
+
+GRID_SIZES = [300, 1000, 3000, 8000, 20000]
+
+
+def pytest_addoption(parser):
+    parser.addoption('--grid-sizes', default=','.join(str(size) for size in GRID_SIZES),
+                     help="comma separated numbers of nodes of the synthetic grids to benchmark")
+
+
+def pytest_generate_tests(metafunc):
+    if 'n_nodes' in metafunc.fixturenames:
+        sizes = [int(size) for size in metafunc.config.getoption('grid_sizes').split(',')]
+        # module scope: the stages of a grid size are run one after the other and the case of a
+        # grid size is released before the next grid size is generated
+        metafunc.parametrize('n_nodes', sizes, indirect=True, scope='module')
+
+
+@pytest.fixture(scope='module')
+def n_nodes(request):
+    return request.param
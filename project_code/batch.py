@@ -0,0 +1,150 @@
+"""Batch runs over many snapshots of a grid, e.g. the hourly files of a day or seasonal variants:
+
+    python -m project_code.cli batch UCT0 'hourly/*.uct' --countries A B --memory-budget 2000
+
+The files of a directory or glob of source_files are processed in name order, each snapshot being
+updated from the previous one (see InfluenceCase.update). Upcoming files are read and preprocessed
+on a background thread while the current snapshot is in the matrix and kernel stages, as far as the
+memory budget allows. The results of all snapshots and countries are appended to one results
+database (see results_database.py), as one run per snapshot and country, stamped with the time of the
+snapshot read from its file name or modification time."""
+import copy
+import queue
+import threading
+import time
+from pathlib import Path
+
+from definitions import ROOT_DIR
+from project_code.influence_case import InfluenceCase
+from project_code.main import check_shared_topology_settings
+from project_code.misc_functions import setup_logger
+from project_code.results_database import add_run, add_set_members, add_results, get_database_path, \
+    get_snapshot_time
+from project_code.settings import FileTypeEnum
+
+SNAPSHOT_SUFFIXES = {FileTypeEnum.uct: ('.uct',), FileTypeEnum.psse: ('.raw', '.sav')}
+PARSED_SIZE_FACTOR = 10  # memory of a read and preprocessed snapshot over the size of its file (UCT)
+
+
+def get_snapshot_file_names(pattern, settings):
+    """Names, relative to source_files and in name order, of the files of the type of settings in the
+    directory pattern, or of the files matching the glob pattern."""
+    source_files = Path(ROOT_DIR) / "source_files"
+    if (source_files / pattern).is_dir():
+        fpaths = [fpath for fpath in (source_files / pattern).iterdir()
+                  if fpath.suffix.lower() in SNAPSHOT_SUFFIXES[settings.file_type]]
+    else:
+        fpaths = list(source_files.glob(pattern))
+    input_file_names = sorted(fpath.relative_to(source_files).as_posix() for fpath in fpaths
+                              if fpath.is_file())
+    if not input_file_names:
+        raise FileNotFoundError(f"No snapshot found for '{pattern}' in {source_files}.")
+    return input_file_names
+
+
+def estimate_snapshot_MB(input_file_name):
+    """Estimated memory of a snapshot once read and preprocessed, 0 if its file cannot be found."""
+    try:
+        file_size = (Path(ROOT_DIR) / "source_files" / input_file_name).stat().st_size
+    except OSError:
+        return 0.0
+    return PARSED_SIZE_FACTOR * file_size / 1024 ** 2
+
+
+def prefetch_cases(settings, input_file_names, memory_budget_MB):
+    """Yields (input file name, InfluenceCase with its topology, error) for each file. The files are read
+    and preprocessed on a background thread, ahead of the caller as long as the estimated memory of
+    the snapshots in flight, the one of the caller included, stays within memory_budget_MB. A file is
+    always read when no other snapshot is in flight. error is the exception raised while reading a
+    file, the case being then None."""
+    snapshots = queue.Queue()
+    condition = threading.Condition()
+    in_flight_MB = []  # estimated memory of each snapshot in flight
+    is_stopped = threading.Event()
+
+    def read_ahead():
+        for input_file_name in input_file_names:
+            size_MB = estimate_snapshot_MB(input_file_name)
+            with condition:
+                condition.wait_for(lambda: is_stopped.is_set() or not in_flight_MB or
+                                   sum(in_flight_MB) + size_MB <= memory_budget_MB)
+                if is_stopped.is_set():
+                    return
+                in_flight_MB.append(size_MB)
+            snapshot_settings = copy.copy(settings)
+            snapshot_settings.input_file_name = input_file_name
+            try:
+                case = InfluenceCase(snapshot_settings)
+                case.topology
+            except Exception as error:  # reported to the caller, the next files are still read
+                snapshots.put((input_file_name, None, error))
+            else:
+                snapshots.put((input_file_name, case, None))
+
+    thread = threading.Thread(target=read_ahead, name='prefetch', daemon=True)
+    thread.start()
+    try:
+        for _ in input_file_names:
+            yield snapshots.get()
+            # the snapshot of the caller is out of flight once the caller asks for the next one
+            with condition:
+                in_flight_MB.pop(0)
+                condition.notify()
+    finally:
+        is_stopped.set()
+        with condition:
+            condition.notify()
+        thread.join()
+
+
+def store_case_results(case, country, results):
+    run_id = add_run(case.settings, country, get_snapshot_time(case.settings))
+    setI, setT, setR, _ = case.sets(country)
+    add_set_members(case.settings, run_id, {'R': setR, 'T': setT, 'I': setI})
+    add_results(case.settings, run_id, results)
+
+
+def run_batch(settings, pattern, memory_budget_MB=1000):
+    """Computes the results of all countries of settings for each snapshot of pattern (see
+    get_snapshot_file_names), and appends them to the results database of settings, by default
+    <case name>_batch.sqlite. Snapshots that cannot be read are logged and skipped. Returns the path
+    of the results database."""
+    from project_code.compute_influence_factors import compile_kernels
+
+    check_shared_topology_settings(settings, 'batch runs')
+    logger = setup_logger()
+    t0 = time.perf_counter()
+    settings = copy.copy(settings)
+    settings.snapshot_time = None  # the time of each snapshot is read from its file
+    if settings.results_database is None:
+        settings.results_database = f"{settings.case_name}_batch.sqlite"
+    input_file_names = get_snapshot_file_names(pattern, settings)
+    logger.info(f"Batch of {len(input_file_names)} snapshots, results stored in "
+                f"{get_database_path(settings)}.")
+    compile_kernels()
+
+    previous_case = None
+    waiting_time = 0
+    n_skipped = 0
+    t_wait = time.perf_counter()
+    for input_file_name, case, error in prefetch_cases(settings, input_file_names, memory_budget_MB):
+        waiting_time += time.perf_counter() - t_wait
+        if error is not None:
+            logger.error(f"Snapshot {input_file_name} skipped: {error!r}")
+            n_skipped += 1
+            t_wait = time.perf_counter()
+            continue
+        t = time.perf_counter()
+        if previous_case is not None:
+            previous_case.update(case)
+        for country in case.countries:
+            store_case_results(case, country, case.influence(country))
+        logger.info(f"Snapshot {input_file_name} processed in {round(time.perf_counter() - t, 3)} seconds.")
+        previous_case = case
+        t_wait = time.perf_counter()
+
+    duration = time.perf_counter() - t0
+    logger.info(f"Batch of {len(input_file_names)} snapshots ({n_skipped} skipped) processed in "
+                f"{round(duration, 3)} seconds, {round(waiting_time, 3)} seconds waiting for snapshots "
+                f"to be read.")
+    return get_database_path(settings)
@@ -1,6 +1,8 @@
 import math
 import enum
 
+import numpy as np
+
 BranchTypeEnum = enum.Enum(value='BranchTypeEnum',
                            names=('Line', 'Coupler', 'Transformer',
                                   'Transformer2W', 'Transformer3W3', 'Transformer3W2'))
@@ -33,6 +35,8 @@ class Branch:
         else:
             self.PATL = PATL  # in MW
         self.PTDF = 1.0
+        self.is_radial = False
+        self.biconnected_component = -1
         Branch.n_of_branches += 1
 
     def __str__(self):
@@ -248,8 +252,99 @@ class GenerationUnit:
             self.node_name = dict_of_couplers[self.node_name]
 
 
+class BranchSet:
+    def __init__(self, branches):
+        """
+            Ordered set of branches (R, I or T), with arrays for vectorized access to the matrices:
+            -branches: list of branches
+            -indices: index of each branch in the branch list and in the system matrices
+            -rings: ring of each branch
+        """
+        self.branches = list(branches)
+        self.indices = np.array([branch.index for branch in self.branches], dtype=np.int64)
+        self.rings = np.array([branch.ring for branch in self.branches], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.branches)
+
+    def __iter__(self):
+        return iter(self.branches)
+
+    def __getitem__(self, position):
+        return self.branches[position]
+
+    def __add__(self, other):
+        return BranchSet(self.branches + other.branches)
+
+    def in_ring(self, ring):
+        return BranchSet([self.branches[pos] for pos in np.flatnonzero(self.rings == ring)])
+
+    def get_positions_in(self, other):
+        """Position in other of each branch of this set, -1 if the branch is not in other."""
+        size = max(self.indices.max(initial=-1), other.indices.max(initial=-1)) + 1
+        position_in_other = -1 * np.ones(size, dtype=np.int32)
+        position_in_other[other.indices] = np.arange(len(other), dtype=np.int32)
+        return position_in_other[self.indices]
+
+
+class GeneratorArrays:
+    def __init__(self, node_index, country, power):
+        """
+            Attached generators stored as arrays, in order of generator index:
+            -node_index: index of the node each generator is attached to
+            -country: country of each generator
+            -power: maximum power of each generator in MW
+        """
+        self.node_index = node_index
+        self.country = country
+        self.power = power
+
+    def __len__(self):
+        return len(self.power)
+
+
+class NetworkReduction:
+    def __init__(self, n_nodes, n_branches, n_reduced_nodes, node_from, node_to, impedance,
+                 slack_idx, branch_to_reduced, branch_sign, node_rep, node_weight,
+                 local_branch, local_node, local_value):
+        """
+            Reduced network with a mapping back to the original network:
+            -n_nodes, n_branches: size of the original network
+            -n_reduced_nodes: number of nodes in the reduced network
+            -node_from, node_to, impedance: arrays describing the branches of the reduced network
+            -slack_idx: index of the slack node in the reduced network
+            -branch_to_reduced: per original branch, the reduced branch it is part of (-1 if the
+            branch was eliminated as part of a dangling tree)
+            -branch_sign: +1 if an original branch has the same direction as its reduced branch
+            -node_rep: per original node, the two reduced nodes (n_nodes * 2) that together receive
+            an injection in that node
+            -node_weight: the share of an injection that each of these two reduced nodes receives
+            -local_branch, local_node, local_value: flow on original branches caused by an
+            injection in an original node that is not seen by the reduced network
+        """
+        self.n_nodes = n_nodes
+        self.n_branches = n_branches
+        self.n_reduced_nodes = n_reduced_nodes
+        self.node_from = node_from
+        self.node_to = node_to
+        self.impedance = impedance
+        self.slack_idx = slack_idx
+        self.branch_to_reduced = branch_to_reduced
+        self.branch_sign = branch_sign
+        self.node_rep = node_rep
+        self.node_weight = node_weight
+        self.local_branch = local_branch
+        self.local_node = local_node
+        self.local_value = local_value
+
+    @property
+    def n_reduced_branches(self):
+        return len(self.impedance)
+
+
 class Result_IF:
-    def __init__(self, eltR, IFN1, nIFN1, IFN2, nIFN2, eltI, eltT, eltIn, eltTn, LODFit, LODFti):
+    def __init__(self, eltR, IFN1, nIFN1, IFN2, nIFN2, eltI, eltT, eltIn, eltTn, LODFit, LODFti,
+                 witnesses=None, rating=None, rating_results=None):
         """
             Generates a result with :
             -eltR the element whose influence is assessed
@@ -261,6 +356,9 @@ class Result_IF:
             -eltT : an element from the CA for which IFN2 is reached
             -eltIn : a contingency i for which nIFN2 is reached
             -eltTn : an element from the CA for which nIFN2 is reached
+            -witnesses : Result_IF_witnesses with the largest combinations, if requested
+            -rating : PATL per branch index used for normalization, None for the input file PATL
+            -rating_results : Result_IF for each additional rating set, if requested
         """
         self.eltR = eltR
         self.IFN1 = IFN1
@@ -273,6 +371,9 @@ class Result_IF:
         self.eltTn = eltTn
         self.LODFit = LODFit
         self.LODFti = LODFti
+        self.witnesses = witnesses
+        self.rating = rating
+        self.rating_results = [] if rating_results is None else rating_results
 
     @staticmethod
     def header(country):
@@ -292,12 +393,116 @@ class Result_IF:
         sep = ','
         return f"{self.eltR.display_name}{sep}{self.eltR.v_base:.0f}{sep}{self.eltR.country}{sep}" \
                f"{self.eltR.type}{sep}{self.nIFN2:.4f}{sep}{self.IFN2:.4f}{sep}" \
-               f"{self.eltR.PATL:.0f}{sep}{self.eltR.ring}{sep}" \
+               f"{self.get_PATL(self.eltR):.0f}{sep}{self.eltR.ring}{sep}" \
                f"{self.eltIn.display_name} {self.eltIn.v_base:.0f} {self.eltIn.country}{sep}" \
                f"{self.eltTn.display_name} {self.eltTn.v_base:.0f} {self.eltTn.country}{sep}" \
                f"{self.eltI.display_name} {self.eltI.v_base:.0f} {self.eltI.country}{sep}" \
                f"{self.eltT.display_name} {self.eltT.v_base:.0f} {self.eltT.country}{sep}" \
-               f"{self.eltTn.PATL:.0f}\n"
+               f"{self.get_PATL(self.eltTn):.0f}\n"
+
+    def get_PATL(self, branch):
+        return branch.PATL if self.rating is None else self.rating[branch.index]
+
+
+class Result_IF_witnesses:
+    def __init__(self, eltR, IFs, eltsI, eltsT, norm_IFs, eltsIn, eltsTn):
+        """
+            Generates the largest combinations for an element, by decreasing value, with :
+            -eltR the element whose influence is assessed
+            -IFs : the largest N-2 IFs, with contingencies eltsI and CA elements eltsT
+            -norm_IFs : the largest normalized N-2 IFs, with contingencies eltsIn and CA elements
+            eltsTn
+        """
+        self.eltR = eltR
+        self.IFs = IFs
+        self.eltsI = eltsI
+        self.eltsT = eltsT
+        self.norm_IFs = norm_IFs
+        self.eltsIn = eltsIn
+        self.eltsTn = eltsTn
+
+    @staticmethod
+    def header(country):
+        sep = ','
+        return f"Largest combinations for R from {country} perspective" \
+               f"{sep}{sep}{sep}{sep}{sep}{sep}{sep}\n\n" \
+               f"R{sep}Rank{sep}Normalized IF{sep}I for norm.IF{sep}T for norm.IF{sep}" \
+               f"IF{sep}I IF{sep}T IF\n"
+
+    def __str__(self):
+        sep = ','
+        lines = []
+        for rank in range(max(len(self.IFs), len(self.norm_IFs))):
+            norm_IF = f"{sep}{sep}"
+            if rank < len(self.norm_IFs):
+                eltIn, eltTn = self.eltsIn[rank], self.eltsTn[rank]
+                norm_IF = f"{self.norm_IFs[rank]:.4f}{sep}" \
+                          f"{eltIn.display_name} {eltIn.v_base:.0f} {eltIn.country}{sep}" \
+                          f"{eltTn.display_name} {eltTn.v_base:.0f} {eltTn.country}"
+            IF = f"{sep}{sep}"
+            if rank < len(self.IFs):
+                eltI, eltT = self.eltsI[rank], self.eltsT[rank]
+                IF = f"{self.IFs[rank]:.4f}{sep}" \
+                     f"{eltI.display_name} {eltI.v_base:.0f} {eltI.country}{sep}" \
+                     f"{eltT.display_name} {eltT.v_base:.0f} {eltT.country}"
+            lines.append(f"{self.eltR.display_name}{sep}{rank + 1}{sep}{norm_IF}{sep}{IF}\n")
+        return ''.join(lines)
+
+
+class Result_IF_bound:
+    def __init__(self, eltR, IFN2_bound, nIFN2_bound):
+        """
+            Generates a result for an element that was not computed, with :
+            -eltR the element whose influence is assessed
+            -IFN2_bound : an upper bound of its N-2 IF
+            -nIFN2_bound : an upper bound of its normalized N-2 IF
+        """
+        self.eltR = eltR
+        self.IFN2_bound = IFN2_bound
+        self.nIFN2_bound = nIFN2_bound
+
+    @staticmethod
+    def header(country):
+        sep = ','
+        return f"List of R below threshold from {country} perspective{sep}{sep}{sep}{sep}{sep}{sep}\n\n" \
+               f"R{sep}Voltage level [kV]{sep}Country{sep}Ring R{sep}" \
+               f"Normalized IF upper bound{sep}IF upper bound\n"
+
+    def __str__(self):
+        sep = ','
+        return f"{self.eltR.display_name}{sep}{self.eltR.v_base:.0f}{sep}{self.eltR.country}{sep}" \
+               f"{self.eltR.ring}{sep}{self.nIFN2_bound:.4f}{sep}{self.IFN2_bound:.4f}\n"
+
+
+class Result_relevance:
+    def __init__(self, eltR, is_relevant, eltI, eltT):
+        """
+            Generates a result of the threshold mode with :
+            -eltR the element whose relevance is assessed
+            -is_relevant : True if its IF or normalized IF exceeds the threshold
+            -eltI : the first contingency i found above the threshold (None if not relevant)
+            -eltT : the first element from the CA found above the threshold (None if not relevant)
+        """
+        self.eltR = eltR
+        self.is_relevant = is_relevant
+        self.eltI = eltI
+        self.eltT = eltT
+
+    @staticmethod
+    def header(country):
+        sep = ','
+        return f"Relevance of R from {country} perspective{sep}{sep}{sep}{sep}{sep}{sep}\n\n" \
+               f"R{sep}Voltage level [kV]{sep}Country{sep}Ring R{sep}Relevant{sep}" \
+               f"I above threshold{sep}T above threshold\n"
+
+    def __str__(self):
+        sep = ','
+        witness = f"{sep}"
+        if self.is_relevant:
+            witness = f"{self.eltI.display_name} {self.eltI.v_base:.0f} {self.eltI.country}{sep}" \
+                      f"{self.eltT.display_name} {self.eltT.v_base:.0f} {self.eltT.country}"
+        return f"{self.eltR.display_name}{sep}{self.eltR.v_base:.0f}{sep}{self.eltR.country}{sep}" \
+               f"{self.eltR.ring}{sep}{self.is_relevant}{sep}{witness}\n"
 
 
 class Result_IF_generators:
@@ -0,0 +1,221 @@
+"""Command line entry point, run as `python -m project_code.cli <subcommand> <settings name>`.
+
+Subcommands:
+- settings: lists the settings sets defined in settings.py;
+- topology: reads the grid and stores the topology (branches.csv, nodes.csv) of each country;
+- sets: as topology, and builds the system matrices and the sets R, T and I of each country;
+- run: full run, as main.main;
+- bench: times the stages of a run for each country, without storing results;
+- serve: loads the grid once and answers influence queries over HTTP, see influence_service.py;
+- batch: results of each snapshot of a directory or glob of source_files, see batch.py;
+- synthetic: writes a synthetic UCTE-DEF grid of a given size to source_files.
+
+Only the modules needed by a subcommand are imported: the settings and topology subcommands do
+not import numba, scipy or the PSSE wrapper."""
+import argparse
+import ast
+import enum
+import sys
+import time
+
+from project_code.settings import SettingsEnum, ScreeningEnum, get_settings
+
+# enum of the settings that may be None, the others are converted to the enum of their current value
+OPTIONAL_ENUM_SETTINGS = {'screening_policy': ScreeningEnum}
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='influence', description="Influence computation of external "
+                                                                   "elements on a control area.")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    subparsers.add_parser('settings', help="list the settings sets")
+    subparser = subparsers.add_parser('synthetic', help="write a synthetic UCTE-DEF grid")
+    subparser.add_argument('input_file_name', help="name of the file written to source_files")
+    subparser.add_argument('n_nodes', type=int, help="number of nodes, X-nodes excluded")
+    subparser.add_argument('--n-countries', type=int, default=4, help="number of countries")
+    subparser.add_argument('--branches-per-node', type=float, default=1.6,
+                           help="number of branches per node")
+    subparser.add_argument('--seed', type=int, default=0, help="seed of the random generator")
+    for command, description in [('topology', "store the topology of each country"),
+                                 ('sets', "determine the sets R, T and I of each country"),
+                                 ('run', "full run"),
+                                 ('bench', "time the stages of a run for each country"),
+                                 ('serve', "answer influence queries over HTTP"),
+                                 ('batch', "compute the results of many snapshots")]:
+        subparser = subparsers.add_parser(command, help=description)
+        subparser.add_argument('settings_name', choices=[s.name for s in SettingsEnum],
+                               help="name of the settings set, see settings.py")
+        subparser.add_argument('--countries', nargs='+', default=None,
+                               help="countries to process, instead of the ones of the settings set")
+        subparser.add_argument('--set', nargs='+', default=[], metavar='NAME=VALUE', dest='overrides',
+                               help="override settings, values are read as python literals, or as "
+                                    "member names for enum settings")
+        if command == 'bench':
+            subparser.add_argument('--repeat', type=int, default=1,
+                                   help="number of runs per country, the fastest one is reported")
+        if command == 'batch':
+            subparser.add_argument('pattern', help="directory or glob of the snapshots, in source_files")
+            subparser.add_argument('--memory-budget', type=float, default=1000,
+                                   help="memory in MB of the snapshots in flight, see batch.py")
+        if command == 'serve':
+            subparser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+            subparser.add_argument('--port', type=int, default=8050, help="port to listen on")
+    return parser
+
+
+def get_settings_from_args(args):
+    settings = get_settings(SettingsEnum[args.settings_name])
+    if args.countries is not None:
+        settings.countries = args.countries
+    for override in args.overrides:
+        name, _, value = override.partition('=')
+        if not hasattr(settings, name):
+            raise ValueError(f"Unknown setting '{name}'.")
+        current = getattr(settings, name)
+        if name in OPTIONAL_ENUM_SETTINGS:
+            value = get_enum_member(name, OPTIONAL_ENUM_SETTINGS[name], value)
+        elif isinstance(current, enum.Enum):
+            value = get_enum_member(name, type(current), value)
+        else:
+            try:
+                value = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                pass  # kept as a string
+        setattr(settings, name, value)
+    return settings
+
+
+def get_enum_member(name, enum_type, value):
+    """Member of enum_type named value, or None for 'None' if the setting is optional."""
+    if value == 'None' and name in OPTIONAL_ENUM_SETTINGS:
+        return None
+    try:
+        return enum_type[value]
+    except KeyError:
+        raise ValueError(f"Unknown value '{value}' for setting '{name}', expected one of "
+                         f"{[member.name for member in enum_type]}.") from None
+
+
+def get_countries(settings):
+    return [country for country in settings.countries if country != 'XX']
+
+
+def list_settings():
+    for settings_name in SettingsEnum:
+        settings = get_settings(settings_name)
+        print(f"{settings_name.name}: {settings.input_file_name} ({settings.file_type.name}), case "
+              f"'{settings.case_name}', countries {', '.join(settings.countries)}")
+
+
+def write_synthetic_grid(args):
+    from project_code.synthetic_grid import get_country_codes, write_synthetic_uct
+
+    countries = get_country_codes(args.n_countries)
+    fpath = write_synthetic_uct(args.input_file_name, args.n_nodes, countries=countries,
+                                branches_per_node=args.branches_per_node, seed=args.seed)
+    print(f"{fpath}: countries {', '.join(countries)}, run with e.g. --set "
+          f"input_file_name={args.input_file_name!r} --countries {countries[0]}")
+
+
+def store_topologies(settings):
+    from project_code.main import open_file, read_grid, create_and_preprocess_topology
+    from project_code.misc_functions import add_log_file_handler, remove_log_file_handler, setup_logger
+    from project_code.topology_functions import store_topology
+
+    logger = setup_logger()
+    file_contents = open_file(settings)
+    for country in get_countries(settings):
+        add_log_file_handler(logger, country, settings)
+        branches, generators, nodes = read_grid(file_contents, settings)
+        branches, nodes, _ = create_and_preprocess_topology(branches, generators, nodes, country,
+                                                            settings)
+        store_topology(branches, nodes, country, settings)
+        remove_log_file_handler(logger, country, settings)
+        print(f"{country}: {len(nodes)} nodes, {len(branches)} branches")
+
+
+def determine_sets(settings):
+    from project_code.main import open_file, read_grid, create_and_preprocess_topology, \
+        create_country_matrices, create_screened_sets, check_screening_settings
+
+    check_screening_settings(settings)
+    file_contents = open_file(settings)
+    for country in get_countries(settings):
+        branches, generators, nodes = read_grid(file_contents, settings)
+        branches, nodes, _ = create_and_preprocess_topology(branches, generators, nodes, country,
+                                                            settings)
+        _, PTDF, LODF, PATL = create_country_matrices(branches, nodes, country, settings)
+        setI, setT, setR, setR_gens = create_screened_sets(branches, generators, LODF, PATL, PTDF,
+                                                           country, settings)
+        print(f"{country}: R {len(setR)}, R generators {len(setR_gens)}, T {len(setT)}, "
+              f"I {len(setI)}")
+
+
+def bench(settings, repeat):
+    from project_code.compute_influence_factors import compute_IFs, compile_kernels
+    from project_code.main import open_file, read_grid, create_and_preprocess_topology, \
+        create_country_matrices, create_screened_sets, check_screening_settings
+
+    check_screening_settings(settings)
+    t0 = time.perf_counter()
+    compile_kernels()
+    print(f"kernels: {time.perf_counter() - t0:.3f} s")
+
+    t0 = time.perf_counter()
+    file_contents = open_file(settings)
+    print(f"open file: {time.perf_counter() - t0:.3f} s")
+
+    stage_names = ['read grid', 'topology', 'matrices', 'sets', 'IF']
+    print(f"{'country':<10}" + ''.join(f"{name:>12}" for name in stage_names))
+    for country in get_countries(settings):
+        timings = []
+        for _ in range(repeat):
+            t = [time.perf_counter()]
+            branches, generators, nodes = read_grid(file_contents, settings)
+            t.append(time.perf_counter())
+            branches, nodes, _ = create_and_preprocess_topology(branches, generators, nodes,
+                                                                country, settings)
+            t.append(time.perf_counter())
+            _, PTDF, LODF, PATL = create_country_matrices(branches, nodes, country, settings)
+            t.append(time.perf_counter())
+            setI, setT, setR, _ = create_screened_sets(branches, generators, LODF, PATL, PTDF, country,
+                                                       settings)
+            t.append(time.perf_counter())
+            compute_IFs(setI, setT, setR, LODF, PATL, PTDF)
+            t.append(time.perf_counter())
+            timings.append([t[k + 1] - t[k] for k in range(len(stage_names))])
+        fastest = min(timings, key=sum)
+        print(f"{country:<10}" + ''.join(f"{duration:>12.3f}" for duration in fastest))
+
+
+def cli(argv=None):
+    args = create_parser().parse_args(argv)
+    if args.command == 'settings':
+        list_settings()
+        return
+    if args.command == 'synthetic':
+        write_synthetic_grid(args)
+        return
+
+    settings = get_settings_from_args(args)
+    if args.command == 'topology':
+        store_topologies(settings)
+    elif args.command == 'sets':
+        determine_sets(settings)
+    elif args.command == 'run':
+        from project_code.main import main
+        main(settings)
+    elif args.command == 'bench':
+        bench(settings, args.repeat)
+    elif args.command == 'serve':
+        from project_code.influence_service import serve
+        serve(settings, args.host, args.port)
+    elif args.command == 'batch':
+        from project_code.batch import run_batch
+        print(run_batch(settings, args.pattern, args.memory_budget))
+
+
+if __name__ == '__main__':
+    cli(sys.argv[1:])
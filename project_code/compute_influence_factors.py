@@ -1,93 +1,461 @@
 from numba import jit
 import time
+from project_code.matrix_and_set_functions import create_PATL_sub_matrix
 from project_code.misc_functions import sub_matrix, combine_sets
-from project_code.classes import Result_IF, Result_IF_generators
+from project_code.instrumentation import report_stage, set_counter, increment_counter
+from project_code.store_functions import append_pair_maxima_hdf5
+from project_code.classes import BranchSet, Result_IF, Result_IF_bound, Result_IF_generators, \
+    Result_IF_witnesses, Result_relevance
 import numpy as np
 import logging
 
 
-def compute_IFs(branches, setI, setT, setR, LODF, PATL, PTDF):
-    t0 = time.clock()
+# Maximum number of external contingencies assessed in one kernel launch, to bound the memory of
+# the (I * R) result matrices.
+R_CHUNK_SIZE = 2048
+# Number of external elements recomputed with the full set I to verify the contingency screening.
+N_VERIFICATION_SAMPLES = 50
+# Number of countries stored per int64 word of the bitsets of the multi-country sweep.
+MASK_BITS_PER_WORD = 63
+
+# Signatures of the numba kernels. The kernels are compiled lazily and cached on disk next to this
+# module (cache=True), so only the first run after a change of this file pays the LLVM compilation;
+# compile_kernels() loads or compiles them upfront for these signatures. The arrays are declared
+# C-contiguous, as the callers build them: an array of another layout would compile a second
+# specialization of the kernel on its first call.
+SIGNATURE_PUSH_BOUNDED_HEAP = 'void(float64[::1], int32[::1], int32[::1], float64, int64, int64)'
+SIGNATURE_COMPUTE_RELEVANCE_CPU = (
+    'void(int32[::1], float64[::1], float64[::1], float64[:, ::1], float64[:, ::1], float64[:, ::1], '
+    'float64[:, ::1], int32[::1], int32[::1], int32[::1], float64[:, ::1], float64, boolean[::1], '
+    'int32[::1], int32[::1])')
+SIGNATURE_COMPUTE_IF_CPU = (
+    'void(int32[::1], float64[::1], float64[::1], float64[:, ::1], float64[:, ::1], float64[:, ::1], '
+    'float64[:, ::1], int32[:, ::1], float64[:, ::1], int32[::1], int32[::1], int32[::1], '
+    'float64[:, :, ::1], float64[:, :, ::1], int32[:, :, ::1], float64[:, :, ::1], float64[:, ::1], '
+    'int32[:, ::1], int32[:, ::1], float64[:, ::1], int32[:, ::1], int32[:, ::1])')
+SIGNATURE_COMPUTE_IF_MULTI_COUNTRY_CPU = (
+    'void(int32[::1], float64[::1], float64[::1], float64[:, ::1], float64[:, ::1], float64[:, ::1], '
+    'float64[:, ::1], int64[::1], int64[::1], int64[::1], float64[:, ::1], int64[:, ::1], int64[:, ::1], '
+    'int32[::1], float64[:, ::1], int32[:, ::1], int32[:, ::1], float64[:, ::1], int32[:, ::1], '
+    'int32[:, ::1], float64[:, ::1])')
+SIGNATURE_GET_MAX_RESULTS = (
+    'void(int32[:, ::1], float64[:, ::1], int32[:, ::1], float64[:, ::1], float64[:, ::1], int32[::1], '
+    'int32[::1], int32[::1], int32[::1], float64[::1], float64[::1], float64[::1])')
+
+
+@report_stage
+def compute_IFs(setI, setT, setR, LODF, PATL, PTDF, relevance_threshold=None, n_top_witnesses=0,
+                ratings=None, pair_maxima_file=None):
+    """Computes the IF of all elements of setR. If relevance_threshold is set, rings are computed
+    in increasing order and the computation stops as soon as an upper bound shows that no element
+    of the remaining rings can reach the threshold. Returns the results and the elements left
+    below threshold, with their bounds. If n_top_witnesses is above 0, each result also holds the
+    n_top_witnesses largest (IF, i, t) combinations for both metrics. If ratings (rating sets *
+    branches) are given, the normalized IFs for each rating set are computed in the same sweep
+    and attached to each result as rating_results. If pair_maxima_file (see
+    create_pair_maxima_hdf5) is given, the maxima over T of each (i, r) pair are appended to it
+    after each chunk of R."""
+    t0 = time.perf_counter()
+
+    # R is ordered by ring once, rings are then only used to label the results.
+    setR = BranchSet([setR[pos] for pos in np.argsort(setR.rings, kind='stable')])
+    rings, ring_start, n_per_ring = np.unique(setR.rings, return_index=True, return_counts=True)
+    for ring, n_in_ring in zip(rings, n_per_ring):
+        logging.info(f"Assessing IF for ring # {ring} with {n_in_ring} elements.")
+
+    # Invariants of I and T, shared by all elements of R.
+    vPTDF_I = np.array([i.PTDF for i in setI])
+    mxPTDF_IT = sub_matrix(setI, setT, PTDF)
+    set_TI = combine_sets(setT, setI)
+
+    if relevance_threshold is None:
+        sections = [(0, len(setR))]
+    else:
+        sections = list(zip(ring_start, ring_start + n_per_ring))
+        # Bounds are computed once per element; the largest bound of the elements from each
+        # position onwards tells whether the remaining rings can still reach the threshold.
+        IF_bound, norm_IF_bound = compute_IF_bounds(setI, setT, setR, vPTDF_I, mxPTDF_IT, PATL,
+                                                    PTDF, ratings)
+        remaining_bound = np.maximum.accumulate(np.maximum(IF_bound, norm_IF_bound)[::-1])[::-1]
 
     results = []
-
+    results_below_threshold = []
+    for (section_start, section_end) in sections:
+        if relevance_threshold is not None and remaining_bound[section_start] < relevance_threshold:
+            results_below_threshold = [Result_IF_bound(setR[idx], IF_bound[idx], norm_IF_bound[idx])
+                                       for idx in range(section_start, len(setR))]
+            logging.info(f"No element from ring # {setR[section_start].ring} onwards can reach "
+                         f"the threshold {relevance_threshold}: {len(setR) - section_start} "
+                         f"elements reported below threshold without computation.")
+            break
+
+        for chunk_start in range(section_start, section_end, R_CHUNK_SIZE):
+            setR_chunk = BranchSet(setR[chunk_start:min(chunk_start + R_CHUNK_SIZE, section_end)])
+            results.extend(compute_IFs_for_chunk(setI, setT, setR_chunk, vPTDF_I, mxPTDF_IT,
+                                                 set_TI, LODF, PATL, PTDF, n_top_witnesses,
+                                                 ratings, pair_maxima_file))
+
+    set_counter('size_R_computed', len(results))
+    set_counter('size_R_below_threshold', len(results_below_threshold))
+    logging.info("IF computed in " + str(round(time.perf_counter() - t0, 1)) + " seconds.")
+    return results, results_below_threshold
+
+
+@report_stage
+def compute_IFs_multi_country(sets_per_country, LODF, PATL, PTDF):
+    """Computes the IFs of several countries in a single sweep. sets_per_country maps each country
+    to its (setI, setT, setR). Each (i, r) pair of the union of the sets of R and I is assessed
+    once, for the countries it belongs to according to bitsets, and the maximum over t is reduced
+    per country on its own partition of T. Returns the results per country, as compute_IFs."""
+    t0 = time.perf_counter()
+
+    countries = list(sets_per_country)
+    setsI, setsT, setsR = zip(*sets_per_country.values())
+    setI = get_union_of_branch_sets(setsI)
+    setR = get_union_of_branch_sets(setsR)
+    # T is partitioned per country, tie lines appear in the partition of both countries
+    setT = BranchSet([t for set_t in setsT for t in set_t])
+    T_start = np.cumsum([0] + [len(set_t) for set_t in setsT]).astype(np.int32)
+    mask_I = create_country_masks(setI, setsI)
+    mask_R = create_country_masks(setR, setsR)
+    logging.info(f"Multi-country sweep for {len(countries)} countries: {len(setR)} elements in R, "
+                 f"{len(setI)} in I and {len(setT)} in T.")
+
+    vPTDF_I = np.array([i.PTDF for i in setI])
+    mxPTDF_IT = sub_matrix(setI, setT, PTDF)
+
+    sizeC = len(countries)
+    res_IF_max = np.zeros((sizeC, len(setR)))
+    res_norm_IF_max = np.zeros((sizeC, len(setR)))
+    res_norm_IF_non_norm_max = np.zeros((sizeC, len(setR)))
+    # Without any IF above 0, the first elements of I and T of the country are reported
+    first_I = np.array([setI.indices.searchsorted(set_i.indices[0]) if len(set_i) > 0 else 0
+                        for set_i in setsI], dtype=np.int32)
+    res_I_max = np.repeat(first_I[:, np.newaxis], len(setR), axis=1)
+    res_norm_I_max = res_I_max.copy()
+    res_T_max = np.repeat(T_start[:-1, np.newaxis], len(setR), axis=1)
+    res_norm_T_max = res_T_max.copy()
+
+    for chunk_start in range(0, len(setR), R_CHUNK_SIZE):
+        chunk = slice(chunk_start, chunk_start + R_CHUNK_SIZE)
+        setR_chunk = BranchSet(setR[chunk])
+        set_size_RIT = np.array([len(setR_chunk), len(setI), len(setT)], dtype=np.int32)
+        increment_counter('kernel_IR_pairs', len(setI) * len(setR_chunk))
+        # the (countries * R) results of the chunk are copied to C-contiguous arrays for the kernel
+        res_chunk = [np.ascontiguousarray(res[:, chunk]) for res in
+                     [res_IF_max, res_I_max, res_T_max, res_norm_IF_max, res_norm_I_max, res_norm_T_max,
+                      res_norm_IF_non_norm_max]]
+        compute_IF_multi_country_CPU(set_size_RIT, vPTDF_I, np.array([r.PTDF for r in setR_chunk]),
+                                     sub_matrix(setI, setR_chunk, PTDF), mxPTDF_IT,
+                                     sub_matrix(setR_chunk, setI, PTDF),
+                                     sub_matrix(setR_chunk, setT, PTDF), setI.indices,
+                                     setR_chunk.indices, setT.indices,
+                                     sub_matrix(setR_chunk, setT, PATL), mask_R[chunk], mask_I,
+                                     T_start, *res_chunk)
+        for res, res_of_chunk in zip([res_IF_max, res_I_max, res_T_max, res_norm_IF_max, res_norm_I_max,
+                                      res_norm_T_max, res_norm_IF_non_norm_max], res_chunk):
+            res[:, chunk] = res_of_chunk
+
+    results_per_country = {}
+    for c, country in enumerate(countries):
+        set_t = setsT[c]
+        set_r = BranchSet([setsR[c][pos] for pos in np.argsort(setsR[c].rings, kind='stable')])
+        results = []
+        for r, idx in zip(set_r, set_r.get_positions_in(setR)):
+            LODF_tr = np.absolute(LODF[set_t.indices, r.index])
+            i = setI[res_I_max[c, idx]]
+            t = setT[res_T_max[c, idx]]
+            i_norm = setI[res_norm_I_max[c, idx]]
+            t_norm = setT[res_norm_T_max[c, idx]]
+            results.append(Result_IF(r, max(LODF_tr), max(LODF_tr * PATL[set_t.indices, r.index]),
+                                     res_IF_max[c, idx], res_norm_IF_max[c, idx], i, t, i_norm,
+                                     t_norm, LODF[t_norm.index, i_norm.index],
+                                     LODF[r.index, i_norm.index]))
+        results_per_country[country] = results
+
+    logging.info(f"IF computed for {len(countries)} countries in {round(time.perf_counter() - t0, 1)} "
+                 f"seconds.")
+    return results_per_country
+
+
+def get_union_of_branch_sets(branch_sets):
+    branches = {branch.index: branch for branch_set in branch_sets for branch in branch_set}
+    return BranchSet([branches[idx] for idx in sorted(branches)])
+
+
+def create_country_masks(union_set, branch_sets):
+    """Bitsets (elements of union_set * words) of the branch sets each element belongs to."""
+    masks = np.zeros((len(union_set), len(branch_sets) // MASK_BITS_PER_WORD + 1), dtype=np.int64)
+    for c, branch_set in enumerate(branch_sets):
+        positions = branch_set.get_positions_in(union_set)
+        masks[positions, c // MASK_BITS_PER_WORD] |= np.int64(1) << (c % MASK_BITS_PER_WORD)
+    return masks
+
+
+def compute_IF_bounds(setI, setT, setR, vPTDF_I, mxPTDF_IT, PATL, PTDF, ratings=None):
+    """Upper bounds of the N-2 IF and normalized IF of each element r of setR, using the maximum
+    over t of each term of the numerator in compute_IF_CPU:
+    |IF_irt| <= (max_t |PTDF_it| * |PTDF_ri| + |1 - PTDF_i| * max_t |PTDF_rt|) / |denominator_ir|
+    This costs O(I * R) instead of O(I * R * T), computed in chunks of R_CHUNK_SIZE elements of R.
+    Pairs skipped by compute_IF_CPU are skipped too. The normalized bound holds for all rating
+    sets."""
+    max_PTDF_IT = np.absolute(mxPTDF_IT).max(axis=0, initial=0.0)
+    IF_bound = np.zeros(len(setR))
+    norm_IF_bound = np.zeros(len(setR))
+    for chunk_start in range(0, len(setR), R_CHUNK_SIZE):
+        chunk = slice(chunk_start, chunk_start + R_CHUNK_SIZE)
+        IF_bound[chunk], norm_IF_bound[chunk] = compute_IF_bounds_for_chunk(
+            setI, setT, BranchSet(setR[chunk]), vPTDF_I, max_PTDF_IT, PATL, PTDF, ratings)
+    return IF_bound, norm_IF_bound
+
+
+def compute_IF_bounds_for_chunk(setI, setT, setR, vPTDF_I, max_PTDF_IT, PATL, PTDF, ratings=None):
+    epsilon = 0.00001
+    vPTDF_R = np.array([r.PTDF for r in setR])
+    mxPTDF_IR = sub_matrix(setI, setR, PTDF)
+    mxPTDF_RI = sub_matrix(setR, setI, PTDF)
+    mxPTDF_RT = np.absolute(sub_matrix(setR, setT, PTDF))
+    mxPATL_RT = get_PATL_sub_matrices(setR, setT, PATL, ratings).max(axis=0)
+
+    denominator = np.absolute(np.outer(1 - vPTDF_I, 1 - vPTDF_R) - mxPTDF_IR.T * mxPTDF_RI)
+    outage_term = max_PTDF_IT[:, np.newaxis] * np.absolute(mxPTDF_RI)
+    transfer_term = np.absolute(1 - vPTDF_I)[:, np.newaxis]
+    is_computed = denominator > epsilon
+    set_IR = combine_sets(setI, setR)
+    is_computed[np.flatnonzero(set_IR >= 0), set_IR[set_IR >= 0]] = False
+
+    IF_bound = np.zeros(denominator.shape)
+    norm_IF_bound = np.zeros(denominator.shape)
+    np.divide(outage_term + transfer_term * mxPTDF_RT.max(axis=0, initial=0.0), denominator,
+              out=IF_bound, where=is_computed)
+    np.divide(outage_term * mxPATL_RT.max(axis=0, initial=0.0) +
+              transfer_term * (mxPTDF_RT * mxPATL_RT).max(axis=0, initial=0.0), denominator,
+              out=norm_IF_bound, where=is_computed)
+    return IF_bound.max(axis=0, initial=0.0), norm_IF_bound.max(axis=0, initial=0.0)
+
+
+def compute_IFs_for_chunk(setI, setT, setR, vPTDF_I, mxPTDF_IT, set_TI, LODF, PATL, PTDF,
+                          n_top_witnesses=0, ratings=None, pair_maxima_file=None):
     sizeI = len(setI)
-    sizeT = len(setT)
-
-    current_ring = 1
-    setR_this_ring = [branch for branch in setR if branch.ring == current_ring]
-    while len(setR_this_ring) > 0:
-        sizeR = len(setR_this_ring)
-        logging.info(f"Assessing IF for ring # {current_ring} with {sizeR} elements.")
-
-        set_size_RIT = np.array([sizeR, sizeI, sizeT], dtype=np.int32)
-        vPTDF_I = [i.PTDF for i in setI]
-        vPTDF_R = [r.PTDF for r in setR_this_ring]
-        mxPTDF_IR = sub_matrix(setI, setR_this_ring, PTDF)
-        mxPTDF_IT = sub_matrix(setI, setT, PTDF)
-        mxPTDF_RI = sub_matrix(setR_this_ring, setI, PTDF)
-        mxPTDF_RT = sub_matrix(setR_this_ring, setT, PTDF)
-
-        res_T = np.zeros((sizeI, sizeR), dtype=np.int32)  # Most influenced t element in N-i-r
-        res_IF = np.zeros((sizeI, sizeR))  # IF of the most influenced t element in N-i-r situation
-        set_IR = combine_sets(setI, setR_this_ring)  # elms i in R set to avoid i = r situation
-        set_RT = combine_sets(setR_this_ring, setT)  # elms r in T set to avoid r = t situation
-        set_TI = combine_sets(setT, setI)
-        mxPATL_RT = sub_matrix(setR_this_ring, setT, PATL)
-
-        res_norm_T = np.zeros((sizeI, sizeR), dtype=np.int32)  # same but normalized
-        res_norm_IF = np.zeros((sizeI, sizeR))  # same but normalized
-        res_norm_IF_non_norm = np.zeros((sizeI, sizeR))
-        res_T_max = np.zeros(sizeR, dtype=np.int32)  # most influenced t element
-        res_norm_T_max = np.zeros(sizeR, dtype=np.int32)  # same but normalized
-        res_I_max = np.zeros(sizeR, dtype=np.int32)
-        res_norm_I_max = np.zeros(sizeR, dtype=np.int32)
-        res_IF_max = np.zeros(sizeR)
-        res_norm_IF_max = np.zeros(sizeR)
-        res_norm_IF_non_norm_max = np.zeros(sizeR)
-
-        LODF_RT = sub_matrix(setR_this_ring, setT, LODF)
-        LODFn_RT = LODF_RT * sub_matrix(setR_this_ring, setT, PATL)
-
-        compute_IF_CPU(set_size_RIT,
-                       vPTDF_I, vPTDF_R, mxPTDF_IR, mxPTDF_IT, mxPTDF_RI, mxPTDF_RT,
-                       res_T, res_IF, set_IR, set_RT, set_TI,
-                       mxPATL_RT, res_norm_IF, res_norm_T, res_norm_IF_non_norm)
-
-        get_max_results(res_T, res_IF, res_norm_T, res_norm_IF, res_norm_IF_non_norm,
-                        res_T_max, res_norm_T_max, res_I_max, res_norm_I_max, res_IF_max,
-                        res_norm_IF_max, res_norm_IF_non_norm_max)
-
-        for idx in range(len(setR_this_ring)):
-            # Template : "name,N-1 IF, N-1 nIF,IF,i,t,nIF,i,t,NNnIF"
-            r = setR_this_ring[idx]
-            IF_1 = max(np.absolute(LODF_RT[:, idx]))
-            norm_IF_1 = max(np.absolute(LODFn_RT[:, idx]))
-            IF_2 = res_IF_max[idx]
-            norm_IF_2 = res_norm_IF_max[idx]
-            i = setI[res_I_max[idx]]
-            t = setT[res_T_max[idx]]
-            i_norm = setI[res_norm_I_max[idx]]
-            t_norm = setT[res_norm_T_max[idx]]
+    sizeR = len(setR)
+    set_size_RIT = np.array([sizeR, sizeI, len(setT)], dtype=np.int32)
+    increment_counter('kernel_IR_pairs', sizeI * sizeR)
+    increment_counter('kernel_IRT_combinations', sizeI * sizeR * len(setT))
+
+    vPTDF_R = np.array([r.PTDF for r in setR])
+    mxPTDF_IR = sub_matrix(setI, setR, PTDF)
+    mxPTDF_RI = sub_matrix(setR, setI, PTDF)
+    mxPTDF_RT = sub_matrix(setR, setT, PTDF)
+    mxPATL_RT = get_PATL_sub_matrices(setR, setT, PATL, ratings)
+    sizeS = mxPATL_RT.shape[0]  # number of rating sets
+    set_IR = combine_sets(setI, setR)  # elms i in R set to avoid i = r situation
+    set_RT = combine_sets(setR, setT)  # elms r in T set to avoid r = t situation
+
+    res_T = np.zeros((sizeI, sizeR), dtype=np.int32)  # Most influenced t element in N-i-r
+    res_IF = np.zeros((sizeI, sizeR))  # IF of the most influenced t element in N-i-r situation
+    res_norm_T = np.zeros((sizeS, sizeI, sizeR), dtype=np.int32)  # same but normalized, per set
+    res_norm_IF = np.zeros((sizeS, sizeI, sizeR))  # same but normalized, per rating set
+    res_norm_IF_non_norm = np.zeros((sizeS, sizeI, sizeR))
+    res_T_max = np.zeros(sizeR, dtype=np.int32)  # most influenced t element
+    res_norm_T_max = np.zeros((sizeS, sizeR), dtype=np.int32)  # same but normalized
+    res_I_max = np.zeros(sizeR, dtype=np.int32)
+    res_norm_I_max = np.zeros((sizeS, sizeR), dtype=np.int32)
+    res_IF_max = np.zeros(sizeR)
+    res_norm_IF_max = np.zeros((sizeS, sizeR))
+    res_norm_IF_non_norm_max = np.zeros((sizeS, sizeR))
+    # Bounded min-heaps of the largest (IF, i, t) combinations per r, for both metrics
+    top_IF = -1 * np.ones((sizeR, n_top_witnesses))
+    top_I = np.zeros((sizeR, n_top_witnesses), dtype=np.int32)
+    top_T = np.zeros((sizeR, n_top_witnesses), dtype=np.int32)
+    top_norm_IF = -1 * np.ones((sizeR, n_top_witnesses))
+    top_norm_I = np.zeros((sizeR, n_top_witnesses), dtype=np.int32)
+    top_norm_T = np.zeros((sizeR, n_top_witnesses), dtype=np.int32)
+
+    LODF_RT = sub_matrix(setR, setT, LODF)
+
+    compute_IF_CPU(set_size_RIT,
+                   vPTDF_I, vPTDF_R, mxPTDF_IR, mxPTDF_IT, mxPTDF_RI, mxPTDF_RT,
+                   res_T, res_IF, set_IR, set_RT, set_TI,
+                   mxPATL_RT, res_norm_IF, res_norm_T, res_norm_IF_non_norm,
+                   top_IF, top_I, top_T, top_norm_IF, top_norm_I, top_norm_T)
+    if pair_maxima_file is not None:
+        append_pair_maxima_hdf5(pair_maxima_file, setR, setT, res_IF, res_T, res_norm_IF[0],
+                                res_norm_T[0])
+
+    for s in range(sizeS):
+        get_max_results(res_T, res_IF, res_norm_T[s], res_norm_IF[s], res_norm_IF_non_norm[s],
+                        res_T_max, res_norm_T_max[s], res_I_max, res_norm_I_max[s], res_IF_max,
+                        res_norm_IF_max[s], res_norm_IF_non_norm_max[s])
+
+    results = []
+    for idx in range(sizeR):
+        # Template : "name,N-1 IF, N-1 nIF,IF,i,t,nIF,i,t,NNnIF"
+        r = setR[idx]
+        IF_1 = max(np.absolute(LODF_RT[:, idx]))
+        IF_2 = res_IF_max[idx]
+        i = setI[res_I_max[idx]]
+        t = setT[res_T_max[idx]]
+        results_per_set = []
+        for s in range(sizeS):
+            norm_IF_1 = max(np.absolute(LODF_RT[:, idx] * mxPATL_RT[s, :, idx]))
+            norm_IF_2 = res_norm_IF_max[s, idx]
+            i_norm = setI[res_norm_I_max[s, idx]]
+            t_norm = setT[res_norm_T_max[s, idx]]
             LODF_it = LODF[t_norm.index, i_norm.index]
             LODF_ir = LODF[r.index, i_norm.index]
-            results.append(Result_IF(r, IF_1, norm_IF_1, IF_2, norm_IF_2,
-                                     i, t, i_norm, t_norm, LODF_it, LODF_ir))
-        current_ring += 1
-        setR_this_ring = [elt for elt in branches if elt.ring == current_ring]
+            rating = None if s == 0 else ratings[s - 1]
+            results_per_set.append(Result_IF(r, IF_1, norm_IF_1, IF_2, norm_IF_2,
+                                             i, t, i_norm, t_norm, LODF_it, LODF_ir,
+                                             rating=rating))
+        result = results_per_set[0]
+        result.rating_results = results_per_set[1:]
+        if n_top_witnesses > 0:
+            result.witnesses = Result_IF_witnesses(r, *get_witnesses(top_IF[idx], top_I[idx],
+                                                                     top_T[idx], setI, setT),
+                                                   *get_witnesses(top_norm_IF[idx],
+                                                                  top_norm_I[idx],
+                                                                  top_norm_T[idx], setI, setT))
+        results.append(result)
+    return results
+
 
-    logging.info("IF computed in " + str(round(time.clock() - t0, 1)) + " seconds.")
+def get_PATL_sub_matrices(setR, setT, PATL, ratings=None):
+    """Normalization blocks (T * R) stacked per rating set: first the PATL of the input file,
+    then one per row of ratings."""
+    mxPATL_RT = [sub_matrix(setR, setT, PATL)]
+    if ratings is not None:
+        mxPATL_RT.extend(create_PATL_sub_matrix(rating, setR, setT) for rating in ratings)
+    return np.stack(mxPATL_RT)
+
+
+def get_witnesses(heap_IF, heap_I, heap_T, setI, setT):
+    """Sorts a heap of (IF, i, t) combinations by decreasing IF, without unused entries."""
+    order = [pos for pos in np.argsort(-heap_IF, kind='stable') if heap_IF[pos] >= 0]
+    return ([heap_IF[pos] for pos in order], [setI[heap_I[pos]] for pos in order],
+            [setT[heap_T[pos]] for pos in order])
+
+
+@report_stage
+def verify_contingency_screening(setI, screened_setI, setT, setR, LODF, PATL, PTDF,
+                                 n_samples=N_VERIFICATION_SAMPLES):
+    """Recomputes the IF of a random sample of setR with the full and the screened set I and
+    returns the maximum error on the non-normalized and normalized IF."""
+    t0 = time.perf_counter()
+
+    rng = np.random.default_rng(0)
+    sample = np.sort(rng.choice(len(setR), size=min(n_samples, len(setR)), replace=False))
+    setR_sample = BranchSet([setR[pos] for pos in sample])
+
+    max_IFs = []
+    for set_i in [setI, screened_setI]:
+        results = compute_IFs_for_chunk(set_i, setT, setR_sample, np.array([i.PTDF for i in set_i]),
+                                        sub_matrix(set_i, setT, PTDF), combine_sets(setT, set_i),
+                                        LODF, PATL, PTDF)
+        max_IFs.append(np.array([[res.IFN2, res.nIFN2] for res in results]).reshape(-1, 2))
+    errors = max_IFs[0] - max_IFs[1]
+    max_IF_error, max_norm_IF_error = errors.max(axis=0, initial=0.0)
+
+    logging.info(f"Contingency screening verified on {len(setR_sample)} external elements: maximum "
+                 f"IF error {round(max_IF_error, 5)}, maximum normalized IF error "
+                 f"{round(max_norm_IF_error, 5)}, in {round(time.perf_counter() - t0, 1)} seconds.")
+    return max_IF_error, max_norm_IF_error
+
+
+# Function defined to replace the smallest element of a bounded min-heap of (value, i, t)
+@jit(nopython=True, cache=True)
+def push_bounded_heap(heap_values, heap_I, heap_T, value, i, t):
+    size = heap_values.shape[0]
+    pos = 0
+    while True:
+        child = 2 * pos + 1
+        if child >= size:
+            break
+        if child + 1 < size and heap_values[child + 1] < heap_values[child]:
+            child += 1
+        if heap_values[child] >= value:
+            break
+        heap_values[pos] = heap_values[child]
+        heap_I[pos] = heap_I[child]
+        heap_T[pos] = heap_T[child]
+        pos = child
+    heap_values[pos] = value
+    heap_I[pos] = i
+    heap_T[pos] = t
+
+
+@report_stage
+def compute_relevance(setI, setT, setR, PATL, PTDF, relevance_threshold, ratings=None):
+    """Determines for each element of setR whether its IF or normalized IF exceeds
+    relevance_threshold, with the first (i, t) combination found above the threshold. With rating
+    sets, the normalized IF may exceed the threshold for any of them."""
+    t0 = time.perf_counter()
+
+    sizeR = len(setR)
+    set_size_RIT = np.array([sizeR, len(setI), len(setT)], dtype=np.int32)
+    increment_counter('kernel_IR_pairs', sizeR * len(setI))
+    res_relevant = np.zeros(sizeR, dtype=np.bool_)
+    res_I = -1 * np.ones(sizeR, dtype=np.int32)
+    res_T = -1 * np.ones(sizeR, dtype=np.int32)
+
+    compute_relevance_CPU(set_size_RIT, np.array([i.PTDF for i in setI]),
+                          np.array([r.PTDF for r in setR]), sub_matrix(setI, setR, PTDF),
+                          sub_matrix(setI, setT, PTDF), sub_matrix(setR, setI, PTDF),
+                          sub_matrix(setR, setT, PTDF), combine_sets(setI, setR),
+                          combine_sets(setR, setT), combine_sets(setT, setI),
+                          get_PATL_sub_matrices(setR, setT, PATL, ratings).max(axis=0),
+                          relevance_threshold,
+                          res_relevant, res_I, res_T)
+
+    results = []
+    for idx, r in enumerate(setR):
+        if res_relevant[idx]:
+            results.append(Result_relevance(r, True, setI[res_I[idx]], setT[res_T[idx]]))
+        else:
+            results.append(Result_relevance(r, False, None, None))
+
+    logging.info(f"Relevance determined in {round(time.perf_counter() - t0, 1)} seconds: "
+                 f"{int(res_relevant.sum())}/{sizeR} elements above {relevance_threshold}.")
     return results
 
 
+# Function defined to determine relevance for a threshold on CPU, leaving the loops over i and t
+# for an element r as soon as one combination exceeds the threshold
+@jit(nopython=True, cache=True, nogil=True)
+def compute_relevance_CPU(set_size_RIT, vPTDF_I, vPTDF_R, mxPTDF_IR, mxPTDF_IT, mxPTDF_RI,
+                          mxPTDF_RT, set_IR, set_RT, set_TI, mxPATL_RT, threshold, res_relevant,
+                          res_I, res_T):
+    epsilon = 0.00001
+    for r in range(set_size_RIT[0]):
+        for i in range(set_size_RIT[1]):
+            PTDF_ir = mxPTDF_IR[r, i]
+            PTDF_ri = mxPTDF_RI[i, r]
+            PTDF_i = vPTDF_I[i]
+            PTDF_r = vPTDF_R[r]
+
+            denominator = (1 - PTDF_i) * (1 - PTDF_r) - PTDF_ir * PTDF_ri
+
+            if abs(denominator) > epsilon and set_IR[i] != r:
+                for t in range(set_size_RIT[2]):
+                    if set_RT[r] != t and set_TI[t] != i:
+                        numerator = mxPTDF_IT[t, i] * PTDF_ri + (1 - PTDF_i) * mxPTDF_RT[t, r]
+                        IF = abs(numerator / denominator)
+                        if IF > threshold or mxPATL_RT[t, r] * IF > threshold:
+                            res_relevant[r] = True
+                            res_I[r] = i
+                            res_T[r] = t
+                            break
+            if res_relevant[r]:
+                break
+
+
 # Function defined to compute N-2 IF on CPU
-@jit('void(int32[:], float64[:], float64[:], float64[:,:], float64[:,:], float64[:,:], float64[:,'
-     ':], int32[:,:], float64[:,:], int32[:], int32[:], int32[:], float64[:], float64[:], '
-     'int32[:], float64[:,:])')
+@jit(nopython=True, cache=True, nogil=True)
 def compute_IF_CPU(set_size_RIT, vPTDF_I, vPTDF_R, mxPTDF_IR, mxPTDF_IT, mxPTDF_RI, mxPTDF_RT,
                    res_T, res_IF, set_IR, set_RT, set_TI, mxPATL_RT, res_norm_IF, res_norm_T,
-                   res_norm_IF_non_norm):
+                   res_norm_IF_non_norm, top_IF, top_I, top_T, top_norm_IF, top_norm_I,
+                   top_norm_T):
     epsilon = 0.00001
+    keep_witnesses = top_IF.shape[1] > 0
     for (r, i) in np.ndindex((set_size_RIT[0], set_size_RIT[1])):
         PTDF_ir = mxPTDF_IR[r, i]
         PTDF_ri = mxPTDF_RI[i, r]
@@ -101,7 +469,6 @@ def compute_IF_CPU(set_size_RIT, vPTDF_I, vPTDF_R, mxPTDF_IR, mxPTDF_IT, mxPTDF_
                 if set_IR[i] != r and set_RT[r] != t and set_TI[t] != i:
                     PTDF_it = mxPTDF_IT[t, i]
                     PTDF_rt = mxPTDF_RT[t, r]
-                    PATL_rt = mxPATL_RT[t, r]
 
                     numerator = PTDF_it * PTDF_ri + (1 - PTDF_i) * PTDF_rt
                     IF = numerator / denominator
@@ -109,17 +476,66 @@ def compute_IF_CPU(set_size_RIT, vPTDF_I, vPTDF_R, mxPTDF_IR, mxPTDF_IT, mxPTDF_
                     if abs(IF) > res_IF[i, r]:
                         res_IF[i, r] = abs(IF)
                         res_T[i, r] = t
-                    norm_IF = PATL_rt * abs(IF)
-                    if norm_IF > res_norm_IF[i, r]:
-                        res_norm_IF[i, r] = norm_IF
-                        res_norm_IF_non_norm[i, r] = abs(IF)
-                        res_norm_T[i, r] = t
+                    if keep_witnesses and abs(IF) > top_IF[r, 0]:
+                        push_bounded_heap(top_IF[r], top_I[r], top_T[r], abs(IF), i, t)
+                    # Normalized IF for each rating set, the first one being the input file PATL
+                    for s in range(mxPATL_RT.shape[0]):
+                        norm_IF = mxPATL_RT[s, t, r] * abs(IF)
+                        if norm_IF > res_norm_IF[s, i, r]:
+                            res_norm_IF[s, i, r] = norm_IF
+                            res_norm_IF_non_norm[s, i, r] = abs(IF)
+                            res_norm_T[s, i, r] = t
+                        if s == 0 and keep_witnesses and norm_IF > top_norm_IF[r, 0]:
+                            push_bounded_heap(top_norm_IF[r], top_norm_I[r], top_norm_T[r],
+                                              norm_IF, i, t)
+
+
+# Function defined to compute N-2 IF for several countries in a single sweep on CPU. Each (i, r)
+# pair is assessed for the countries whose R and I bitsets both contain it, on the partition of T
+# of each of these countries.
+@jit(nopython=True, cache=True, nogil=True)
+def compute_IF_multi_country_CPU(set_size_RIT, vPTDF_I, vPTDF_R, mxPTDF_IR, mxPTDF_IT, mxPTDF_RI,
+                                 mxPTDF_RT, idx_I, idx_R, idx_T, mxPATL_RT, mask_R, mask_I,
+                                 T_start, res_IF_max, res_I_max, res_T_max, res_norm_IF_max,
+                                 res_norm_I_max, res_norm_T_max, res_norm_IF_non_norm_max):
+    epsilon = 0.00001
+    bits_per_word = 63
+    n_countries = res_IF_max.shape[0]
+    for (r, i) in np.ndindex((set_size_RIT[0], set_size_RIT[1])):
+        if idx_I[i] == idx_R[r]:
+            continue
+        PTDF_ir = mxPTDF_IR[r, i]
+        PTDF_ri = mxPTDF_RI[i, r]
+        PTDF_i = vPTDF_I[i]
+        PTDF_r = vPTDF_R[r]
+
+        denominator = (1 - PTDF_i) * (1 - PTDF_r) - PTDF_ir * PTDF_ri
+
+        if abs(denominator) > epsilon:
+            for c in range(n_countries):
+                word = c // bits_per_word
+                bit = c % bits_per_word
+                if ((mask_R[r, word] & mask_I[i, word]) >> bit) & 1 == 0:
+                    continue
+                for t in range(T_start[c], T_start[c + 1]):
+                    if idx_T[t] != idx_R[r] and idx_T[t] != idx_I[i]:
+                        numerator = mxPTDF_IT[t, i] * PTDF_ri + (1 - PTDF_i) * mxPTDF_RT[t, r]
+                        IF = abs(numerator / denominator)
+
+                        if IF > res_IF_max[c, r]:
+                            res_IF_max[c, r] = IF
+                            res_I_max[c, r] = i
+                            res_T_max[c, r] = t
+                        norm_IF = mxPATL_RT[t, r] * IF
+                        if norm_IF > res_norm_IF_max[c, r]:
+                            res_norm_IF_max[c, r] = norm_IF
+                            res_norm_I_max[c, r] = i
+                            res_norm_T_max[c, r] = t
+                            res_norm_IF_non_norm_max[c, r] = IF
 
 
 # Function defined to get IF, t and i from 2-D matrices previously computed (CPU compiled)
-@jit(
-    'void(int32[:,:], float64[:,:], int32[:,:], float64[:,:], float64[:,:], int32[:], int32[:], '
-    'int32[:], int32[:], float64[:], float64[:], float64[:])')
+@jit(nopython=True, cache=True)
 def get_max_results(res_T, res_IF, res_norm_T, res_norm_IF, res_norm_IF_non_norm,
                     res_T_max, res_norm_T_max, res_I_max, res_norm_I_max, res_IF_max,
                     res_norm_IF_max, res_norm_IF_non_norm_max):
@@ -135,18 +551,32 @@ def get_max_results(res_T, res_IF, res_norm_T, res_norm_IF, res_norm_IF_non_norm
             res_norm_IF_non_norm_max[r] = res_norm_IF_non_norm[i, r]
 
 
-def compute_IFs_generators(branches, setT, setI, setR_gens, LODF, LODF_gens, PATL):
-    t0 = time.clock()
+@report_stage
+def compile_kernels():
+    """Loads the numba kernels from the on-disk cache, or compiles and caches them, for the
+    signatures used by the callers (C-contiguous arrays). Calling it upfront, e.g. in the parent process
+    before starting workers, keeps the compilation out of the timings of the first country."""
+    t0 = time.perf_counter()
+    for kernel, signature in [(push_bounded_heap, SIGNATURE_PUSH_BOUNDED_HEAP),
+                              (compute_relevance_CPU, SIGNATURE_COMPUTE_RELEVANCE_CPU),
+                              (compute_IF_CPU, SIGNATURE_COMPUTE_IF_CPU),
+                              (compute_IF_multi_country_CPU, SIGNATURE_COMPUTE_IF_MULTI_COUNTRY_CPU),
+                              (get_max_results, SIGNATURE_GET_MAX_RESULTS)]:
+        kernel.compile(signature)
+    logging.info(f"Numba kernels ready in {round(time.perf_counter() - t0, 1)} seconds.")
+
+
+@report_stage
+def compute_IFs_generators(branches, setT, setI, setR_gens, LODF, LODF_gens, PATL,
+                           generator_arrays):
+    t0 = time.perf_counter()
     logging.info("computing IF for generators")
+    set_counter('generator_IR_pairs', len(setR_gens) * len(setI))
 
-    LODF_gens_norm = LODF_gens * normalize_generators(branches, setR_gens)
-    list_LODF_gens = []
-    list_LODFnorm_gens = []
-    for t in setT:
-        list_LODF_gens.append(LODF_gens[t.index, :])
-        list_LODFnorm_gens.append(LODF_gens_norm[t.index, :])
-    mxLODF_gens_TR = np.array(list_LODF_gens)
-    mxLODFnorm_gens_TR = np.array(list_LODFnorm_gens)
+    idx_r = np.array([gen.index for gen in setR_gens], dtype=np.int64)
+    LODF_gens_norm = LODF_gens * normalize_generators(branches, generator_arrays.power[idx_r])
+    mxLODF_gens_TR = LODF_gens[setT.indices, :]
+    mxLODFnorm_gens_TR = LODF_gens_norm[setT.indices, :]
     mxLODF_TI = sub_matrix(setI, setT, LODF)
     mxPATL_TI = sub_matrix(setI, setT, PATL)
     mxLODFnorm_TI = mxLODF_TI * mxPATL_TI
@@ -193,18 +623,14 @@ def compute_IFs_generators(branches, setT, setI, setR_gens, LODF, LODF_gens, PAT
                                             IF_norm_r, IF_norm_r_branches_i,
                                             IF_norm_r_branches_t))
 
-    logging.info(f"IF determined for generators in {round(time.clock() - t0, 1)} seconds.")
+    logging.info(f"IF determined for generators in {round(time.perf_counter() - t0, 1)} seconds.")
     return results
 
 
-def normalize_generators(branches, setR_gens):
+def normalize_generators(branches, generator_power):
     PATL = np.array([branch.PATL for branch in branches])
 
-    generator_power = np.array([generator.power for generator in setR_gens])
-    list_norm_generators = []
-    for idx in range(len(PATL)):
-        if PATL[idx] > 0:
-            list_norm_generators.append(generator_power / PATL[idx])
-        else:
-            list_norm_generators.append(generator_power * 0)
-    return np.array(list_norm_generators)
+    norm_generators = np.zeros((len(PATL), len(generator_power)))
+    np.divide(generator_power[np.newaxis, :], PATL[:, np.newaxis], out=norm_generators,
+              where=PATL[:, np.newaxis] > 0)
+    return norm_generators
@@ -0,0 +1,387 @@
+"""Library API: an InfluenceCase holds the stages of the calculation for a grid, each computed on first
+access and kept, so that notebooks and services can reuse the topology, the system matrices, the sets
+and the results of earlier stages:
+
+    case = InfluenceCase.from_file('example.uct', countries=['A', 'B'])
+    case.lodf                 # reads the grid, builds the topology and the system matrices
+    case.sets('A')            # (I, T, R, R generators) of country A
+    case.influence('B')       # results of country B, computed once
+    case.what_if('B', opened=['<branch name>'])   # results of country B with a branch opened
+    next_case = case.update_from_file('example_next_hour.uct')   # next snapshot, reusing stages
+
+As in the multi-country sweep, the topology and the system matrices are shared by all countries, the
+slack node being the most connected node of the first country. Rings and sets are country specific:
+the rings of the branches are the ones of the country of the last call to sets or influence. Neither
+the sets nor the results are written to output_files, so a case does not overwrite the files of runs
+of main."""
+import collections
+import copy
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+
+from project_code.classes import BranchSet
+from project_code.main import open_file, read_grid, create_and_preprocess_topology, create_sets, \
+    check_shared_topology_settings
+from project_code.settings import SettingsEnum, get_settings
+from project_code.topology_functions import get_most_connected_node, reset_rings, assign_nodes_to_ring_0, \
+    assign_nodes_to_other_rings
+
+Topology = collections.namedtuple('Topology', 'branches nodes generators generator_arrays')
+SnapshotDiff = collections.namedtuple('SnapshotDiff', 'added removed impedances ratings')
+
+
+def diff_snapshots(branches, new_branches):
+    """Differences between the preprocessed branches of two snapshots of a grid, matched by name: names
+    of the added and removed branches, and {name: new value} of the changed impedances and PATL."""
+    branches_by_name = {branch.name_branch: branch for branch in branches}
+    new_branches_by_name = {branch.name_branch: branch for branch in new_branches}
+    kept = [(branches_by_name[name], branch) for name, branch in new_branches_by_name.items()
+            if name in branches_by_name]
+    return SnapshotDiff(added=[name for name in new_branches_by_name if name not in branches_by_name],
+                        removed=[name for name in branches_by_name if name not in new_branches_by_name],
+                        impedances={branch.name_branch: branch.impedance for old_branch, branch in kept
+                                    if branch.impedance != old_branch.impedance},
+                        ratings={branch.name_branch: branch.PATL for old_branch, branch in kept
+                                 if branch.PATL != old_branch.PATL})
+
+
+def remap_result(result, branches_by_name, scale=1.0):
+    """Copy of result on the branches of another snapshot, with the normalized IF multiplied by scale."""
+    result = copy.copy(result)
+    result.eltR = branches_by_name[result.eltR.name_branch]
+    result.eltI = branches_by_name[result.eltI.name_branch]
+    result.eltT = branches_by_name[result.eltT.name_branch]
+    result.eltIn = branches_by_name[result.eltIn.name_branch]
+    result.eltTn = branches_by_name[result.eltTn.name_branch]
+    result.nIFN1 *= scale
+    result.nIFN2 *= scale
+    return result
+
+
+def select_branches(matrix, indices):
+    """Rows and columns of indices of a branch * branch matrix, None if it is not computed."""
+    return None if matrix is None else matrix[np.ix_(indices, indices)]
+
+
+class InfluenceCase:
+    def __init__(self, settings):
+        """
+            Stages of the calculation for the grid of settings, computed on first access:
+            -topology: preprocessed branches, nodes, generators and generator arrays
+            -susceptance_factor: inverse susceptance matrix, without the slack node
+            -isf, ptdf, lodf, patl: system matrices
+            -sets(country), influence(country): sets and results of a country
+            what_if(country, opened, impedances) computes results for changed branches from these
+            stages, without keeping them
+            update_from_file(input_file_name) creates the case of another snapshot of the grid,
+            reusing these stages, snapshot_diff and snapshot_update then tell what was reused
+        """
+        check_shared_topology_settings(settings, 'an InfluenceCase')
+        self.settings = settings
+        self._topology = None
+        self._slack_node = None
+        self._susceptance_factor = None
+        self._isf = None
+        self._ptdf = None
+        self._lodf = None
+        self._patl = None
+        self._branches_by_name = None
+        self._rings = {}
+        self._sets = {}
+        self._influence = {}
+        self.snapshot_diff = None
+        self.snapshot_update = None
+
+    max_low_rank_share = 0.1  # share of nodes above which changed branches lead to a full rebuild
+
+    @classmethod
+    def from_file(cls, input_file_name, settings_name=None, countries=None):
+        """Case of a file of source_files, with the settings of settings_name (by default UCT0 for
+        .uct files and PSSE0 otherwise)."""
+        if settings_name is None:
+            settings_name = SettingsEnum.UCT0 if Path(input_file_name).suffix.lower() == '.uct' \
+                else SettingsEnum.PSSE0
+        settings = get_settings(settings_name)
+        settings.input_file_name = input_file_name
+        if countries is not None:
+            settings.countries = countries
+        return cls(settings)
+
+    @property
+    def countries(self):
+        """Countries of the settings connected to the grid of the first country."""
+        return [country for country in self.settings.countries
+                if country != 'XX' and get_most_connected_node(self.topology.nodes, country) is not None]
+
+    @property
+    def topology(self):
+        if self._topology is None:
+            branches, generators, nodes = read_grid(open_file(self.settings), self.settings)
+            country = next(country for country in self.settings.countries if country != 'XX')
+            branches, nodes, generator_arrays = create_and_preprocess_topology(
+                branches, generators, nodes, country, self.settings)
+            self._topology = Topology(branches, nodes, generators, generator_arrays)
+            self._slack_node = get_most_connected_node(nodes, country)
+            self._rings[country] = [branch.ring for branch in branches]
+        return self._topology
+
+    @property
+    def branches_by_name(self):
+        if self._branches_by_name is None:
+            self._branches_by_name = {branch.name_branch: branch for branch in self.topology.branches}
+        return self._branches_by_name
+
+    @property
+    def susceptance_factor(self):
+        from project_code.matrix_and_set_functions import create_inv_susceptance_matrix
+
+        if self._susceptance_factor is None:
+            self._susceptance_factor = create_inv_susceptance_matrix(
+                self.topology.branches, self.topology.nodes, self._slack_node)
+        return self._susceptance_factor
+
+    @property
+    def isf(self):
+        from project_code.matrix_and_set_functions import create_ISF_matrix
+        from project_code.network_reduction import reduce_network, create_ISF_matrix_from_reduced_network
+
+        if self._isf is None:
+            branches, nodes = self.topology.branches, self.topology.nodes
+            if self.settings.do_reduce_network:
+                self._isf = create_ISF_matrix_from_reduced_network(
+                    reduce_network(nodes, branches, self._slack_node))
+            else:
+                self._isf = create_ISF_matrix(branches, nodes, self.susceptance_factor,
+                                              self._slack_node)
+        return self._isf
+
+    @property
+    def ptdf(self):
+        from project_code.matrix_and_set_functions import create_PTDF_matrix, set_PTDF_on_branches
+
+        if self._ptdf is None:
+            self._ptdf = create_PTDF_matrix(self.topology.branches, self.isf)
+            set_PTDF_on_branches(self._ptdf, self.topology.branches, self.settings.eps)
+        return self._ptdf
+
+    @property
+    def lodf(self):
+        from project_code.matrix_and_set_functions import create_LODF_matrix
+
+        if self._lodf is None:
+            self._lodf = create_LODF_matrix(self.topology.branches, self.ptdf, self.settings.eps)
+        return self._lodf
+
+    @property
+    def patl(self):
+        from project_code.matrix_and_set_functions import create_PATL_matrix
+
+        if self._patl is None:
+            self._patl = create_PATL_matrix(self.topology.branches)
+        return self._patl
+
+    def set_rings(self, country):
+        """Sets the rings of the branches to the ones of country."""
+        branches, nodes = self.topology.branches, self.topology.nodes
+        if country not in self._rings:
+            if country == 'XX' or get_most_connected_node(nodes, country) is None:
+                raise ValueError(f"Country '{country}' is not connected to the grid, connected "
+                                 f"countries: {self.countries}.")
+            reset_rings(nodes, branches)
+            assign_nodes_to_ring_0(nodes, branches, country)
+            assign_nodes_to_other_rings(nodes)
+            self._rings[country] = [branch.ring for branch in branches]
+        for branch, ring in zip(branches, self._rings[country]):
+            branch.ring = ring
+
+    def sets(self, country):
+        """Sets (I, T, R, R generators) of country."""
+        self.set_rings(country)
+        if country not in self._sets:
+            self._sets[country] = create_sets(self.topology.branches, self.topology.generators,
+                                              self.lodf, self.patl, country, self.settings.eps,
+                                              self.settings, do_store_sets=False)
+        return self._sets[country]
+
+    def get_branch_set(self, names, set_name):
+        unknown_names = [name for name in names if name not in self.branches_by_name]
+        if unknown_names:
+            raise ValueError(f"Unknown branches in {set_name}: {unknown_names}.")
+        if not names:
+            raise ValueError(f"Set {set_name} is empty.")
+        return BranchSet([self.branches_by_name[name] for name in names])
+
+    def influence(self, country, R=None, I=None, T=None):
+        """Results (Result_IF) of the elements named in R against the contingencies named in I and the
+        elements named in T, each of R, I and T defaulting to the set of country. The results of all
+        elements of R of country are kept, and used for the elements of R if I and T are not given."""
+        from project_code.compute_influence_factors import compute_IFs
+
+        setI, setT, setR, _ = self.sets(country)
+        if I is None and T is None and (R is None or country in self._influence):
+            if country not in self._influence:
+                self._influence[country], _ = compute_IFs(setI, setT, setR, self.lodf, self.patl,
+                                                          self.ptdf)
+            if R is None:
+                return self._influence[country]
+            result_by_name = {result.eltR.name_branch: result for result in self._influence[country]}
+            if all(name in result_by_name for name in R):
+                return [result_by_name[name] for name in R]
+        results, _ = compute_IFs(setI if I is None else self.get_branch_set(I, 'I'),
+                                 setT if T is None else self.get_branch_set(T, 'T'),
+                                 setR if R is None else self.get_branch_set(R, 'R'),
+                                 self.lodf, self.patl, self.ptdf)
+        return results
+
+    def what_if(self, country, opened=(), impedances=None):
+        """Results of all elements of R of country with the branches named in opened out of service and
+        the impedances of the branches named in impedances ({name: impedance}) changed. The PTDF and
+        LODF matrices are updated by a rank-k correction (see update_PTDF_matrix), without inverting
+        the susceptance matrix again, and the kept stages are not modified. Opened branches and
+        branches made radial by the change are left out of the sets."""
+        from project_code.compute_influence_factors import compute_IFs
+        from project_code.matrix_and_set_functions import update_PTDF_matrix, create_LODF_matrix_from_PTDF
+
+        changes = {} if impedances is None else dict(impedances)
+        if any(impedance <= 0 for impedance in changes.values()):
+            raise ValueError("Impedances must be positive, open branches instead.")
+        changes.update({name: np.inf for name in opened})
+        if not changes:
+            return self.influence(country)
+        setI, setT, setR, _ = self.sets(country)
+        branches = self.topology.branches
+        changed = self.get_branch_set(list(changes), 'the changed branches')
+        PTDF = update_PTDF_matrix(self.ptdf, np.array([branch.impedance for branch in branches]),
+                                  changed.indices, [changes[branch.name_branch] for branch in changed])
+        self_PTDF = np.diag(PTDF).copy()
+        is_radial = np.array([branch.is_radial for branch in branches]) | (self_PTDF > 1 - self.settings.eps)
+        LODF = create_LODF_matrix_from_PTDF(PTDF, is_radial)
+
+        is_excluded = is_radial.copy()
+        is_excluded[[self.branches_by_name[name].index for name in opened]] = True
+        setI, setT, setR = [BranchSet([branch for branch in branch_set if not is_excluded[branch.index]])
+                            for branch_set in (setI, setT, setR)]
+        # compute_IFs reads the selfPTDF of the contingencies on the branches
+        base_self_PTDF = [branch.PTDF for branch in branches]
+        try:
+            for branch in branches:
+                branch.PTDF = self_PTDF[branch.index]
+            results, _ = compute_IFs(setI, setT, setR, LODF, self.patl, PTDF)
+        finally:
+            for branch, branch_self_PTDF in zip(branches, base_self_PTDF):
+                branch.PTDF = branch_self_PTDF
+        return results
+
+    def update_from_file(self, input_file_name):
+        """Case of input_file_name, another snapshot of the grid with the same settings. The new file is
+        read and preprocessed, and the stages of this case are reused as far as the differences
+        (snapshot_diff) allow, which is recorded in snapshot_update:
+        -'unchanged': matrices reused, results of the countries whose sets are unchanged remapped
+        -'ratings': only PATL changed. PTDF and LODF reused, sets rebuilt, and the normalized IF of
+        the countries whose sets are unchanged rescaled, if the changed PATL are only the ones of
+        elements of R
+        -'low rank': branches removed or impedances changed, the PTDF is updated by a rank-k
+        correction (see update_PTDF_matrix) and the other stages are rebuilt from it
+        -'full': branches added, nodes changed or more than max_low_rank_share of the nodes changed
+        branches, all stages are rebuilt
+        Stages that are not reused are computed on first access, as for any case."""
+        settings = copy.copy(self.settings)
+        settings.input_file_name = input_file_name
+        case = InfluenceCase(settings)
+        self.update(case)
+        return case
+
+    def update(self, case):
+        """Reuses the stages of this case for case, another snapshot of the grid with the same settings,
+        see update_from_file."""
+        t0 = time.perf_counter()
+        case.snapshot_diff = diff_snapshots(self.topology.branches, case.topology.branches)
+        case.snapshot_update = self.get_snapshot_update(case)
+        if case.snapshot_update == 'low rank':
+            self.update_PTDF(case)
+        elif case.snapshot_update in ('unchanged', 'ratings'):
+            self.reuse_stages(case)
+        diff = case.snapshot_diff
+        logging.info(f"Snapshot {case.settings.input_file_name}: {len(diff.added)} branches added, {len(diff.removed)} "
+                     f"removed, {len(diff.impedances)} impedances and {len(diff.ratings)} PATL changed, "
+                     f"'{case.snapshot_update}' update in {round(time.perf_counter() - t0, 3)} seconds.")
+
+    def get_snapshot_update(self, case):
+        diff = case.snapshot_diff
+        node_names = {node.name for node in self.topology.nodes}
+        if diff.added or node_names != {node.name for node in case.topology.nodes}:
+            return 'full'
+        n_changed = len(diff.removed) + len(diff.impedances)
+        if n_changed > self.max_low_rank_share * len(case.topology.nodes):
+            return 'full'
+        if n_changed > 0:
+            return 'low rank' if self._ptdf is not None else 'full'
+        return 'ratings' if diff.ratings else 'unchanged'
+
+    def get_indices(self, branches):
+        """Indices in this case of branches of another snapshot."""
+        return np.array([self.branches_by_name[branch.name_branch].index for branch in branches],
+                        dtype=np.int64)
+
+    def update_PTDF(self, case):
+        """Sets the PTDF of case, whose branches are the ones of this case without the removed ones."""
+        from project_code.matrix_and_set_functions import update_PTDF_matrix, set_PTDF_on_branches
+
+        diff = case.snapshot_diff
+        changes = {**diff.impedances, **{name: np.inf for name in diff.removed}}
+        try:
+            impedance = np.array([branch.impedance for branch in self.topology.branches])
+            PTDF = update_PTDF_matrix(self._ptdf, impedance,
+                                      [self.branches_by_name[name].index for name in changes],
+                                      list(changes.values()))
+        except ValueError:
+            case.snapshot_update = 'full'
+            return
+        case._ptdf = select_branches(PTDF, self.get_indices(case.topology.branches))
+        set_PTDF_on_branches(case._ptdf, case.topology.branches, case.settings.eps)
+
+    def reuse_stages(self, case):
+        """Reuses the stages of this case for case, whose branches are the same with the same impedances,
+        possibly in another order."""
+        from project_code.matrix_and_set_functions import set_PTDF_on_branches
+
+        branches = case.topology.branches
+        indices = self.get_indices(branches)
+        if np.array_equal(indices, np.arange(len(branches))) and \
+                [node.name for node in self.topology.nodes] == [node.name for node in case.topology.nodes]:
+            case._susceptance_factor = self._susceptance_factor
+            case._isf = self._isf
+            case._ptdf = self._ptdf
+            case._lodf = self._lodf
+            if case.snapshot_update == 'unchanged':
+                case._patl = self._patl
+            case._rings.update(self._rings)
+        else:
+            case._ptdf = select_branches(self._ptdf, indices)
+            case._lodf = select_branches(self._lodf, indices)
+            if case.snapshot_update == 'unchanged':
+                case._patl = select_branches(self._patl, indices)
+        if case._ptdf is not None:
+            set_PTDF_on_branches(case._ptdf, branches, case.settings.eps)
+
+        # the normalized IF of r is proportional to its PATL, as long as the PATL of the elements of T
+        # are unchanged and positive (see create_PATL_matrix)
+        ratings = case.snapshot_diff.ratings
+        scales = {name: rating / self.branches_by_name[name].PATL for name, rating in ratings.items()
+                  if self.branches_by_name[name].PATL > 0 and rating > 0}
+        for country, results in self._influence.items():
+            sets, new_sets = self._sets[country][:3], case.sets(country)[:3]
+            if any({branch.name_branch for branch in branch_set} !=
+                   {branch.name_branch for branch in new_branch_set}
+                   for branch_set, new_branch_set in zip(sets, new_sets)):
+                continue
+            setT, setR = new_sets[1], new_sets[2]
+            if any(branch.name_branch in ratings or branch.PATL <= 0 for branch in setT) or \
+                    any(branch.name_branch in ratings and branch.name_branch not in scales for branch in setR):
+                continue
+            case._influence[country] = [remap_result(result, case.branches_by_name,
+                                                     scales.get(result.eltR.name_branch, 1.0))
+                                        for result in results]
@@ -0,0 +1,141 @@
+"""Long-running influence service: the grid of a settings set is read and preprocessed, and its system
+matrices and the sets of each country are built once, when the service starts. Influence queries are
+then answered over HTTP from memory, in JSON:
+
+- GET /countries: the countries served, with the sizes of their sets R, T and I;
+- GET /influence?country=A: the results of all elements of R of country A, computed once and cached;
+- GET /influence?country=A&element=NAME&element=NAME2: the results of some elements;
+- POST /influence with a body {"country": "A", "R": [NAME, ...], "I": [...], "T": [...]}: the results
+  for ad-hoc subsets, a missing subset being the set of the country;
+- POST /what_if with a body {"country": "A", "opened": [NAME, ...], "impedances": {NAME: X, ...}}: the
+  results of country A with branches opened and impedances changed, not cached.
+
+Branches are named by Branch.name_branch. The case is an InfluenceCase, see influence_case.py: the
+topology and the matrices are shared by all countries, only rings and sets are country specific.
+Queries are answered one at a time, as the rings of the branches are set to the ones of the queried
+country."""
+import http.server
+import json
+import logging
+import time
+import urllib.parse
+
+from project_code.influence_case import InfluenceCase
+from project_code.misc_functions import setup_logger
+
+
+def load_case(settings):
+    """InfluenceCase of settings, with the system matrices and the sets of all countries built."""
+    from project_code.compute_influence_factors import compile_kernels
+
+    t0 = time.perf_counter()
+    compile_kernels()
+    case = InfluenceCase(settings)
+    for country in case.countries:
+        case.sets(country)
+    logging.info(f"Case {settings.input_file_name} loaded in {round(time.perf_counter() - t0, 3)} "
+                 f"seconds, serving countries {', '.join(case.countries)}.")
+    return case
+
+
+def get_name(branch):
+    return None if branch is None else branch.name_branch
+
+
+def result_to_dict(result):
+    return {'element': result.eltR.name_branch, 'display_name': result.eltR.display_name,
+            'country': result.eltR.country, 'ring': int(result.eltR.ring),
+            'IF_N1': float(result.IFN1), 'norm_IF_N1': float(result.nIFN1),
+            'IF_N2': float(result.IFN2), 'norm_IF_N2': float(result.nIFN2),
+            'I': get_name(result.eltI), 'T': get_name(result.eltT),
+            'I_norm': get_name(result.eltIn), 'T_norm': get_name(result.eltTn)}
+
+
+def get_countries_summary(case):
+    summary = {}
+    for country in case.countries:
+        setI, setT, setR, _ = case.sets(country)
+        summary[country] = {'R': len(setR), 'T': len(setT), 'I': len(setI)}
+    return {'countries': summary}
+
+
+class InfluenceRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Answers the queries on the case of the server, see the module docstring."""
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == '/countries':
+            self.answer(lambda: get_countries_summary(self.server.case))
+        elif url.path == '/influence':
+            country = query.get('country', [None])[0]
+            self.answer(lambda: self.get_results(country, query.get('element')))
+        else:
+            self.send_json(404, {'error': f"Unknown path {url.path}."})
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if url.path == '/influence':
+            self.answer(lambda: self.get_results(**self.read_query(body, ['country', 'R', 'I', 'T'])))
+        elif url.path == '/what_if':
+            self.answer(lambda: self.get_what_if_results(
+                **self.read_query(body, ['country', 'opened', 'impedances'])))
+        else:
+            self.send_json(404, {'error': f"Unknown path {url.path}."})
+
+    @staticmethod
+    def read_query(body, keys):
+        query = json.loads(body or b'{}')
+        if not isinstance(query, dict) or not set(query) <= set(keys):
+            raise ValueError(f"The query must be an object with keys {', '.join(keys)}.")
+        return query
+
+    def get_results(self, country=None, R=None, I=None, T=None):
+        results = self.server.case.influence(country, R, I, T)
+        return {'country': country, 'results': [result_to_dict(result) for result in results]}
+
+    def get_what_if_results(self, country=None, opened=(), impedances=None):
+        results = self.server.case.what_if(country, opened, impedances)
+        return {'country': country, 'results': [result_to_dict(result) for result in results]}
+
+    def answer(self, query):
+        t0 = time.perf_counter()
+        try:
+            content = query()
+        except (ValueError, TypeError, KeyError) as error:  # malformed query or unknown element
+            self.send_json(400, {'error': str(error)})
+            return
+        content['duration_ms'] = round((time.perf_counter() - t0) * 1000, 3)
+        logging.info(f"{self.command} {self.path} answered in {content['duration_ms']} ms.")
+        self.send_json(200, content)
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+def create_server(case, host='127.0.0.1', port=8050):
+    """HTTP server answering queries on case, one at a time. Port 0 picks a free port."""
+    server = http.server.HTTPServer((host, port), InfluenceRequestHandler)
+    server.case = case
+    return server
+
+
+def serve(settings, host='127.0.0.1', port=8050):
+    setup_logger()
+    server = create_server(load_case(settings), host, port)
+    logging.info(f"Influence service listening on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
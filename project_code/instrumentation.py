@@ -0,0 +1,135 @@
+"""Instrumentation of a run: stage timers, memory tracking and counters, collected per country in a
+run report written as JSON to output_files/<case>/<country>/<country>_run_report.json.
+
+Stages are timed with stage_timer (context manager) or report_stage (decorator). Each stage of the
+report holds its name, its parent stage, its duration, the peak RSS of the process so far at its end
+(process_peak_rss_MB, which never decreases, so it is not the peak of the stage) and, if memory tracing
+is on, its peak of memory allocated through Python (tracemalloc). Counters hold
+sizes such as the number of branches, |R|, |I| and |T| or the number of pairs computed by the
+kernels. Outside of a run report, stages and counters are not recorded."""
+import contextlib
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from definitions import ROOT_DIR
+
+_run_report = None
+_stages = threading.local()  # stages in progress, per thread: grids may be read on a background thread
+
+
+def get_stage_stack():
+    if not hasattr(_stages, 'stack'):
+        _stages.stack = []
+    return _stages.stack
+
+
+def start_run_report(country, settings, do_trace_memory=False):
+    """Starts collecting stages and counters for a country, with tracemalloc if do_trace_memory. Tracing
+    started by the caller is left running when the report stops."""
+    global _run_report
+    _run_report = {'country': country,
+                   'case_name': settings.case_name,
+                   'input_file_name': settings.input_file_name,
+                   'settings_name': getattr(settings.settings_name, 'name', str(settings.settings_name)),
+                   'start_time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'python_version': sys.version.split()[0],
+                   'do_trace_memory': do_trace_memory,
+                   'start': time.perf_counter(),
+                   'do_stop_tracing': do_trace_memory and not tracemalloc.is_tracing(),
+                   'stages': [],
+                   'counters': {}}
+    get_stage_stack().clear()
+    if _run_report['do_stop_tracing']:
+        tracemalloc.start()
+
+
+def stop_run_report(country, settings):
+    """Stops collecting, writes the run report of the country and returns it."""
+    global _run_report
+    report = _run_report
+    _run_report = None
+    if report is None:
+        return None
+    if report.pop('do_stop_tracing'):
+        tracemalloc.stop()
+    report['peak_rss_MB'] = get_peak_rss_MB()
+    report['duration_s'] = time.perf_counter() - report.pop('start')
+
+    case_folder_name = f"{settings.case_name}_{settings.input_file_name.replace('.', '_')}"
+    fpath = Path(ROOT_DIR) / "output_files" / case_folder_name / country
+    if not fpath.exists():
+        fpath.mkdir(parents=True)
+    with open(fpath / f"{country}_run_report.json", "w") as file_out:
+        json.dump(report, file_out, indent=2)
+    return report
+
+
+def get_peak_rss_MB():
+    """Peak resident set size of the process in MB, None where the resource module is missing
+    (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return peak_rss / 1024 ** 2 if sys.platform == 'darwin' else peak_rss / 1024
+
+
+@contextlib.contextmanager
+def stage_timer(name):
+    """Times the enclosed stage and records it in the run report."""
+    is_tracing = _run_report is not None and tracemalloc.is_tracing()
+    stage_stack = get_stage_stack()
+    if is_tracing:
+        # the peak of the enclosing stage so far is kept before the peak is reset for this stage
+        if stage_stack:
+            stage_stack[-1]['peak_traced'] = max(stage_stack[-1]['peak_traced'],
+                                                 tracemalloc.get_traced_memory()[1])
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+    stage = {'name': name, 'peak_traced': 0}
+    parent = stage_stack[-1]['name'] if stage_stack else None
+    stage_stack.append(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        stage_stack.pop()
+        if _run_report is not None:
+            record = {'name': name, 'parent': parent, 'duration_s': duration,
+                      'process_peak_rss_MB': get_peak_rss_MB()}
+            if is_tracing:
+                peak_traced = max(stage['peak_traced'], tracemalloc.get_traced_memory()[1])
+                record['peak_traced_MB'] = peak_traced / 1024 ** 2
+                if stage_stack:
+                    stage_stack[-1]['peak_traced'] = max(stage_stack[-1]['peak_traced'],
+                                                         peak_traced)
+            _run_report['stages'].append(record)
+            logging.debug(f"Stage {name} performed in {duration:.6f} seconds.")
+
+
+def report_stage(function):
+    """Decorator timing each call of function as a stage named after it."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with stage_timer(function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def set_counter(name, value):
+    if _run_report is not None:
+        _run_report['counters'][name] = value
+
+
+def increment_counter(name, value):
+    if _run_report is not None:
+        _run_report['counters'][name] = _run_report['counters'].get(name, 0) + value
@@ -3,74 +3,248 @@ import time
 from pathlib import Path
 
 from definitions import ROOT_DIR
-from project_code.classes import Result_IF, Result_IF_generators
-from project_code.compute_influence_factors import compute_IFs, compute_IFs_generators
-from project_code.matrix_and_set_functions import compute_LODF_for_generators, \
-    create_inv_susceptance_matrix, create_ISF_matrix, create_PTDF_matrix, set_PTDF_on_branches, create_LODF_matrix, \
-    create_PATL_matrix, create_set_external_contingencies, create_set_external_contingencies_generators, \
-    create_set_within_control_area, create_set_internal_external_maintenance
+from project_code.classes import Result_IF, Result_IF_bound, Result_IF_generators, Result_IF_witnesses, \
+    Result_relevance, BranchSet
+from project_code.instrumentation import report_stage, start_run_report, stop_run_report, set_counter
 from project_code.misc_functions import setup_logger, add_log_file_handler, remove_log_file_handler
 from project_code.read_grid import read_lines, read_transformers, read_generators, read_couplers, \
-    create_nodes_and_update_branches_with_node_info, set_node_country, set_branch_country
-from project_code.settings import FileTypeEnum, get_settings, SettingsEnum
+    create_nodes_and_update_branches_with_node_info, set_node_country, set_branch_country, read_rating_sets
+from project_code.results_database import add_run, add_set_members, add_results, add_results_generators, \
+    get_snapshot_time
+from project_code.settings import FileTypeEnum, get_settings, SettingsEnum, OutputFormatEnum
+from project_code.store_functions import store_results_hdf5, store_results_generators_hdf5, \
+    create_pair_maxima_hdf5
 from project_code.topology_functions import store_topology, remove_branches_with_loop_elements, merge_tie_lines, \
     assign_nodes_to_ring_0, assign_nodes_to_other_rings, remove_non_connected_nodes_and_branches, \
     connect_generators_to_nodes, validate_topology, apply_couplers_on_branches_and_generators, \
-    convert_couplers_to_lines, get_most_connected_node
-from project_code.topology_getter.pssetopology_wrapper import get_topology
+    convert_couplers_to_lines, get_most_connected_node, mark_radial_branches, reset_rings
+
+# The modules depending on numba and scipy (compute_influence_factors, matrix_and_set_functions,
+# network_reduction) and the PSSE wrapper (execnet) are imported in the functions using them, so
+# that reading a grid and building its topology does not pay for their import.
+
+# Folder and file prefix of the run report of the multi-country sweep, in place of a country.
+MULTI_COUNTRY_REPORT_NAME = 'multi_country'
 
 
 def main(settings):
+    from project_code.compute_influence_factors import compute_IFs, compute_IFs_generators, \
+        compute_relevance, compile_kernels
+    from project_code.matrix_and_set_functions import compute_LODF_for_generators
+
+    check_relevance_settings(settings)
+    check_screening_settings(settings)
+    if settings.do_multi_country_sweep:
+        main_multi_country(settings)
+        return
+
     logger = setup_logger()
-    ttt = time.clock()
+    ttt = time.perf_counter()
+    compile_kernels()
 
     for country in settings.countries:
         if country == 'XX':  # used for surrounding countries of a region that are not analyzed
             continue
-        tt = time.clock()
-        epsilon = settings.eps
+        tt = time.perf_counter()
         add_log_file_handler(logger, country, settings)
+        start_run_report(country, settings, settings.do_trace_memory)
 
         logger.info(f"Starting a full run for country '{country}':")
         logger.info(f"Required functions compiled ! Processing {settings.input_file_name}")
 
         file_contents = open_file(settings)
         branches, generators, nodes = read_grid(file_contents, settings)
-        branches, nodes = create_and_preprocess_topology(branches, generators, nodes,
-                                                         country, settings)
+        branches, nodes, generator_arrays = create_and_preprocess_topology(branches, generators,
+                                                                           nodes, country,
+                                                                           settings)
         store_topology(branches, nodes, country, settings)
 
-        ISF, PTDF, LODF, PATL = create_system_matrices(branches, nodes, country, epsilon)
+        ISF, PTDF, LODF, PATL = create_country_matrices(branches, nodes, country, settings)
+        setI, setT, setR, setR_gens = create_screened_sets(branches, generators, LODF, PATL, PTDF,
+                                                           country, settings)
+
+        run_id = None
+        if settings.results_database is not None:
+            run_id = add_run(settings, country, get_snapshot_time(settings))
+            add_set_members(settings, run_id, {'R': setR, 'T': setT, 'I': setI})
+
+        rating_names, ratings = [], None
+        if settings.rating_sets is not None:
+            rating_names, ratings = read_rating_sets(branches, settings)
+
+        if settings.do_relevance_only:
+            results_relevance = compute_relevance(setI, setT, setR, PATL, PTDF,
+                                                  settings.relevance_threshold, ratings)
+            store_results_to_csv(results_relevance, Result_relevance, 'relevance', country,
+                                 settings)
+        else:
+            relevance_threshold = settings.relevance_threshold \
+                if settings.do_stop_at_irrelevant_rings else None
+            pair_maxima_file = create_pair_maxima_hdf5(setI, branches, country, settings) \
+                if settings.do_store_pair_maxima else None
+            try:
+                results_branches, results_below_threshold = compute_IFs(
+                    setI, setT, setR, LODF, PATL, PTDF, relevance_threshold,
+                    settings.n_top_witnesses, ratings, pair_maxima_file)
+            finally:
+                if pair_maxima_file is not None:
+                    pair_maxima_file.close()
+            if settings.output_format == OutputFormatEnum.hdf5:
+                store_results_hdf5(results_branches, branches, country, settings, rating_names)
+            else:
+                store_results(results_branches, country, settings)
+                for idx, rating_name in enumerate(rating_names):
+                    store_results_to_csv([result.rating_results[idx] for result in results_branches],
+                                         Result_IF, f'results_{rating_name}', country, settings)
+                if settings.n_top_witnesses > 0:
+                    store_results_to_csv([result.witnesses for result in results_branches],
+                                         Result_IF_witnesses, 'results_top_witnesses', country,
+                                         settings)
+            if run_id is not None:
+                add_results(settings, run_id, results_branches)
+            if settings.do_stop_at_irrelevant_rings:
+                store_results_to_csv(results_below_threshold, Result_IF_bound,
+                                     'results_below_threshold', country, settings)
+
+        if settings.do_calculate_generator_IF:
+            LODF_gens = compute_LODF_for_generators(setR_gens, ISF, generator_arrays)
+            results_generators = compute_IFs_generators(branches, setT, setI, setR_gens, LODF,
+                                                        LODF_gens, PATL, generator_arrays)
+            if settings.output_format == OutputFormatEnum.hdf5:
+                store_results_generators_hdf5(results_generators, branches, country, settings)
+            else:
+                store_results_generators(results_generators, country, settings)
+            if run_id is not None:
+                add_results_generators(settings, run_id, results_generators)
+
+        logging.info(f"Whole calculation for {country} performed in {round(time.perf_counter() - tt, 0)} "
+                     f"seconds.\n\n")
+        stop_run_report(country, settings)
+        remove_log_file_handler(logger, country, settings)
+
+    logging.info(f"Whole calculation for data set performed in {round(time.perf_counter() - ttt, 0)}"
+                 f" seconds.\n\n")
+
 
-        setI, setT, setR, setR_gens = create_sets(branches, generators, LODF, PATL, country,
-                                                  epsilon, settings)
+def main_multi_country(settings):
+    """Runs all countries on a topology and matrices built once, and computes the IFs of all
+    countries in a single sweep. Rings and sets are still determined per country."""
+    from project_code.compute_influence_factors import compute_IFs_generators, compute_IFs_multi_country, \
+        compile_kernels
+    from project_code.matrix_and_set_functions import compute_LODF_for_generators
 
-        results_branches = compute_IFs(branches, setI, setT, setR, LODF, PATL, PTDF)
-        store_results(results_branches, country, settings)
+    check_shared_topology_settings(settings, 'the multi-country sweep')
+
+    logger = setup_logger()
+    ttt = time.perf_counter()
+    # a single run report for all countries, as the stages are shared
+    start_run_report(MULTI_COUNTRY_REPORT_NAME, settings, settings.do_trace_memory)
+    compile_kernels()
+    epsilon = settings.eps
+    countries = [country for country in settings.countries if country != 'XX']
+
+    file_contents = open_file(settings)
+    branches, generators, nodes = read_grid(file_contents, settings)
+    branches, nodes, generator_arrays = create_and_preprocess_topology(branches, generators, nodes,
+                                                                       countries[0], settings)
+    ISF, PTDF, LODF, PATL = create_system_matrices(branches, nodes, countries[0], epsilon,
+                                                   settings.do_reduce_network)
+
+    sets_per_country = {}
+    rings_per_country = {}
+    for country in countries:
+        if get_most_connected_node(nodes, country) is None:
+            logging.info(f"Country '{country}' is not connected to the grid of '{countries[0]}', "
+                         f"skipped in the multi-country sweep.")
+            continue
+        add_log_file_handler(logger, country, settings)
+        logger.info(f"Determining rings and sets for country '{country}':")
+        reset_rings(nodes, branches)
+        assign_nodes_to_ring_0(nodes, branches, country)
+        assign_nodes_to_other_rings(nodes)
+        rings_per_country[country] = [branch.ring for branch in branches]
+        store_topology(branches, nodes, country, settings)
+        sets_per_country[country] = create_sets(branches, generators, LODF, PATL, country, epsilon,
+                                                settings)
+        remove_log_file_handler(logger, country, settings)
+
+    results_per_country = compute_IFs_multi_country(
+        {country: sets[:3] for country, sets in sets_per_country.items()}, LODF, PATL, PTDF)
+
+    for country, (setI, setT, setR, setR_gens) in sets_per_country.items():
+        add_log_file_handler(logger, country, settings)
+        for branch, ring in zip(branches, rings_per_country[country]):
+            branch.ring = ring
+        if settings.output_format == OutputFormatEnum.hdf5:
+            store_results_hdf5(results_per_country[country], branches, country, settings)
+        else:
+            store_results(results_per_country[country], country, settings)
+        run_id = None
+        if settings.results_database is not None:
+            run_id = add_run(settings, country, get_snapshot_time(settings))
+            add_set_members(settings, run_id, {'R': setR, 'T': setT, 'I': setI})
+            add_results(settings, run_id, results_per_country[country])
 
         if settings.do_calculate_generator_IF:
-            LODF_gens = compute_LODF_for_generators(setR_gens, ISF, generators)
+            LODF_gens = compute_LODF_for_generators(setR_gens, ISF, generator_arrays)
             results_generators = compute_IFs_generators(branches, setT, setI, setR_gens, LODF,
-                                                        LODF_gens, PATL)
-            store_results_generators(results_generators, country, settings)
-
-        logging.info(f"Whole calculation for {country} performed in {round(time.clock() - tt, 0)} "
-                     f"seconds.\n\n")
+                                                        LODF_gens, PATL, generator_arrays)
+            if settings.output_format == OutputFormatEnum.hdf5:
+                store_results_generators_hdf5(results_generators, branches, country, settings)
+            else:
+                store_results_generators(results_generators, country, settings)
+            if run_id is not None:
+                add_results_generators(settings, run_id, results_generators)
         remove_log_file_handler(logger, country, settings)
 
-    logging.info(f"Whole calculation for data set performed in {round(time.clock() - ttt, 0)}"
+    stop_run_report(MULTI_COUNTRY_REPORT_NAME, settings)
+    logging.info(f"Whole calculation for data set performed in {round(time.perf_counter() - ttt, 0)}"
                  f" seconds.\n\n")
 
 
+def check_relevance_settings(settings):
+    """Raises a ValueError if a mode based on the relevance threshold is set without a threshold, or if
+    both modes are set, as the relevance only run computes no IFs to stop."""
+    modes = [name for name in ['do_stop_at_irrelevant_rings', 'do_relevance_only'] if getattr(settings, name)]
+    if modes and settings.relevance_threshold is None:
+        raise ValueError(f"Settings {modes} require relevance_threshold to be set.")
+    if len(modes) > 1:
+        raise ValueError(f"Settings {modes} cannot be combined, set only one of them.")
+
+
+def check_screening_settings(settings):
+    """Raises a ValueError if a screening policy is set without a screening value."""
+    if settings.screening_policy is not None and settings.screening_value is None:
+        raise ValueError(f"Setting screening_policy ({settings.screening_policy.name}) requires "
+                         f"screening_value to be set.")
+
+
+def check_shared_topology_settings(settings, usage):
+    """Raises a ValueError if settings are set that need a topology or sets specific to a country,
+    which are not supported when the topology and matrices are shared by all countries."""
+    unsupported = [name for name in ['max_ring', 'screening_policy', 'relevance_threshold',
+                                     'rating_sets'] if getattr(settings, name) is not None]
+    if settings.n_top_witnesses > 0:
+        unsupported.append('n_top_witnesses')
+    if settings.do_store_pair_maxima:
+        unsupported.append('do_store_pair_maxima')
+    if unsupported:
+        raise ValueError(f"Settings {unsupported} are not supported in {usage}.")
+
+
+@report_stage
 def read_grid(file_contents, settings):
-    t0 = time.clock()
+    t0 = time.perf_counter()
 
     branches, generators = read_branches_and_generators(file_contents, settings)
     nodes = create_nodes_and_update_branches_with_node_info(branches)
     set_node_country(nodes, settings)
     set_branch_country(branches)
+    set_counter('n_branches_read', len(branches))
+    set_counter('n_nodes_read', len(nodes))
+    set_counter('n_generators_read', len(generators))
 
-    logging.info(f"System read from {settings.input_file_name} in {round(time.clock() - t0, 3)} seconds.")
+    logging.info(f"System read from {settings.input_file_name} in {round(time.perf_counter() - t0, 3)} seconds.")
     return branches, generators, nodes
 
 
@@ -83,6 +257,7 @@ def read_branches_and_generators(file_contents, settings):
     return branches, generators
 
 
+@report_stage
 def open_file(settings):
     input_file = Path(ROOT_DIR) / "source_files" / settings.input_file_name
     if not input_file.exists():
@@ -90,8 +265,13 @@ def open_file(settings):
 
     if settings.file_type == FileTypeEnum.uct:
         with open(input_file, "r") as file:
-            file_contents = file.read().split('\n')
+            file_contents = file.read().splitlines()
+    elif settings.file_type == FileTypeEnum.psse and input_file.suffix.lower() == '.raw':
+        # RAW files are read in process by the psspy stand-in, so without PSSE
+        from project_code.topology_getter.pssetopology_wrapper import get_topology_from_raw
+        file_contents = get_topology_from_raw({0: str(input_file)})
     elif settings.file_type == FileTypeEnum.psse:
+        from project_code.topology_getter.pssetopology_wrapper import get_topology
         file_contents = get_topology({0: str(input_file)})
     else:
         raise ValueError("File type not found!")
@@ -99,9 +279,10 @@ def open_file(settings):
     return file_contents
 
 
+@report_stage
 def create_and_preprocess_topology(branches, generators, nodes, country, settings):
 
-    t0 = time.clock()
+    t0 = time.perf_counter()
 
     if settings.do_merge_couplers:
         apply_couplers_on_branches_and_generators(branches, generators, nodes)
@@ -121,40 +302,99 @@ def create_and_preprocess_topology(branches, generators, nodes, country, setting
     assign_nodes_to_other_rings(nodes)
 
     nodes, branches = remove_non_connected_nodes_and_branches(nodes)
+    mark_radial_branches(nodes, branches)
 
-    connect_generators_to_nodes(nodes, generators)
+    generator_arrays = connect_generators_to_nodes(nodes, generators)
     validate_topology(nodes, branches, generators)
+    set_counter('n_branches', len(branches))
+    set_counter('n_nodes', len(nodes))
+    set_counter('n_generators_connected', len(generator_arrays.power))
+
+    logging.info(f"Topology determined in {round(time.perf_counter() - t0, 3)} seconds.")
+    return branches, nodes, generator_arrays
 
-    logging.info(f"Topology determined in {round(time.clock() - t0, 3)} seconds.")
-    return branches, nodes
 
+@report_stage
+def create_system_matrices(branches, nodes, country, epsilon, do_reduce_network=False,
+                           do_sparse_factorization=False):
+    from project_code.matrix_and_set_functions import create_inv_susceptance_matrix, create_ISF_matrix, \
+        create_ISF_matrix_from_sparse_factorization, create_PTDF_matrix, set_PTDF_on_branches, \
+        create_LODF_matrix, create_PATL_matrix
+    from project_code.network_reduction import reduce_network, create_ISF_matrix_from_reduced_network
 
-def create_system_matrices(branches, nodes, country, epsilon):
     slack_node = get_most_connected_node(nodes, country)
-    inv_B = create_inv_susceptance_matrix(branches, nodes, slack_node)
-    ISF = create_ISF_matrix(branches, nodes, inv_B, slack_node)
+    if do_reduce_network:
+        reduction = reduce_network(nodes, branches, slack_node)
+        ISF = create_ISF_matrix_from_reduced_network(reduction)
+    elif do_sparse_factorization:
+        ISF = create_ISF_matrix_from_sparse_factorization(branches, nodes, slack_node)
+    else:
+        inv_B = create_inv_susceptance_matrix(branches, nodes, slack_node)
+        ISF = create_ISF_matrix(branches, nodes, inv_B, slack_node)
     PTDF = create_PTDF_matrix(branches, ISF)
     set_PTDF_on_branches(PTDF, branches, epsilon)
     LODF = create_LODF_matrix(branches, PTDF, epsilon)
     PATL = create_PATL_matrix(branches)
+    set_counter('ISF_shape', list(ISF.shape))
+    set_counter('PTDF_shape', list(PTDF.shape))
+    set_counter('system_matrices_MB', sum(matrix.nbytes for matrix in [ISF, PTDF, LODF, PATL]) / 1024 ** 2)
     return ISF, PTDF, LODF, PATL
 
 
-def create_sets(branches, generators, LODF, PATL, country, epsilon, settings):
-    t0 = time.clock()
+def create_country_matrices(branches, nodes, country, settings):
+    """System matrices of a country as in a full run. With settings.max_ring, the ISF matrix is solved on
+    a sparse factorization of the susceptance matrix: the contingencies beyond max_ring are kept, so the
+    rows of all branches are still needed, but the dense inverse of the susceptance matrix is not."""
+    return create_system_matrices(branches, nodes, country, settings.eps, settings.do_reduce_network,
+                                  settings.max_ring is not None)
+
+
+def create_screened_sets(branches, generators, LODF, PATL, PTDF, country, settings):
+    """Sets I, T, R and R of generators of a country as in a full run, the contingencies of I being
+    screened with settings.screening_policy."""
+    from project_code.compute_influence_factors import verify_contingency_screening
+    from project_code.matrix_and_set_functions import screen_contingencies
+
+    setI, setT, setR, setR_gens = create_sets(branches, generators, LODF, PATL, country, settings.eps,
+                                              settings)
+    if settings.screening_policy is not None:
+        screened_setI = screen_contingencies(setI, setT, LODF, PATL, settings.screening_policy,
+                                             settings.screening_value)
+        verify_contingency_screening(setI, screened_setI, setT, setR, LODF, PATL, PTDF)
+        setI = screened_setI
+    return setI, setT, setR, setR_gens
+
+
+@report_stage
+def create_sets(branches, generators, LODF, PATL, country, epsilon, settings, do_store_sets=True):
+    """Sets (I, T, R, R generators) of country, written to the output folder of the case unless
+    do_store_sets is False."""
+    from project_code.matrix_and_set_functions import create_set_external_contingencies, \
+        create_set_external_contingencies_generators, create_set_within_control_area, \
+        create_set_internal_external_maintenance
 
-    setR = create_set_external_contingencies(branches, epsilon)
+    t0 = time.perf_counter()
+
+    setR_all = create_set_external_contingencies(branches, epsilon)
+    setR = setR_all if settings.max_ring is None else \
+        BranchSet([branch for branch in setR_all if branch.ring <= settings.max_ring])
     setR_gens = create_set_external_contingencies_generators(generators, country)
-    setT = create_set_within_control_area(branches, country, epsilon, settings)
-    setI = create_set_internal_external_maintenance(branches, LODF, PATL, setR, setT,
-                                                    country, epsilon, settings)
+    setT = create_set_within_control_area(branches, country, epsilon, settings, do_store_sets)
+    # contingencies beyond max_ring are kept, only the external elements assessed are limited
+    setI = create_set_internal_external_maintenance(branches, LODF, PATL, setR_all, setT,
+                                                    country, epsilon, settings, do_store_sets)
     logging.info(f"External elements R : {len(setR)}, generators: {len(setR_gens)}")
     logging.info(f"Internal elements monitored : {len(setT)}")
     logging.info(f"Contingencies : {len(setI)}")
-    logging.info("Sets determined in " + str(round(time.clock() - t0, 1)) + " seconds.")
+    set_counter('size_R', len(setR))
+    set_counter('size_R_generators', len(setR_gens))
+    set_counter('size_T', len(setT))
+    set_counter('size_I', len(setI))
+    logging.info("Sets determined in " + str(round(time.perf_counter() - t0, 1)) + " seconds.")
     return setI, setT, setR, setR_gens
 
 
+@report_stage
 def store_results(results, country, settings):
     case_folder_name = f"{settings.case_name}_{settings.input_file_name.replace('.', '_')}"
     fname = f"{country}_results.csv"
@@ -175,6 +415,22 @@ def store_results(results, country, settings):
                 file_out.write(str(result_uc))
 
 
+@report_stage
+def store_results_to_csv(results, result_class, name, country, settings):
+    case_folder_name = f"{settings.case_name}_{settings.input_file_name.replace('.', '_')}"
+    fname = f"{country}_{name}.csv"
+    fpath = Path(ROOT_DIR) / "output_files" / case_folder_name / country
+    ffname = Path(ROOT_DIR) / "output_files" / case_folder_name / country / fname
+    if not fpath.exists():
+        fpath.mkdir(parents=True)
+
+    with open(ffname, "w") as file_out:
+        file_out.write(result_class.header(country))
+        for result in results:
+            file_out.write(str(result))
+
+
+@report_stage
 def store_results_generators(results, country, settings):
     case_folder_name = f"{settings.case_name}_{settings.input_file_name.replace('.', '_')}"
     fname = f"{country}_results_generators.csv"
@@ -1,73 +1,109 @@
 import time
-from scipy.sparse.linalg import inv as spinv
-from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import inv as spinv, splu
+from scipy.sparse import csr_matrix, coo_matrix
 import numpy as np
 import logging
+from project_code.classes import BranchSet
+from project_code.instrumentation import report_stage, set_counter
 from project_code.misc_functions import sub_matrix
 from pathlib import Path
 from definitions import ROOT_DIR
+from project_code.settings import ScreeningEnum
 import os
 
 
 def create_inv_susceptance_matrix(branches, nodes, slack_node):
-    t1 = time.clock()
-    B = np.zeros((len(nodes), len(nodes)))
-    for branch in branches:
-        i = branch.node_from.index
-        j = branch.node_to.index
-        B[i, i] += -1 / branch.impedance
-        B[j, j] += -1 / branch.impedance
-        B[i, j] += 1 / branch.impedance
-        B[j, i] += 1 / branch.impedance
-    B = np.delete(B, slack_node.index, axis=0)
-    B = np.delete(B, slack_node.index, axis=1)
-    logging.info(f"Susceptance matrix B built in {round(time.clock() - t1, 2)} seconds.")
-
-    t1 = time.clock()
+    node_from = np.array([branch.node_from.index for branch in branches], dtype=np.int64)
+    node_to = np.array([branch.node_to.index for branch in branches], dtype=np.int64)
+    impedance = np.array([branch.impedance for branch in branches])
+    return build_inv_susceptance_matrix(len(nodes), node_from, node_to, impedance,
+                                        slack_node.index)
+
+
+@report_stage
+def build_inv_susceptance_matrix(n_nodes, node_from, node_to, impedance, slack_idx):
+    """Builds and inverts the susceptance matrix B without the row and column of the slack node,
+    for a network given as arrays of branch end node indices and branch impedances."""
+    t1 = time.perf_counter()
+    B = np.zeros((n_nodes, n_nodes))
+    rows = np.column_stack((node_from, node_to, node_from, node_to)).ravel()
+    columns = np.column_stack((node_from, node_to, node_to, node_from)).ravel()
+    values = np.column_stack((-1 / impedance, -1 / impedance, 1 / impedance, 1 / impedance)).ravel()
+    np.add.at(B, (rows, columns), values)
+    B = np.delete(B, slack_idx, axis=0)
+    B = np.delete(B, slack_idx, axis=1)
+    logging.info(f"Susceptance matrix B built in {round(time.perf_counter() - t1, 2)} seconds.")
+
+    t1 = time.perf_counter()
     B2 = csr_matrix(B)
     invB2 = spinv(B2)
     inverseB = invB2.toarray()
-    logging.info(f"Susceptance matrix B inverted in {round(time.clock() - t1, 2)} seconds.")
+    logging.info(f"Susceptance matrix B inverted in {round(time.perf_counter() - t1, 2)} seconds.")
     return inverseB
 
 
 def create_ISF_matrix(branches, nodes, inv_B, slack_node):
-    t1 = time.clock()
-
-    list_ISF = []
-    for branch in branches:
-        i = branch.node_from.index
-        B_from = get_row_from_inv_B(i, inv_B, nodes, slack_node)
-
-        j = branch.node_to.index
-        B_to = get_row_from_inv_B(j, inv_B, nodes, slack_node)
-
-        list_ISF.append(-1 / branch.impedance * np.array((B_from - B_to)))
-    matrixISF = np.array(list_ISF)
-    matrixISF = np.insert(matrixISF, slack_node.index, 0, axis=1)
-    logging.info(f"ISF matrix computed in {round(time.clock() - t1, 1)} seconds.")
+    node_from = np.array([branch.node_from.index for branch in branches], dtype=np.int64)
+    node_to = np.array([branch.node_to.index for branch in branches], dtype=np.int64)
+    impedance = np.array([branch.impedance for branch in branches])
+    return build_ISF_matrix(node_from, node_to, impedance, inv_B, slack_node.index)
+
+
+@report_stage
+def build_ISF_matrix(node_from, node_to, impedance, inv_B, slack_idx):
+    """Computes the ISF matrix (branches * nodes) from the inverse susceptance matrix, for a network
+    given as arrays of branch end node indices and branch impedances. The slack column is zero."""
+    t1 = time.perf_counter()
+    inv_B_with_slack = np.insert(inv_B, slack_idx, 0, axis=0)
+    matrixISF = (-1 / impedance)[:, np.newaxis] * (inv_B_with_slack[node_from, :] -
+                                                   inv_B_with_slack[node_to, :])
+    matrixISF = np.insert(matrixISF, slack_idx, 0, axis=1)
+    logging.info(f"ISF matrix computed in {round(time.perf_counter() - t1, 1)} seconds.")
     return matrixISF
 
 
-def get_row_from_inv_B(i, inv_B, nodes, slack_node):
-    if i < slack_node.index:
-        BFrom = inv_B[i, :]
-    elif i > slack_node.index:
-        BFrom = inv_B[i - 1, :]
-    else:
-        BFrom = np.zeros(len(nodes) - 1)
-    return BFrom
-
-
+def create_sparse_susceptance_matrix(n_nodes, branches):
+    node_from = np.array([branch.node_from.index for branch in branches], dtype=np.int64)
+    node_to = np.array([branch.node_to.index for branch in branches], dtype=np.int64)
+    admittance = 1 / np.array([branch.impedance for branch in branches])
+    rows = np.concatenate((node_from, node_to, node_from, node_to))
+    columns = np.concatenate((node_from, node_to, node_to, node_from))
+    values = np.concatenate((-admittance, -admittance, admittance, admittance))
+    return coo_matrix((values, (rows, columns)), shape=(n_nodes, n_nodes)).tocsc()
+
+
+@report_stage
+def create_ISF_matrix_from_sparse_factorization(branches, nodes, slack_node):
+    """Computes the ISF matrix (branches * nodes) from a sparse LU factorization of the susceptance
+    matrix without the slack node, instead of its dense inverse. The result equals create_ISF_matrix."""
+    t1 = time.perf_counter()
+    n_nodes = len(nodes)
+    is_not_slack = np.arange(n_nodes) != slack_node.index
+    B = create_sparse_susceptance_matrix(n_nodes, branches)
+    factorization = splu(B[is_not_slack][:, is_not_slack].tocsc())
+
+    columns = np.arange(len(branches))
+    incidence = np.zeros((n_nodes, len(branches)))
+    incidence[[branch.node_from.index for branch in branches], columns] = 1
+    incidence[[branch.node_to.index for branch in branches], columns] -= 1
+    impedance = np.array([branch.impedance for branch in branches])
+    ISF = np.zeros((len(branches), n_nodes))
+    ISF[:, is_not_slack] = -factorization.solve(incidence[is_not_slack]).T / impedance[:, np.newaxis]
+    logging.info(f"ISF matrix computed on a sparse factorization in "
+                 f"{round(time.perf_counter() - t1, 1)} seconds.")
+    return ISF
+
+
+@report_stage
 def create_PTDF_matrix(branches, ISF):
-    t1 = time.clock()
+    t1 = time.perf_counter()
     list_PTDF = []
     for branch in branches:
         column = np.array((ISF[:, branch.node_from.index] - ISF[:, branch.node_to.index]))
         list_PTDF.append(column)
     PTDF = np.transpose(np.array(list_PTDF))
 
-    logging.info(f"PTDF computed in {round(time.clock() - t1, 1)} seconds.")
+    logging.info(f"PTDF computed in {round(time.perf_counter() - t1, 1)} seconds.")
     return PTDF
 
 
@@ -86,7 +122,30 @@ def set_PTDF_on_branches(PTDF, branches, epsilon):
             if branch.PTDF > 1 + epsilon:
                 logging.debug(f"Branch '{branch.name_branch}' has selfPTDF over 1: {branch.PTDF}")
 
+    validate_radial_branches(branches, epsilon)
 
+
+def validate_radial_branches(branches, epsilon):
+    """Cross-checks the structural radial marking (see mark_radial_branches) against selfPTDF,
+    which is 1 for radial branches. Branches that are not radial but have a selfPTDF of 1 within
+    epsilon are numerically indistinguishable from radial ones and are marked radial as well."""
+    radial_mismatch = [branch for branch in branches
+                       if branch.is_radial and abs(branch.PTDF - 1) > epsilon]
+    numerically_radial = [branch for branch in branches
+                          if not branch.is_radial and branch.PTDF > 1 - epsilon]
+    if len(radial_mismatch) + len(numerically_radial) > 0:
+        logging.info(f"{len(radial_mismatch) + len(numerically_radial)} out of {len(branches)} "
+                     f"branches have a selfPTDF not matching their topology, "
+                     f"see log file for details.")
+    for branch in radial_mismatch:
+        logging.debug(f"Radial branch '{branch.name_branch}' has selfPTDF {branch.PTDF}")
+    for branch in numerically_radial:
+        logging.debug(f"Branch '{branch.name_branch}' is not radial but has selfPTDF "
+                      f"{branch.PTDF}, it is treated as radial.")
+        branch.is_radial = True
+
+
+@report_stage
 def create_LODF_matrix(branches, PTDF, epsilon):
     """
     This function computes a LODF matrix from a PTDF matrix. It is assumed that the PTDF matrix
@@ -96,23 +155,63 @@ def create_LODF_matrix(branches, PTDF, epsilon):
     :param epsilon: sensitivity to determine == 1
     :return: a square matrix of size n*n of Line Outage Distribution Factors.
     """
-    t0 = time.clock()
+    t0 = time.perf_counter()
 
     list_LODF = []
     for branch in branches:
-        if branch.PTDF < 1 - epsilon:
+        if not branch.is_radial:
             column = np.array(PTDF[:, branch.index] / (1 - branch.PTDF))
             column[branch.index] = 0.0
         else:
             column = np.zeros(PTDF.shape[0])
         list_LODF.append(column)
     LODF = np.transpose(np.array(list_LODF))
-    logging.info(f"LODF (N-1 IF) computed in {round(time.clock() - t0, 1)} seconds.")
+    logging.info(f"LODF (N-1 IF) computed in {round(time.perf_counter() - t0, 1)} seconds.")
     return LODF
 
 
+@report_stage
+def update_PTDF_matrix(PTDF, impedance, changed_idx, new_impedance):
+    """
+    Updates a PTDF matrix for new impedances of some branches, np.inf for an opened branch, with a
+    Sherman-Morrison-Woodbury rank-k correction instead of inverting the new susceptance matrix:
+    PTDF' = diag(b'/b) (PTDF - PTDF[:, K] (I + diag(db x_K) PTDF[K, K])^-1 diag(db x_K) PTDF[K, :])
+    with K the changed branches, x their impedances and db the change of their susceptances. The
+    rows of opened branches are 0.
+    :param PTDF: a square matrix of size n*n of Power Transfer Distribution Factors
+    :param impedance: the n impedances the PTDF matrix was computed with
+    :param changed_idx: indices of the k changed branches
+    :param new_impedance: the k new impedances
+    :return: the updated PTDF matrix. Raises a ValueError if opened branches split the grid.
+    """
+    t0 = time.perf_counter()
+    changed_idx = np.asarray(changed_idx, dtype=np.int64)
+    # b'/b = x/x' and db x = x/x' - 1
+    susceptance_ratio = impedance[changed_idx] / np.asarray(new_impedance, dtype=np.float64)
+    delta_bx = susceptance_ratio - 1
+    capacitance = np.eye(len(changed_idx)) + delta_bx[:, np.newaxis] * PTDF[np.ix_(changed_idx, changed_idx)]
+    if np.linalg.cond(capacitance) > 1e10:
+        raise ValueError("The new impedances split the grid, no PTDF can be computed.")
+    new_PTDF = PTDF - PTDF[:, changed_idx] @ np.linalg.solve(capacitance,
+                                                             delta_bx[:, np.newaxis] * PTDF[changed_idx, :])
+    new_PTDF[changed_idx, :] *= susceptance_ratio[:, np.newaxis]
+    logging.info(f"PTDF updated for {len(changed_idx)} branches in {round(time.perf_counter() - t0, 3)} "
+                 f"seconds.")
+    return new_PTDF
+
+
+def create_LODF_matrix_from_PTDF(PTDF, is_radial):
+    """Vectorized create_LODF_matrix for a PTDF matrix and the radial marking of its branches."""
+    self_PTDF = np.diag(PTDF)
+    LODF = PTDF / np.where(is_radial, 1.0, 1 - self_PTDF)[np.newaxis, :]
+    LODF[:, is_radial] = 0.0
+    np.fill_diagonal(LODF, 0.0)
+    return LODF
+
+
+@report_stage
 def create_PATL_matrix(branches):
-    t0 = time.clock()
+    t0 = time.perf_counter()
 
     array_PATL = np.array([elt.PATL for elt in branches])
 
@@ -124,24 +223,37 @@ def create_PATL_matrix(branches):
         else:
             list_PATL.append(np.array([1.0] * sizeP))
 
-    logging.info(f"Normalization matrix built in {round(time.clock() - t0, 3)} seconds.")
+    logging.info(f"Normalization matrix built in {round(time.perf_counter() - t0, 3)} seconds.")
     return np.array(list_PATL)
 
 
+def create_PATL_sub_matrix(array_PATL, set_columns, set_rows):
+    """Block of the normalization matrix of create_PATL_matrix for a given PATL vector, in order of
+    branch index, without building the full matrix."""
+    PATL_rows = array_PATL[set_rows.indices][:, np.newaxis]
+    PATL_columns = array_PATL[set_columns.indices][np.newaxis, :]
+    PATL_sub_matrix = np.ones((len(set_rows), len(set_columns)))
+    np.divide(PATL_columns, PATL_rows, out=PATL_sub_matrix,
+              where=np.broadcast_to(PATL_rows > 0, PATL_sub_matrix.shape))
+    return PATL_sub_matrix
+
+
 def create_set_external_contingencies(branches, epsilon):
     setR = [branch for branch in branches if branch.ring > 0]
     setR = exclude_radial_elements(setR, epsilon)
-    return setR
+    return BranchSet(setR)
 
 
 def create_set_external_contingencies_generators(generators, country):
     return [gen for gen in generators if gen.country != country]
 
 
-def create_set_within_control_area(branches, country, epsilon, settings):
+def create_set_within_control_area(branches, country, epsilon, settings, do_store_sets=True):
     setT = [branch for branch in branches if branch.ring == 0]
     logging.info(f"Control area contains {len(setT)} elements")
-    setT = exclude_radial_elements(setT, epsilon)
+    setT = BranchSet(exclude_radial_elements(setT, epsilon))
+    if not do_store_sets:
+        return setT
 
     case_folder_name = f"{settings.case_name}_{settings.input_file_name.replace('.', '_')}"
     fname = f"{country}_sets_T.csv"
@@ -157,10 +269,13 @@ def create_set_within_control_area(branches, country, epsilon, settings):
 
 
 def create_set_internal_external_maintenance(branches, LODF, PATL, setR, setT,
-                                             country, epsilon, settings):
-    setIext = create_set_external_maintenance(setR, setT, LODF, PATL, country, epsilon, settings)
+                                             country, epsilon, settings, do_store_sets=True):
+    setIext = create_set_external_maintenance(setR, setT, LODF, PATL, country, epsilon, settings,
+                                              do_store_sets)
     setIint = create_set_internal_maintenance(branches, epsilon)
     setI = setIext + setIint
+    if not do_store_sets:
+        return setI
 
     case_folder_name = f"{settings.case_name}_{settings.input_file_name.replace('.', '_')}"
     fname = f"{country}_sets_I.csv"
@@ -172,18 +287,19 @@ def create_set_internal_external_maintenance(branches, LODF, PATL, setR, setT,
     return setI
 
 
-def create_set_external_maintenance(setR, setT, inputLODF, PATL, country, epsilon, settings):
+def create_set_external_maintenance(setR, setT, inputLODF, PATL, country, epsilon, settings,
+                                    do_store_sets=True):
     setIext = []
     idx_ring = 1
-    branches_in_ring = [branch for branch in setR if branch.ring == idx_ring]
+    branches_in_ring = setR.in_ring(idx_ring)
     while len(branches_in_ring) > 0:
-        for i in range(len(branches_in_ring)):
-            setIext.append(branches_in_ring[i])
+        setIext.extend(branches_in_ring)
         idx_ring += 1
-        branches_in_ring = [branch for branch in setR if branch.ring == idx_ring]
-    setIext = exclude_radial_elements(setIext, epsilon)
+        branches_in_ring = setR.in_ring(idx_ring)
+    setIext = BranchSet(exclude_radial_elements(setIext, epsilon))
 
-    log_set_external_maintenance_to_file(PATL, country, inputLODF, setR, setT, settings)
+    if do_store_sets:
+        log_set_external_maintenance_to_file(PATL, country, inputLODF, setR, setT, settings)
     logging.info(f"External contingencies determined : {len(setIext)} elements selected "
                  f"within maximum ring # {idx_ring}")
 
@@ -199,7 +315,7 @@ def log_set_external_maintenance_to_file(PATL, country, inputLODF, setR, setT, s
     fileI.write("External contingencies " + '\n')
     fileI.write("Element,Ring,self-PTDF,max IF (non-normalized),max IF (normalized)" + '\n')
     idx_ring = 1
-    branches_in_ring = [branch for branch in setR if branch.ring == idx_ring]
+    branches_in_ring = setR.in_ring(idx_ring)
     while len(branches_in_ring) > 0:
         LODF = np.absolute(sub_matrix(branches_in_ring, setT, inputLODF))
         LODFn = LODF * sub_matrix(branches_in_ring, setT, PATL)
@@ -208,47 +324,98 @@ def log_set_external_maintenance_to_file(PATL, country, inputLODF, setR, setT, s
             fileI.write(f"{eltI.name_branch},{eltI.ring},{eltI.PTDF},"
                         f"{np.amax(LODF[:, i])},{np.amax(LODFn[:, i])}" + '\n')
         idx_ring += 1
-        branches_in_ring = [elt for elt in setR if elt.ring == idx_ring]
+        branches_in_ring = setR.in_ring(idx_ring)
     fileI.close()
 
 
+@report_stage
+def screen_contingencies(setI, setT, LODF, PATL, screening_policy, screening_value):
+    """Keeps the internal contingencies of setI and the external ones selected by the screening
+    policy, scored on their maximum N-1 LODF and normalized LODF on setT."""
+    t0 = time.perf_counter()
+
+    LODF_TI = np.absolute(sub_matrix(setI, setT, LODF))
+    LODFn_TI = LODF_TI * sub_matrix(setI, setT, PATL)
+    score = np.maximum(LODF_TI.max(axis=0, initial=0.0), LODFn_TI.max(axis=0, initial=0.0))
+
+    is_external = setI.rings > 0
+    is_kept = ~is_external
+    if screening_policy == ScreeningEnum.threshold:
+        is_kept |= is_external & (score >= screening_value)
+    elif screening_policy == ScreeningEnum.top_k:
+        for ring in np.unique(setI.rings[is_external]):
+            positions = np.flatnonzero(setI.rings == ring)
+            best = np.argsort(-score[positions], kind='stable')[:int(screening_value)]
+            is_kept[positions[best]] = True
+    elif screening_policy == ScreeningEnum.cumulative:
+        positions = np.flatnonzero(is_external)
+        order = positions[np.argsort(-score[positions], kind='stable')]
+        total_score = score[order].sum()
+        if total_score > 0:
+            share = np.cumsum(score[order]) / total_score
+            is_kept[order[:np.searchsorted(share, screening_value) + 1]] = True
+    else:
+        raise ValueError(f"Unknown contingency screening policy {screening_policy}.")
+
+    screened_setI = BranchSet([branch for branch, kept in zip(setI, is_kept) if kept])
+    set_counter('size_I_screened', len(screened_setI))
+    logging.info(f"Contingency screening ({screening_policy.name}, {screening_value}) kept "
+                 f"{len(screened_setI)}/{len(setI)} contingencies: "
+                 f"{round(100 * (1 - len(screened_setI) / max(len(setI), 1)), 1)}% of the N-2 "
+                 f"sweep eliminated, in {round(time.perf_counter() - t0, 3)} seconds.")
+    return screened_setI
+
+
 def create_set_internal_maintenance(branches, epsilon):
     set_I_internal_maintenance = [branch for branch in branches if branch.ring == 0]
-    set_I_internal_maintenance = exclude_radial_elements(set_I_internal_maintenance, epsilon)
+    set_I_internal_maintenance = BranchSet(exclude_radial_elements(set_I_internal_maintenance,
+                                                                   epsilon))
     logging.info(f"Internal maintenance set contains {len(set_I_internal_maintenance)} elements")
     return set_I_internal_maintenance
 
 
 def exclude_radial_elements(branch_list, epsilon):
-    result = []
-    for branch in branch_list:
-        if branch.PTDF > 1 - epsilon:
-            pass
-        else:
-            result.append(branch)
+    result = [branch for branch in branch_list if not branch.is_radial]
     logging.info(f"Radial elements which do not lead to disconnection of a "
                  f"generator are excluded : "
                  f"{len(result)}/{len(branch_list)} kept.")
     return result
 
 
-def compute_LODF_for_generators(setR_generators, ISF, all_generators):
-    t0 = time.clock()
+@report_stage
+def compute_LODF_for_generators(setR_generators, ISF, generator_arrays):
+    """
+    This function computes the LODF of each generator in setR_generators, assuming its power is
+    balanced by all other generators of the same country pro rata their power.
+    :param setR_generators: a list of g attached generators
+    :param ISF: a matrix of size n_branches*n_nodes of Injection Shift Factors
+    :param generator_arrays: GeneratorArrays of all attached generators
+    :return: a matrix of size n_branches*g of Line Outage Distribution Factors for generators.
+    """
+    t0 = time.perf_counter()
     logging.info("computing LODF for generators")
 
-    list_LODF_gens = []
-    for gen_r in setR_generators:
-        column = np.zeros(ISF.shape[0])
-        balancing_gens = [gen for gen in all_generators if
-                          gen.country == gen_r.country and gen != gen_r]
-        if len(balancing_gens) == 0:
-            logging.info(f"No generators found to balance the contingency of {gen_r.name_branch}")
-        else:
-            sum_balancing_power = sum([gen_bal.power for gen_bal in balancing_gens])
-            for gen_bal in balancing_gens:
-                PTDF_gen = ISF[:, gen_bal.node.index] - ISF[:, gen_r.node.index]
-                column += gen_bal.power / sum_balancing_power * (np.array(PTDF_gen))
-        list_LODF_gens.append(column)
-
-    logging.info(f"LODF determined for generators in {round(time.clock() - t0, 1)} seconds.")
-    return np.transpose(np.array(list_LODF_gens))
+    countries, country_idx = np.unique(generator_arrays.country, return_inverse=True)
+    power_per_node_and_country = np.zeros((ISF.shape[1], len(countries)))
+    np.add.at(power_per_node_and_country, (generator_arrays.node_index, country_idx),
+              generator_arrays.power)
+    ISF_per_country = ISF @ power_per_node_and_country
+    power_per_country = np.bincount(country_idx, weights=generator_arrays.power,
+                                    minlength=len(countries))
+    n_gens_per_country = np.bincount(country_idx, minlength=len(countries))
+
+    idx_r = np.array([gen.index for gen in setR_generators], dtype=np.int64)
+    country_r = country_idx[idx_r]
+    power_r = generator_arrays.power[idx_r]
+    ISF_r = ISF[:, generator_arrays.node_index[idx_r]]
+
+    has_balancing = n_gens_per_country[country_r] > 1
+    for gen_r in [gen for gen, ok in zip(setR_generators, has_balancing) if not ok]:
+        logging.info(f"No generators found to balance the contingency of {gen_r.name}")
+    balancing_power = np.where(has_balancing, power_per_country[country_r] - power_r, 1.0)
+
+    LODF_gens = (ISF_per_country[:, country_r] - power_r * ISF_r) / balancing_power - ISF_r
+    LODF_gens[:, ~has_balancing] = 0.0
+
+    logging.info(f"LODF determined for generators in {round(time.perf_counter() - t0, 1)} seconds.")
+    return LODF_gens
@@ -13,25 +13,12 @@ def sub_matrix(set_columns, set_rows, matrix_in):
     -lines from set_rows
     in a new array.
     """
-    list_of_rows = []
-    for i in range(len(set_rows)):
-        list_of_rows.append(matrix_in[set_rows[i].index, :])
-    mx_of_set_rows = np.array(list_of_rows)
-    list_of_columns = []
-    for i in range(len(set_columns)):
-        list_of_columns.append(mx_of_set_rows[:, set_columns[i].index])
-    return np.transpose(np.array(list_of_columns))
+    return matrix_in[np.ix_(set_rows.indices, set_columns.indices)]
 
 
 def combine_sets(setA, setB):
     # Function defined to avoid computations of N-k-k, required for computation on GPU.
-    results = -1 * np.ones(len(setA), dtype=np.int32)
-    for i in range(len(setA)):
-        try:
-            results[i] = setB.index(setA[i])
-        except:
-            pass
-    return results
+    return setA.get_positions_in(setB)
 
 
 def setup_logger():
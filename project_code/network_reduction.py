@@ -0,0 +1,211 @@
+"""Exact reduction of the network before factorization: dangling trees are eliminated and series
+chains (nodes with exactly two branches) are merged into equivalent branches. The ISF matrix of the
+original network is recovered from the ISF matrix of the reduced network, so all sensitivities and
+influence factors are still computed on the original elements.
+"""
+
+import logging
+import time
+
+import numpy as np
+
+from project_code.classes import NetworkReduction
+from project_code.instrumentation import report_stage
+from project_code.matrix_and_set_functions import build_inv_susceptance_matrix, build_ISF_matrix
+
+
+def reduce_network(nodes, branches, slack_node):
+    """Eliminates dangling trees and merges series chains. The slack node is never eliminated.
+    Assumes nodes and branches are stored in index order."""
+    node_from = np.array([branch.node_from.index for branch in branches], dtype=np.int64)
+    node_to = np.array([branch.node_to.index for branch in branches], dtype=np.int64)
+    impedance = np.array([branch.impedance for branch in branches])
+    return reduce_network_from_arrays(len(nodes), node_from, node_to, impedance, slack_node.index)
+
+
+@report_stage
+def reduce_network_from_arrays(n_nodes, node_from, node_to, impedance, slack_idx):
+    t0 = time.perf_counter()
+
+    incident = [set() for _ in range(n_nodes)]
+    for idx in range(len(node_from)):
+        incident[node_from[idx]].add(idx)
+        incident[node_to[idx]].add(idx)
+
+    tree_parent, tree_branch, tree_order = eliminate_dangling_trees(incident, node_from, node_to,
+                                                                    slack_idx)
+    chains, is_merged = merge_series_chains(incident, node_from, node_to, impedance, slack_idx,
+                                            tree_parent >= 0)
+
+    reduction = create_network_reduction(len(node_from), node_from, node_to, impedance, slack_idx,
+                                         tree_parent, tree_branch, tree_order, chains, is_merged)
+
+    logging.info(f"Network reduced from {n_nodes} nodes and {len(node_from)} branches to "
+                 f"{reduction.n_reduced_nodes} nodes and {reduction.n_reduced_branches} branches "
+                 f"({len(tree_order)} nodes in dangling trees, {int(is_merged.sum())} nodes in "
+                 f"series chains) in {round(time.perf_counter() - t0, 3)} seconds.")
+    return reduction
+
+
+def eliminate_dangling_trees(incident, node_from, node_to, slack_idx):
+    """Repeatedly eliminates nodes with a single branch. Updates incident in place. Returns per node
+    the neighbour it was attached to and the branch it was attached by (-1 if not eliminated), and
+    the order of elimination."""
+    n_nodes = len(incident)
+    tree_parent = -1 * np.ones(n_nodes, dtype=np.int64)
+    tree_branch = -1 * np.ones(n_nodes, dtype=np.int64)
+    tree_order = []
+
+    candidates = [idx for idx in range(n_nodes) if len(incident[idx]) == 1 and idx != slack_idx]
+    while candidates:
+        idx = candidates.pop()
+        if tree_parent[idx] >= 0 or len(incident[idx]) != 1 or idx == slack_idx:
+            continue
+        (branch_idx,) = incident[idx]
+        other = node_to[branch_idx] if node_from[branch_idx] == idx else node_from[branch_idx]
+        tree_parent[idx] = other
+        tree_branch[idx] = branch_idx
+        tree_order.append(idx)
+        incident[idx].clear()
+        incident[other].discard(branch_idx)
+        if len(incident[other]) == 1 and other != slack_idx:
+            candidates.append(other)
+
+    return tree_parent, tree_branch, tree_order
+
+
+def merge_series_chains(incident, node_from, node_to, impedance, slack_idx, is_eliminated):
+    """Merges branches meeting in nodes that have exactly two branches to two different neighbours.
+    Updates incident in place. Returns the chains of the reduced network as a dict of
+    id -> (end node a, end node b, [(original branch, +1/-1 for direction a->b), ...], impedance),
+    and per node whether it was merged away."""
+    n_nodes = len(incident)
+    is_merged = np.zeros(n_nodes, dtype=bool)
+    chains = {idx: (node_from[idx], node_to[idx], [(idx, 1)], impedance[idx])
+              for idx in range(len(node_from))
+              if not (is_eliminated[node_from[idx]] or is_eliminated[node_to[idx]])}
+    next_id = len(node_from)
+
+    for idx in range(n_nodes):
+        if is_eliminated[idx] or idx == slack_idx or len(incident[idx]) != 2:
+            continue
+        id_1, id_2 = incident[idx]
+        end_u, sequence_1, impedance_1 = get_chain_towards_node(chains[id_1], idx)
+        end_v, sequence_2, impedance_2 = get_chain_towards_node(chains[id_2], idx)
+        if end_u == end_v or end_u == idx or end_v == idx:
+            continue
+        if abs(impedance_1 + impedance_2) < 1e-12:
+            continue  # equivalent branch would have no impedance
+
+        sequence_2 = [(branch_idx, -sign) for (branch_idx, sign) in reversed(sequence_2)]
+        chains[next_id] = (end_u, end_v, sequence_1 + sequence_2, impedance_1 + impedance_2)
+        del chains[id_1]
+        del chains[id_2]
+        incident[end_u].discard(id_1)
+        incident[end_u].add(next_id)
+        incident[end_v].discard(id_2)
+        incident[end_v].add(next_id)
+        incident[idx].clear()
+        is_merged[idx] = True
+        next_id += 1
+
+    return chains, is_merged
+
+
+def get_chain_towards_node(chain, idx):
+    """Returns the other end of a chain ending in node idx, and its branches ordered towards idx."""
+    end_a, end_b, sequence, chain_impedance = chain
+    if end_b == idx:
+        return end_a, sequence, chain_impedance
+    return end_b, [(branch_idx, -sign) for (branch_idx, sign) in reversed(sequence)], \
+        chain_impedance
+
+
+def create_network_reduction(n_branches, node_from, node_to, impedance, slack_idx,
+                             tree_parent, tree_branch, tree_order, chains, is_merged):
+    n_nodes = len(tree_parent)
+    is_kept = (tree_parent < 0) & ~is_merged
+    reduced_idx = -1 * np.ones(n_nodes, dtype=np.int64)
+    reduced_idx[is_kept] = np.arange(int(is_kept.sum()))
+
+    node_rep = np.zeros((n_nodes, 2), dtype=np.int64)
+    node_weight = np.zeros((n_nodes, 2))
+    node_rep[is_kept, 0] = reduced_idx[is_kept]
+    node_weight[is_kept, 0] = 1.0
+    local_terms = {}
+
+    branch_to_reduced = -1 * np.ones(n_branches, dtype=np.int64)
+    branch_sign = np.zeros(n_branches)
+    reduced_from, reduced_to, reduced_impedance = [], [], []
+    for chain_idx, (end_a, end_b, sequence, chain_impedance) in enumerate(chains.values()):
+        reduced_from.append(reduced_idx[end_a])
+        reduced_to.append(reduced_idx[end_b])
+        reduced_impedance.append(chain_impedance)
+
+        # An injection in an internal node m of chain a-b is seen by the reduced network as
+        # injections in a and b, shared in inverse proportion to the impedance between m and a, b.
+        # The branches between a and m (m and b) carry in addition -x_mb/x_ab (+x_am/x_ab).
+        node = end_a
+        impedance_a_m = 0.0
+        for position, (branch_idx, sign) in enumerate(sequence):
+            branch_to_reduced[branch_idx] = chain_idx
+            branch_sign[branch_idx] = sign
+            node = node_to[branch_idx] if node_from[branch_idx] == node else node_from[branch_idx]
+            impedance_a_m += impedance[branch_idx]
+            if position == len(sequence) - 1:
+                continue
+            share_b = impedance_a_m / chain_impedance
+            node_rep[node] = (reduced_idx[end_a], reduced_idx[end_b])
+            node_weight[node] = (1 - share_b, share_b)
+            local_terms[node] = [(idx, -(1 - share_b) * s) for (idx, s) in sequence[:position + 1]]
+            local_terms[node] += [(idx, share_b * s) for (idx, s) in sequence[position + 1:]]
+
+    # An injection in a node of a dangling tree flows to the node the tree is attached to.
+    for idx in reversed(tree_order):
+        parent = tree_parent[idx]
+        node_rep[idx] = node_rep[parent]
+        node_weight[idx] = node_weight[parent]
+        direction = 1.0 if node_from[tree_branch[idx]] == idx else -1.0
+        local_terms[idx] = local_terms.get(parent, []) + [(tree_branch[idx], direction)]
+
+    local_branch, local_node, local_value = [], [], []
+    for idx, terms in local_terms.items():
+        for (branch_idx, value) in terms:
+            local_branch.append(branch_idx)
+            local_node.append(idx)
+            local_value.append(value)
+
+    return NetworkReduction(n_nodes, n_branches, int(is_kept.sum()),
+                            np.array(reduced_from, dtype=np.int64),
+                            np.array(reduced_to, dtype=np.int64),
+                            np.array(reduced_impedance), reduced_idx[slack_idx],
+                            branch_to_reduced, branch_sign, node_rep, node_weight,
+                            np.array(local_branch, dtype=np.int64),
+                            np.array(local_node, dtype=np.int64), np.array(local_value))
+
+
+@report_stage
+def create_ISF_matrix_from_reduced_network(reduction):
+    """Factorizes the reduced network and expands its ISF matrix to the original branches and nodes.
+    The result equals create_ISF_matrix on the original network."""
+    if reduction.n_reduced_nodes > 1:
+        inv_B = build_inv_susceptance_matrix(reduction.n_reduced_nodes, reduction.node_from,
+                                             reduction.node_to, reduction.impedance,
+                                             reduction.slack_idx)
+        reduced_ISF = build_ISF_matrix(reduction.node_from, reduction.node_to, reduction.impedance,
+                                       inv_B, reduction.slack_idx)
+    else:  # the network is a tree: all flows are local
+        reduced_ISF = np.zeros((reduction.n_reduced_branches, reduction.n_reduced_nodes))
+
+    t0 = time.perf_counter()
+    reduced_ISF_per_node = reduced_ISF[:, reduction.node_rep[:, 0]] * reduction.node_weight[:, 0] + \
+        reduced_ISF[:, reduction.node_rep[:, 1]] * reduction.node_weight[:, 1]
+
+    ISF = np.zeros((reduction.n_branches, reduction.n_nodes))
+    in_reduced = reduction.branch_to_reduced >= 0
+    ISF[in_reduced] = reduction.branch_sign[in_reduced, np.newaxis] * \
+        reduced_ISF_per_node[reduction.branch_to_reduced[in_reduced]]
+    np.add.at(ISF, (reduction.local_branch, reduction.local_node), reduction.local_value)
+    logging.info(f"ISF matrix expanded to the original network in "
+                 f"{round(time.perf_counter() - t0, 1)} seconds.")
+    return ISF
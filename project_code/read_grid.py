@@ -7,7 +7,9 @@ import math
 import numpy as np
 import itertools
 import logging
+from pathlib import Path
 
+from definitions import ROOT_DIR
 from project_code.classes import Branch, Node, GenerationUnit, BranchTypeEnum
 from project_code.settings import FileTypeEnum
 from project_code.topology_getter.serviceenumsandcontants import ComponentStatus
@@ -429,6 +431,32 @@ def read_couplers_uct(file_contents, settings):
     return coupler_attributes
 
 
+def read_rating_sets(branches, settings):
+    """Reads the rating sets of settings.rating_sets. Returns the names of the rating sets and an
+    array (rating sets * branches, in order of branch index) of PATL in MW."""
+    names = list(settings.rating_sets)
+    ratings = np.zeros((len(names), len(branches)))
+    branch_by_name = {branch.name_branch: branch for branch in branches}
+    for idx, name in enumerate(names):
+        for branch in branches:
+            ratings[idx, branch.index] = branch.PATL
+        with open(Path(ROOT_DIR) / "source_files" / settings.rating_sets[name], "r") as file:
+            lines = [line.split(',') for line in file.read().split('\n') if line.strip() != '']
+        n_not_found = 0
+        for (name_branch, PATL) in lines:
+            branch = branch_by_name.get(name_branch.strip())
+            if branch is None:
+                n_not_found += 1
+                continue
+            PATL = float(PATL)
+            if PATL > Branch.IATL_max * math.sqrt(3) * branch.v_base / 1000:
+                PATL = 0
+            ratings[idx, branch.index] = PATL
+        logging.info(f"Rating set {name} read: {len(lines) - n_not_found} ratings applied, "
+                     f"{n_not_found} branches not found.")
+    return names, ratings
+
+
 def create_nodes_and_update_branches_with_node_info(branches):
     """Based on node names in branches, do the following:
     1. create node objects for each node
@@ -502,7 +530,8 @@ def set_node_country(nodes, settings):
     elif (settings.file_type == FileTypeEnum.psse) and (settings.case_name == 'Test'):
 
         for node in nodes:
-            name_int = int(node.name)
+            # star nodes of three winding transformers take the country of their first bus
+            name_int = int(node.name.split('_T')[0])
             if (name_int >= 1) and (name_int < 115):
                 node.country = 'A'
             elif (name_int >= 115) and (name_int < 189):
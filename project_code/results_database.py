@@ -0,0 +1,216 @@
+"""Optional SQLite sink collecting the results of all runs in output_files/<settings.results_database>.
+
+Each country of a run is a row of table runs (case, input file, settings, country, timestamp of the
+snapshot, see get_snapshot_time). The
+results of the external branches and generators and the members of the sets R, T and I refer to it
+by run_id, branches being identified by their name (Branch.name_branch). The query functions take the
+path of the database and return lists of sqlite3.Row, whose values are accessed by column name."""
+import contextlib
+import datetime
+import logging
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+from definitions import ROOT_DIR
+from project_code.instrumentation import report_stage
+
+# Date and time of a snapshot in the UCTE file naming convention, e.g. 20180101_1030_SN1_UX0.uct
+FILE_NAME_TIME = re.compile(r'(?<!\d)(\d{8})_(\d{4})(?!\d)')
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    case_name TEXT NOT NULL,
+    input_file_name TEXT NOT NULL,
+    settings_name TEXT NOT NULL,
+    country TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    element TEXT NOT NULL,
+    display_name TEXT,
+    element_country TEXT,
+    ring INTEGER,
+    IF_N2 REAL,
+    norm_IF_N2 REAL,
+    I TEXT,
+    T TEXT,
+    I_norm TEXT,
+    T_norm TEXT
+);
+CREATE TABLE IF NOT EXISTS results_generators (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    generator TEXT NOT NULL,
+    power REAL,
+    IF_N2 REAL,
+    norm_IF_N2 REAL
+);
+CREATE TABLE IF NOT EXISTS set_members (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    set_name TEXT NOT NULL,
+    element TEXT NOT NULL,
+    ring INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_case_country_timestamp ON runs (case_name, country, timestamp);
+CREATE INDEX IF NOT EXISTS runs_country_timestamp ON runs (country, timestamp);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (timestamp);
+CREATE INDEX IF NOT EXISTS results_element ON results (element, run_id);
+CREATE INDEX IF NOT EXISTS results_run ON results (run_id);
+CREATE INDEX IF NOT EXISTS results_generators_generator ON results_generators (generator, run_id);
+CREATE INDEX IF NOT EXISTS results_generators_run ON results_generators (run_id);
+CREATE INDEX IF NOT EXISTS set_members_element ON set_members (element, run_id);
+CREATE INDEX IF NOT EXISTS set_members_run ON set_members (run_id, set_name);
+"""
+
+
+def get_database_path(settings):
+    fpath = Path(ROOT_DIR) / "output_files"
+    if not fpath.exists():
+        fpath.mkdir(parents=True)
+    return fpath / settings.results_database
+
+
+@contextlib.contextmanager
+def connect(database_path):
+    """Opens the database, creating its tables if needed, and commits and closes it on exit."""
+    connection = sqlite3.connect(str(database_path))
+    try:
+        connection.row_factory = sqlite3.Row
+        connection.executescript(SCHEMA)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def get_name(element):
+    return None if element is None else element.name_branch
+
+
+def get_snapshot_time(settings):
+    """Time of the snapshot of settings, in ISO format: settings.snapshot_time if set, else the date and
+    time of the file name (UCTE file naming convention yyyymmdd_hhmm), else the modification time (UTC)
+    of the input file. None if the input file cannot be found."""
+    if settings.snapshot_time is not None:
+        return settings.snapshot_time
+    for match in FILE_NAME_TIME.finditer(Path(settings.input_file_name).name):
+        try:
+            return datetime.datetime.strptime(''.join(match.groups()), '%Y%m%d%H%M').strftime(TIMESTAMP_FORMAT)
+        except ValueError:  # digits that are not a date
+            continue
+    try:
+        modification_time = (Path(ROOT_DIR) / "source_files" / settings.input_file_name).stat().st_mtime
+    except OSError:
+        return None
+    return datetime.datetime.fromtimestamp(modification_time, datetime.timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def add_run(settings, country, timestamp=None):
+    """Adds a run for a country and returns its run_id. timestamp is the time of the snapshot (see
+    get_snapshot_time), in ISO format, and defaults to the current UTC time."""
+    if timestamp is None:
+        timestamp = datetime.datetime.now(datetime.timezone.utc).strftime(TIMESTAMP_FORMAT)
+    with connect(get_database_path(settings)) as connection:
+        cursor = connection.execute(
+            "INSERT INTO runs (case_name, input_file_name, settings_name, country, timestamp) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (settings.case_name, settings.input_file_name,
+             getattr(settings.settings_name, 'name', str(settings.settings_name)), country, timestamp))
+        return cursor.lastrowid
+
+
+def add_set_members(settings, run_id, sets):
+    """Adds the members of sets given as a dictionary {set name: BranchSet}."""
+    with connect(get_database_path(settings)) as connection:
+        for set_name, branch_set in sets.items():
+            connection.executemany(
+                "INSERT INTO set_members (run_id, set_name, element, ring) VALUES (?, ?, ?, ?)",
+                [(run_id, set_name, branch.name_branch, branch.ring) for branch in branch_set])
+
+
+@report_stage
+def add_results(settings, run_id, results):
+    t0 = time.perf_counter()
+    with connect(get_database_path(settings)) as connection:
+        connection.executemany(
+            "INSERT INTO results (run_id, element, display_name, element_country, ring, IF_N2, "
+            "norm_IF_N2, I, T, I_norm, T_norm) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(run_id, result.eltR.name_branch, result.eltR.display_name, result.eltR.country,
+              result.eltR.ring, float(result.IFN2), float(result.nIFN2), get_name(result.eltI),
+              get_name(result.eltT), get_name(result.eltIn), get_name(result.eltTn))
+             for result in results])
+    logging.info(f"Results stored in database in {round(time.perf_counter() - t0, 3)} seconds.")
+
+
+@report_stage
+def add_results_generators(settings, run_id, results):
+    with connect(get_database_path(settings)) as connection:
+        connection.executemany(
+            "INSERT INTO results_generators (run_id, generator, power, IF_N2, norm_IF_N2) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(run_id, result.name, float(result.power), float(result.IF), float(result.IF_norm))
+             for result in results])
+
+
+def get_run_filter(case_name=None, country=None, since=None, until=None):
+    """Returns the SQL condition on table runs and its parameters. since and until are ISO
+    timestamps, both included."""
+    conditions, parameters = [], []
+    for condition, value in [("runs.case_name = ?", case_name), ("runs.country = ?", country),
+                             ("runs.timestamp >= ?", since), ("runs.timestamp <= ?", until)]:
+        if value is not None:
+            conditions.append(condition)
+            parameters.append(value)
+    return ' AND '.join(conditions) if conditions else '1', parameters
+
+
+def query_runs(database_path, case_name=None, country=None, since=None, until=None):
+    condition, parameters = get_run_filter(case_name, country, since, until)
+    with connect(database_path) as connection:
+        return connection.execute(f"SELECT * FROM runs WHERE {condition} ORDER BY timestamp, run_id",
+                                  parameters).fetchall()
+
+
+def query_IF_history(database_path, element, case_name=None, country=None, since=None, until=None):
+    """Returns the results of an external branch over the runs, in chronological order, with the
+    columns of the run (case_name, input_file_name, country, timestamp)."""
+    condition, parameters = get_run_filter(case_name, country, since, until)
+    with connect(database_path) as connection:
+        return connection.execute(
+            f"SELECT runs.case_name, runs.input_file_name, runs.country, runs.timestamp, results.* "
+            f"FROM results JOIN runs ON results.run_id = runs.run_id "
+            f"WHERE results.element = ? AND {condition} ORDER BY runs.timestamp, runs.run_id",
+            [element] + parameters).fetchall()
+
+
+def query_generator_IF_history(database_path, generator, case_name=None, country=None, since=None,
+                               until=None):
+    condition, parameters = get_run_filter(case_name, country, since, until)
+    with connect(database_path) as connection:
+        return connection.execute(
+            f"SELECT runs.case_name, runs.input_file_name, runs.country, runs.timestamp, "
+            f"results_generators.* FROM results_generators "
+            f"JOIN runs ON results_generators.run_id = runs.run_id "
+            f"WHERE results_generators.generator = ? AND {condition} "
+            f"ORDER BY runs.timestamp, runs.run_id",
+            [generator] + parameters).fetchall()
+
+
+def query_set_members(database_path, run_id, set_name):
+    """Returns the names of the members of set set_name ('R', 'T' or 'I') in a run."""
+    with connect(database_path) as connection:
+        return [row['element'] for row in connection.execute(
+            "SELECT element FROM set_members WHERE run_id = ? AND set_name = ? ORDER BY rowid",
+            (run_id, set_name))]
+
+
+def query_top_elements(database_path, run_id, n_elements=10, do_normalized=False):
+    """Returns the n_elements results of a run with the largest IF (or normalized IF)."""
+    column = 'norm_IF_N2' if do_normalized else 'IF_N2'
+    with connect(database_path) as connection:
+        return connection.execute(f"SELECT * FROM results WHERE run_id = ? ORDER BY {column} DESC "
+                                  f"LIMIT ?", (run_id, n_elements)).fetchall()
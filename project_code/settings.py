@@ -2,6 +2,8 @@ import enum
 
 SettingsEnum = enum.Enum(value='SettingsEnum', names=('PSSE0', 'PSSE1', 'UCT0', 'PSSETest'))
 FileTypeEnum = enum.Enum(value='FileTypeEnum', names=('uct', 'psse'))
+ScreeningEnum = enum.Enum(value='ScreeningEnum', names=('threshold', 'top_k', 'cumulative'))
+OutputFormatEnum = enum.Enum(value='OutputFormatEnum', names=('csv', 'hdf5'))
 
 
 def get_settings(settings_set_name):
@@ -65,8 +67,8 @@ def get_settings(settings_set_name):
 # noinspection PyPep8Naming
 class Settings:
     """Defines a library of settings.
-    input_file_name: takes PSSE .sav files and UCTE files .uct. Input file is assumed to be placed in folder
-    source_files.
+    input_file_name: takes PSSE .sav files, PSSE .raw files (read without PSSE) and UCTE files .uct. Input file is
+    assumed to be placed in folder source_files.
     case_name: used to determine which country mapping to apply. If you have an input file that is a variation on
     a file that has earlier been used in this calculation, check the case_name of this earlier file and use it.
     If you have an input file where no clear country mapping is yet available, define a new case_name and use this in
@@ -80,6 +82,48 @@ class Settings:
     do_calculate_generator_IF: if True, influence factors for generators are also calculated. If false, this is skipped.
     dictVbase_uct: voltages for UCT file setting import - not used for other types of files.
     min_voltage_level_PSSE_kV: minimum votlage level for which file contents are taken into account.
+    do_reduce_network: if True, dangling trees and series chains are reduced out of the network before
+    factorization. Results are identical, but the susceptance matrix to invert is smaller.
+    max_ring: if set, only external elements up to this ring are assessed, and the ISF matrix is solved on a sparse
+    factorization of the susceptance matrix instead of its dense inverse (unless do_reduce_network is set).
+    Contingencies beyond max_ring are kept, the IFs of the assessed elements are unchanged. None assesses the
+    elements of all rings.
+    screening_policy: if set (ScreeningEnum), external contingencies of I are screened on their maximum N-1 LODF and
+    normalized LODF on T: threshold keeps elements above screening_value, top_k keeps the screening_value best
+    elements per ring and cumulative keeps the best elements up to a share screening_value of the total influence.
+    Internal contingencies are always kept.
+    screening_value: threshold, number of elements per ring or cumulative share used by screening_policy.
+    relevance_threshold: threshold on the IF and normalized IF above which an external element is relevant for the
+    control area.
+    do_stop_at_irrelevant_rings: if True (requires relevance_threshold), rings are computed in increasing order and the
+    computation stops when an upper bound shows that no element of the remaining rings can reach relevance_threshold.
+    These elements are reported below threshold with their bound instead of their IF.
+    do_relevance_only: if True (requires relevance_threshold), only whether each external element reaches relevance_threshold is
+    determined, with the first contingency and monitored element found above the threshold. This is much cheaper
+    than the search for the maximum IF. Cannot be combined with do_stop_at_irrelevant_rings.
+    n_top_witnesses: if above 0, the n_top_witnesses largest IF and normalized IF per external element are kept with their
+    contingency and monitored element, and written to <country>_results_top_witnesses.csv.
+    rating_sets: dictionary of additional rating sets {name: file name}, e.g. seasonal ratings. Files are placed in
+    source_files, with one line "branch name,PATL [MW]" per branch; other branches keep the PATL of the input file.
+    Normalized IFs for all rating sets are computed in the same sweep, and stored in <country>_results_<name>.csv.
+    do_multi_country_sweep: if True, the topology and matrices are built once for all countries and the IFs of all countries are
+    computed in a single sweep. Countries outside the main connected component of the first country are skipped.
+    The options max_ring, screening_policy, relevance_threshold, n_top_witnesses and rating_sets are not supported
+    in this mode.
+    output_format: csv or hdf5 (as enum). hdf5 writes the results, the results of additional rating sets, the top
+    witnesses and the generator results as typed columns of <country>_results.h5, with element indices into a names
+    table (see store_functions.py). Relevance and below threshold results are always written to csv.
+    results_database: if set, file name of an SQLite database in output_files to which the results, the generator results
+    and the members of the sets R, T and I (after screening) of each country are appended (see results_database.py for
+    the queries).
+    snapshot_time: time of the snapshot in ISO format (e.g. '2018-01-01T10:30:00'), stored with the runs in the results
+    database. If None, it is read from the file name (UCTE file naming convention yyyymmdd_hhmm), or else taken from
+    the modification time of the input file. Batch runs always read it from each file.
+    do_store_pair_maxima: if True, the maximum IF and normalized IF over T of each pair (i, r), with the t reaching them,
+    are streamed to the chunked and compressed <country>_pair_maxima.h5 during the computation. Not supported in the
+    multi-country sweep and the relevance only mode.
+    do_trace_memory: if True, the peak memory allocated through Python of each stage is traced with tracemalloc and
+    added to <country>_run_report.json. This slows the run down noticeably.
     """
 
     def __init__(
@@ -93,7 +137,22 @@ class Settings:
             do_merge_couplers,
             do_calculate_generator_IF,
             dictVbase_uct,
-            min_voltage_level_PSSE_kV
+            min_voltage_level_PSSE_kV,
+            do_reduce_network=False,
+            max_ring=None,
+            screening_policy=None,
+            screening_value=None,
+            relevance_threshold=None,
+            do_stop_at_irrelevant_rings=False,
+            do_relevance_only=False,
+            n_top_witnesses=0,
+            rating_sets=None,
+            do_multi_country_sweep=False,
+            output_format=OutputFormatEnum.csv,
+            results_database=None,
+            snapshot_time=None,
+            do_store_pair_maxima=False,
+            do_trace_memory=False
     ):
         self.settings_name = settings_name
         self.input_file_name = input_file_name
@@ -105,6 +164,21 @@ class Settings:
         self.do_calculate_generator_IF = do_calculate_generator_IF
         self.dictVbase_uct = dictVbase_uct
         self.min_voltage_level_PSSE_kV = min_voltage_level_PSSE_kV
+        self.do_reduce_network = do_reduce_network
+        self.max_ring = max_ring
+        self.screening_policy = screening_policy
+        self.screening_value = screening_value
+        self.relevance_threshold = relevance_threshold
+        self.do_stop_at_irrelevant_rings = do_stop_at_irrelevant_rings
+        self.do_relevance_only = do_relevance_only
+        self.n_top_witnesses = n_top_witnesses
+        self.rating_sets = rating_sets
+        self.do_multi_country_sweep = do_multi_country_sweep
+        self.output_format = output_format
+        self.results_database = results_database
+        self.snapshot_time = snapshot_time
+        self.do_store_pair_maxima = do_store_pair_maxima
+        self.do_trace_memory = do_trace_memory
 
 
 # noinspection PyPep8Naming
@@ -118,7 +192,22 @@ class PsseSettings(Settings):
             eps,
             do_merge_couplers,
             do_calculate_generator_IF,
-            min_voltage_level_PSSE_kV
+            min_voltage_level_PSSE_kV,
+            do_reduce_network=False,
+            max_ring=None,
+            screening_policy=None,
+            screening_value=None,
+            relevance_threshold=None,
+            do_stop_at_irrelevant_rings=False,
+            do_relevance_only=False,
+            n_top_witnesses=0,
+            rating_sets=None,
+            do_multi_country_sweep=False,
+            output_format=OutputFormatEnum.csv,
+            results_database=None,
+            snapshot_time=None,
+            do_store_pair_maxima=False,
+            do_trace_memory=False
     ):
         super().__init__(
             settings_name=settings_name,
@@ -130,7 +219,22 @@ class PsseSettings(Settings):
             do_merge_couplers=do_merge_couplers,
             do_calculate_generator_IF=do_calculate_generator_IF,
             dictVbase_uct=None,
-            min_voltage_level_PSSE_kV=min_voltage_level_PSSE_kV
+            min_voltage_level_PSSE_kV=min_voltage_level_PSSE_kV,
+            do_reduce_network=do_reduce_network,
+            max_ring=max_ring,
+            screening_policy=screening_policy,
+            screening_value=screening_value,
+            relevance_threshold=relevance_threshold,
+            do_stop_at_irrelevant_rings=do_stop_at_irrelevant_rings,
+            do_relevance_only=do_relevance_only,
+            n_top_witnesses=n_top_witnesses,
+            rating_sets=rating_sets,
+            do_multi_country_sweep=do_multi_country_sweep,
+            output_format=output_format,
+            results_database=results_database,
+            snapshot_time=snapshot_time,
+            do_store_pair_maxima=do_store_pair_maxima,
+            do_trace_memory=do_trace_memory
         )
 
 
@@ -145,7 +249,22 @@ class UCTSettings(Settings):
             eps,
             do_merge_couplers,
             do_calculate_generator_IF,
-            dictVbase_uct
+            dictVbase_uct,
+            do_reduce_network=False,
+            max_ring=None,
+            screening_policy=None,
+            screening_value=None,
+            relevance_threshold=None,
+            do_stop_at_irrelevant_rings=False,
+            do_relevance_only=False,
+            n_top_witnesses=0,
+            rating_sets=None,
+            do_multi_country_sweep=False,
+            output_format=OutputFormatEnum.csv,
+            results_database=None,
+            snapshot_time=None,
+            do_store_pair_maxima=False,
+            do_trace_memory=False
     ):
         super().__init__(
             settings_name=settings_name,
@@ -157,5 +276,20 @@ class UCTSettings(Settings):
             do_merge_couplers=do_merge_couplers,
             do_calculate_generator_IF=do_calculate_generator_IF,
             dictVbase_uct=dictVbase_uct,
-            min_voltage_level_PSSE_kV=None
+            min_voltage_level_PSSE_kV=None,
+            do_reduce_network=do_reduce_network,
+            max_ring=max_ring,
+            screening_policy=screening_policy,
+            screening_value=screening_value,
+            relevance_threshold=relevance_threshold,
+            do_stop_at_irrelevant_rings=do_stop_at_irrelevant_rings,
+            do_relevance_only=do_relevance_only,
+            n_top_witnesses=n_top_witnesses,
+            rating_sets=rating_sets,
+            do_multi_country_sweep=do_multi_country_sweep,
+            output_format=output_format,
+            results_database=results_database,
+            snapshot_time=snapshot_time,
+            do_store_pair_maxima=do_store_pair_maxima,
+            do_trace_memory=do_trace_memory
         )
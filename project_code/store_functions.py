@@ -0,0 +1,235 @@
+"""Columnar storage of the results of a country in output_files/<case>/<country>/<country>_results.h5.
+
+Each table is written in one call from a numpy structured array, branches being referred to by their
+index in the names table /branches:
+- /branches: index, name, display name, country, voltage level, type, ring and PATL of each branch
+- /results: one row per external element R, with its IFs and the indices of I and T
+- /results_<rating set name>: as /results, normalized with each additional rating set
+- /top_witnesses: one row per external element R and rank, if top witnesses are computed
+- /generators: name and power of each external generator
+- /results_generators: one row per external generator, with its IF and normalized IF
+- /generator_witnesses: the (generator, metric, role, branch) rows of the I and T for which the IF
+  (metric 0) and normalized IF (metric 1) of each generator are reached, role 0 for I and 1 for T.
+The tables are read back with read_table_hdf5.
+
+If requested, the maxima over T of the IF and normalized IF of each (i, r) pair are streamed per
+chunk of R to <country>_pair_maxima.h5, with the same names table /branches, see
+create_pair_maxima_hdf5 and read_pair_maxima_hdf5."""
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+
+from definitions import ROOT_DIR
+from project_code.instrumentation import report_stage
+
+
+# Shape of the compressed chunks of the (I * R) matrices of <country>_pair_maxima.h5, square so that
+# slices per contingency i and per external element r both read few chunks.
+PAIR_MAXIMA_CHUNK_SHAPE = (128, 128)
+
+
+def get_results_file_path(country, settings, name='results'):
+    case_folder_name = f"{settings.case_name}_{settings.input_file_name.replace('.', '_')}"
+    fpath = Path(ROOT_DIR) / "output_files" / case_folder_name / country
+    if not fpath.exists():
+        fpath.mkdir(parents=True)
+    return fpath / f"{country}_{name}.h5"
+
+
+def encode_strings(strings):
+    return np.array([str(string).encode('utf-8') for string in strings], dtype=np.bytes_) \
+        if len(strings) > 0 else np.zeros(0, dtype='S1')
+
+
+def create_structured_array(columns):
+    """Creates a structured array from a list of (name, array) columns of equal length."""
+    array = np.zeros(len(columns[0][1]), dtype=[(name, column.dtype) for name, column in columns])
+    for name, column in columns:
+        array[name] = column
+    return array
+
+
+def get_indices(elements):
+    return np.array([-1 if element is None else element.index for element in elements], dtype=np.int32)
+
+
+def create_branches_array(branches):
+    return create_structured_array([
+        ('index', get_indices(branches)),
+        ('name', encode_strings([branch.name_branch for branch in branches])),
+        ('display_name', encode_strings([branch.display_name for branch in branches])),
+        ('country', encode_strings([branch.country for branch in branches])),
+        ('v_base', np.array([branch.v_base for branch in branches], dtype=np.float64)),
+        # merged tie-lines have a string type instead of a BranchTypeEnum
+        ('type', encode_strings([getattr(branch.type, 'name', branch.type) for branch in branches])),
+        ('ring', np.array([branch.ring for branch in branches], dtype=np.int32)),
+        ('PATL', np.array([branch.PATL for branch in branches], dtype=np.float64))])
+
+
+def create_results_array(results):
+    return create_structured_array([
+        ('R', get_indices([result.eltR for result in results])),
+        ('IF', np.array([result.IFN2 for result in results], dtype=np.float64)),
+        ('I', get_indices([result.eltI for result in results])),
+        ('T', get_indices([result.eltT for result in results])),
+        ('norm_IF', np.array([result.nIFN2 for result in results], dtype=np.float64)),
+        ('I_norm', get_indices([result.eltIn for result in results])),
+        ('T_norm', get_indices([result.eltTn for result in results])),
+        ('IF_N1', np.array([result.IFN1 for result in results], dtype=np.float64)),
+        ('norm_IF_N1', np.array([result.nIFN1 for result in results], dtype=np.float64)),
+        ('PATL_R', np.array([result.get_PATL(result.eltR) for result in results], dtype=np.float64)),
+        ('PATL_T_norm', np.array([result.get_PATL(result.eltTn) for result in results],
+                                 dtype=np.float64))])
+
+
+def create_top_witnesses_array(witnesses):
+    rows = []
+    for witness in witnesses:
+        for rank in range(max(len(witness.IFs), len(witness.norm_IFs))):
+            rows.append((witness.eltR.index, rank + 1,
+                         witness.IFs[rank] if rank < len(witness.IFs) else np.nan,
+                         witness.eltsI[rank].index if rank < len(witness.IFs) else -1,
+                         witness.eltsT[rank].index if rank < len(witness.IFs) else -1,
+                         witness.norm_IFs[rank] if rank < len(witness.norm_IFs) else np.nan,
+                         witness.eltsIn[rank].index if rank < len(witness.norm_IFs) else -1,
+                         witness.eltsTn[rank].index if rank < len(witness.norm_IFs) else -1))
+    return np.array(rows, dtype=[('R', np.int32), ('rank', np.int32), ('IF', np.float64),
+                                 ('I', np.int32), ('T', np.int32), ('norm_IF', np.float64),
+                                 ('I_norm', np.int32), ('T_norm', np.int32)])
+
+
+def flatten_branch_names(names):
+    """Tie lists of generator results may hold nested lists of branch names."""
+    flat_names = []
+    for name in names:
+        if isinstance(name, list):
+            flat_names.extend(flatten_branch_names(name))
+        else:
+            flat_names.append(name)
+    return flat_names
+
+
+def create_generator_witnesses_array(results, branches):
+    index_per_name = {branch.name_branch: branch.index for branch in branches}
+    rows = []
+    for idx, result in enumerate(results):
+        for metric, names_i, names_t in [(0, result.IF_branches_i, result.IF_branches_t),
+                                         (1, result.IF_norm_branches_i, result.IF_norm_branches_t)]:
+            for role, names in [(0, names_i), (1, names_t)]:
+                rows.extend((idx, metric, role, index_per_name[name])
+                            for name in flatten_branch_names(names))
+    return np.array(rows, dtype=[('generator', np.int32), ('metric', np.int8), ('role', np.int8),
+                                 ('branch', np.int32)])
+
+
+@report_stage
+def store_results_hdf5(results, branches, country, settings, rating_names=()):
+    """Stores the names table, the results, the results for each rating set and the top witnesses
+    of a country, replacing the file of an earlier run."""
+    import tables
+
+    t0 = time.perf_counter()
+    filters = tables.Filters(complevel=5, complib='zlib')
+    with tables.open_file(str(get_results_file_path(country, settings)), mode='w') as h5file:
+        h5file.create_table('/', 'branches', obj=create_branches_array(branches), filters=filters)
+        h5file.create_table('/', 'results', obj=create_results_array(results), filters=filters)
+        for idx, rating_name in enumerate(rating_names):
+            h5file.create_table('/', f'results_{rating_name}',
+                                obj=create_results_array([result.rating_results[idx]
+                                                          for result in results]),
+                                filters=filters)
+        if len(results) > 0 and results[0].witnesses is not None:
+            h5file.create_table('/', 'top_witnesses',
+                                obj=create_top_witnesses_array([result.witnesses
+                                                                for result in results]),
+                                filters=filters)
+    logging.info(f"Results stored in hdf5 in {round(time.perf_counter() - t0, 3)} seconds.")
+
+
+@report_stage
+def store_results_generators_hdf5(results, branches, country, settings):
+    """Adds the generator results of a country to the file written by store_results_hdf5."""
+    import tables
+
+    filters = tables.Filters(complevel=5, complib='zlib')
+    generators = create_structured_array([
+        ('name', encode_strings([result.name for result in results])),
+        ('power', np.array([result.power for result in results], dtype=np.float64))])
+    results_generators = create_structured_array([
+        ('generator', np.arange(len(results), dtype=np.int32)),
+        ('IF', np.array([result.IF for result in results], dtype=np.float64)),
+        ('norm_IF', np.array([result.IF_norm for result in results], dtype=np.float64))])
+    with tables.open_file(str(get_results_file_path(country, settings)), mode='a') as h5file:
+        for name, array in [('generators', generators), ('results_generators', results_generators),
+                            ('generator_witnesses',
+                             create_generator_witnesses_array(results, branches))]:
+            if f'/{name}' in h5file:
+                h5file.remove_node('/', name)
+            h5file.create_table('/', name, obj=array, filters=filters)
+
+
+def read_table_hdf5(country, settings, table_name, name='results'):
+    """Reads a table of the results file of a country (or of <country>_<name>.h5, e.g. the names table
+    of the pair maxima) as a numpy structured array. Strings are returned as bytes, decoded with
+    .astype(str)."""
+    import tables
+
+    with tables.open_file(str(get_results_file_path(country, settings, name)), mode='r') as h5file:
+        return h5file.get_node('/', table_name).read()
+
+
+def create_pair_maxima_hdf5(setI, branches, country, settings):
+    """Creates <country>_pair_maxima.h5 and returns it open, to be filled by append_pair_maxima_hdf5
+    and closed by the caller. It holds the names table /branches, as in <country>_results.h5, the
+    branch indices of I (/I) and of R (/R, in computation order), and the (I * R) matrices of the
+    maximum IF (/IF) and normalized IF (/norm_IF) over T of each pair (i, r) with the branch index of
+    the t reaching it (/T, /norm_T, -1 if no IF was computed). The matrices are extended along R,
+    chunked and compressed."""
+    import tables
+
+    filters = tables.Filters(complevel=5, complib='zlib', shuffle=True)
+    h5file = tables.open_file(str(get_results_file_path(country, settings, 'pair_maxima')), mode='w')
+    h5file.create_table('/', 'branches', obj=create_branches_array(branches), filters=filters)
+    h5file.create_array('/', 'I', obj=setI.indices.astype(np.int32))
+    h5file.create_earray('/', 'R', atom=tables.Int32Atom(), shape=(0,), filters=filters)
+    chunk_shape = (max(1, min(len(setI), PAIR_MAXIMA_CHUNK_SHAPE[0])), PAIR_MAXIMA_CHUNK_SHAPE[1])
+    for name, atom in [('IF', tables.Float64Atom()), ('T', tables.Int32Atom()),
+                       ('norm_IF', tables.Float64Atom()), ('norm_T', tables.Int32Atom())]:
+        h5file.create_earray('/', name, atom=atom, shape=(len(setI), 0), chunkshape=chunk_shape,
+                             filters=filters)
+    return h5file
+
+
+def append_pair_maxima_hdf5(h5file, setR, setT, res_IF, res_T, res_norm_IF, res_norm_T):
+    """Appends the (I * R) results of compute_IF_CPU for a chunk of R, t being given as positions
+    in setT."""
+    h5file.root.R.append(setR.indices.astype(np.int32))
+    h5file.root.IF.append(res_IF)
+    h5file.root.T.append(np.where(res_IF > 0, setT.indices[res_T], -1).astype(np.int32))
+    h5file.root.norm_IF.append(res_norm_IF)
+    h5file.root.norm_T.append(np.where(res_norm_IF > 0, setT.indices[res_norm_T], -1).astype(np.int32))
+
+
+def get_position_slice(indices, index, set_name):
+    positions = np.flatnonzero(indices == index)
+    if len(positions) == 0:
+        raise KeyError(f"Branch index {index} is not in set {set_name}.")
+    return slice(positions[0], positions[0] + 1)
+
+
+def read_pair_maxima_hdf5(file_path, i=None, r=None):
+    """Reads the pair maxima of the contingency with branch index i and/or of the external element
+    with branch index r, only reading the chunks holding them. Returns the branch indices of I and R
+    of the slice and a dictionary of (I * R) matrices IF, T, norm_IF and norm_T."""
+    import tables
+
+    with tables.open_file(str(file_path), mode='r') as h5file:
+        indices_I = h5file.root.I.read()
+        indices_R = h5file.root.R.read()
+        rows = slice(None) if i is None else get_position_slice(indices_I, i, 'I')
+        columns = slice(None) if r is None else get_position_slice(indices_R, r, 'R')
+        matrices = {name: h5file.get_node('/', name)[rows, columns]
+                    for name in ['IF', 'T', 'norm_IF', 'norm_T']}
+    return indices_I[rows], indices_R[columns], matrices
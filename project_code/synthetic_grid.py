@@ -0,0 +1,226 @@
+"""Synthetic meshed multi-country grid models in UCTE-DEF format, to test and benchmark the
+calculation on grids of any size without the proprietary models.
+
+Countries are laid out as a grid of square areas. In each country, 380 kV substations are placed on
+a square lattice and connected by a spanning tree of lines completed with random lattice and
+diagonal lines until the requested number of branches per node is reached. Some substations have a
+second busbar connected by a coupler, some a 220 kV busbar behind a transformer, connected to the
+220 kV busbars of neighbouring substations, and some a generator. Neighbouring countries are
+connected by tie lines split at X-nodes. Node names follow the conventions of the 'Europe' case of
+set_node_country: the country code ('A', 'B', ..., 'D1', ...), a 4 or 5 character substation code,
+the voltage level digit of settings.dictVbase_uct and the busbar letter."""
+import logging
+import math
+import random
+from pathlib import Path
+
+from definitions import ROOT_DIR
+
+# country codes read by set_node_country for the 'Europe' case: 'D' followed by a digit for
+# German control areas ('D' followed by a letter is an adjacent area), 'X' for X-nodes
+COUNTRY_CODES = [code for code in 'ABCEFGHIJKLMNOPQRSTUVWYZ'] + [f'D{digit}' for digit in range(1, 10)] + \
+    [str(digit) for digit in range(10)]
+VOLTAGE_CODES = {380: 1, 220: 2}
+BASE36_DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def get_country_codes(n_countries):
+    if not 1 <= n_countries <= len(COUNTRY_CODES):
+        raise ValueError(f"Between 1 and {len(COUNTRY_CODES)} countries can be generated.")
+    return COUNTRY_CODES[:n_countries]
+
+
+def encode_base36(number, n_characters):
+    code = ''
+    for _ in range(n_characters):
+        number, digit = divmod(number, 36)
+        code = BASE36_DIGITS[digit] + code
+    if number > 0:
+        raise ValueError(f"Too many substations to be named with {n_characters} characters.")
+    return code
+
+
+def get_node_name(country, substation, voltage, busbar='A'):
+    return f"{country}{encode_base36(substation, 6 - len(country))}{VOLTAGE_CODES[voltage]}{busbar}"
+
+
+def format_node(name, generation=0.0, geographical_name='synthetic'):
+    """Node record: name, geographical name, status, node type (2: PV, 0: PQ), voltage, active
+    and reactive load, active and reactive generation, minimum and maximum permissible active
+    generation (negative for generation) and reactive generation."""
+    node_type, generation_limit = (2, -generation) if generation > 0 else (0, 0.0)
+    return f"{name:8} {geographical_name:12} 0 {node_type} {0.0:6.2f} {0.0:7.1f} {0.0:7.1f} " \
+           f"{generation_limit / 2:7.1f} {0.0:7.1f} {0.0:7.1f} {generation_limit:7.1f} " \
+           f"{9999.0:7.1f} {-9999.0:7.1f}"
+
+
+def format_line(node_from, node_to, order, status, resistance, reactance, susceptance, current_limit,
+                element_name):
+    """Line record: nodes, order code, status (0: in operation, 2: busbar coupler, 8: out of
+    operation), R and X in ohm, B in uS, current limit in A and element name."""
+    return f"{node_from:8} {node_to:8} {order} {status} {resistance:6.3f} {reactance:6.3f} " \
+           f"{susceptance:8.1f} {current_limit:6.0f} {element_name:12}"
+
+
+def format_transformer(node_from, node_to, order, rated_voltage_from, rated_voltage_to, rated_power,
+                       reactance, element_name):
+    """Transformer record: nodes, order code, status, rated voltages in kV, rated power in MVA,
+    R and X in ohm and B and G in uS (on the side of node_from), current limit in A and element
+    name."""
+    current_limit = rated_power / (math.sqrt(3) * rated_voltage_from) * 1000
+    return f"{node_from:8} {node_to:8} {order} 0 {rated_voltage_from:5.1f} {rated_voltage_to:5.1f} " \
+           f"{rated_power:5.1f} {reactance / 40:6.3f} {reactance:6.3f} {0.0:8.1f} {0.0:6.1f} " \
+           f"{current_limit:6.0f} {element_name:12}"
+
+
+def get_lattice_shape(n_elements):
+    n_columns = math.ceil(math.sqrt(n_elements))
+    return math.ceil(n_elements / n_columns), n_columns
+
+
+def create_substation_edges(n_substations, n_lines, rnd):
+    """Returns n_lines (substation, substation) pairs: a spanning tree of the lattice (rows and
+    first column), completed with random vertical and diagonal lattice edges."""
+    _, n_columns = get_lattice_shape(n_substations)
+    tree, candidates = [], []
+    for substation in range(n_substations):
+        row, column = divmod(substation, n_columns)
+        right, below = substation + 1, substation + n_columns
+        if column + 1 < n_columns and right < n_substations:
+            tree.append((substation, right))
+        if below < n_substations:
+            (tree if column == 0 else candidates).append((substation, below))
+        if column + 1 < n_columns and below + 1 < n_substations:
+            candidates.append((substation, below + 1))
+    rnd.shuffle(candidates)
+    return tree + candidates[:max(0, n_lines - len(tree))]
+
+
+def create_country(country, n_nodes, branches_per_node, rnd, coupler_share, transformer_share,
+                   generator_share, out_of_operation_share):
+    """Returns the node records, line records, transformer records and the 380 kV busbar names of
+    the substations (in lattice order) of a country of about n_nodes nodes."""
+    n_substations = max(2, round(n_nodes / (1 + coupler_share + transformer_share)))
+    has_coupler = [rnd.random() < coupler_share for _ in range(n_substations)]
+    has_transformer = [rnd.random() < transformer_share for _ in range(n_substations)]
+    _, n_columns = get_lattice_shape(n_substations)
+
+    nodes, lines, transformers = [], [], []
+    busbars = [get_node_name(country, substation, 380) for substation in range(n_substations)]
+    for substation in range(n_substations):
+        generation = rnd.choice([100, 250, 500, 800, 1200]) if rnd.random() < generator_share else 0
+        nodes.append(format_node(busbars[substation], generation))
+        if has_coupler[substation]:
+            busbar_B = get_node_name(country, substation, 380, 'B')
+            nodes.append(format_node(busbar_B))
+            lines.append(format_line(busbars[substation], busbar_B, 1, 2, 0.0, 0.0, 0.0, 0, 'coupler'))
+        if has_transformer[substation]:
+            busbar_220 = get_node_name(country, substation, 220)
+            nodes.append(format_node(busbar_220))
+            transformers.append(format_transformer(busbars[substation], busbar_220, 1, 380.0, 220.0,
+                                                   rnd.choice([300.0, 400.0, 600.0]),
+                                                   rnd.uniform(25.0, 45.0), 'transformer'))
+
+    n_lines = round(branches_per_node * n_nodes) - sum(has_coupler) - sum(has_transformer)
+    edges = create_substation_edges(n_substations, n_lines, rnd)
+    order_per_edge = {}
+    for substation_from, substation_to in edges:
+        voltage = 380
+        if has_transformer[substation_from] and has_transformer[substation_to] and rnd.random() < 0.5:
+            voltage = 220
+        node_names = []
+        for substation in (substation_from, substation_to):
+            busbar = 'B' if voltage == 380 and has_coupler[substation] and rnd.random() < 0.5 else 'A'
+            node_names.append(get_node_name(country, substation, voltage, busbar))
+        order = order_per_edge.get(tuple(node_names), 0) + 1
+        order_per_edge[tuple(node_names)] = order
+        # lines of the spanning tree are kept in operation so that the country stays connected
+        is_tree = substation_to - substation_from == 1 or \
+            (substation_from % n_columns == 0 and substation_to - substation_from == n_columns)
+        status = 8 if not is_tree and rnd.random() < out_of_operation_share else 0
+        reactance = rnd.uniform(3.0, 45.0) if voltage == 380 else rnd.uniform(5.0, 30.0)
+        current_limit = rnd.choice([1500, 2000, 2500, 3000, 4000]) if voltage == 380 \
+            else rnd.choice([600, 800, 1000, 1200])
+        lines.append(format_line(node_names[0], node_names[1], order, status, reactance / 10,
+                                 reactance, reactance * 10, current_limit, 'line'))
+        # some corridors have a second circuit
+        if rnd.random() < 0.05:
+            lines.append(format_line(node_names[0], node_names[1], order + 1, 0, reactance / 10,
+                                     reactance, reactance * 10, current_limit, 'line'))
+            order_per_edge[tuple(node_names)] = order + 1
+    return nodes, lines, transformers, busbars
+
+
+def get_border_substations(busbars, side):
+    """380 kV busbars of the substations on a side ('left', 'right', 'top' or 'bottom') of the
+    lattice of a country."""
+    n_rows, n_columns = get_lattice_shape(len(busbars))
+    if side in ('left', 'right'):
+        column = 0 if side == 'left' else n_columns - 1
+        return [busbars[row * n_columns + column] for row in range(n_rows)
+                if row * n_columns + column < len(busbars)]
+    row = 0 if side == 'top' else (len(busbars) - 1) // n_columns
+    return busbars[row * n_columns:(row + 1) * n_columns]
+
+
+def create_synthetic_uct(n_nodes, countries=('A', 'B', 'C', 'E'), branches_per_node=1.6,
+                         n_tie_lines=3, coupler_share=0.1, transformer_share=0.15,
+                         generator_share=0.2, out_of_operation_share=0.01, seed=0):
+    """Returns the lines of a UCTE-DEF file of a grid of about n_nodes nodes (X-nodes excluded)
+    and branches_per_node * n_nodes branches, split evenly over countries. n_tie_lines tie lines,
+    each split at an X-node, connect each pair of neighbouring countries. The grid only depends on
+    the arguments, seed included."""
+    rnd = random.Random(seed)
+    n_country_columns = math.ceil(math.sqrt(len(countries)))
+    nodes_per_country, lines, transformers, busbars_per_country = {}, [], [], []
+    for country in countries:
+        country_nodes, country_lines, country_transformers, busbars = create_country(
+            country, n_nodes / len(countries), branches_per_node, rnd, coupler_share,
+            transformer_share, generator_share, out_of_operation_share)
+        nodes_per_country[country] = country_nodes
+        lines.extend(country_lines)
+        transformers.extend(country_transformers)
+        busbars_per_country.append(busbars)
+
+    x_nodes = []
+    for idx, country in enumerate(countries):
+        neighbours = [(idx + 1, 'right', 'left')] if (idx + 1) % n_country_columns != 0 else []
+        neighbours.append((idx + n_country_columns, 'bottom', 'top'))
+        for idx_neighbour, side, side_neighbour in neighbours:
+            if idx_neighbour >= len(countries):
+                continue
+            border = get_border_substations(busbars_per_country[idx], side)
+            border_neighbour = get_border_substations(busbars_per_country[idx_neighbour],
+                                                      side_neighbour)
+            for _ in range(n_tie_lines):
+                x_node = f"X{encode_base36(len(x_nodes), 5)}1A"
+                x_nodes.append(format_node(x_node, geographical_name='X-node'))
+                reactance = rnd.uniform(5.0, 25.0)
+                current_limit = rnd.choice([1500, 2000, 2500, 3000])
+                for busbar in (rnd.choice(border), rnd.choice(border_neighbour)):
+                    lines.append(format_line(busbar, x_node, 1, 0, reactance / 10, reactance,
+                                             reactance * 10, current_limit, 'tie line'))
+
+    file_contents = ["##C 2007.05.01",
+                     f"Synthetic grid: {n_nodes} nodes, {len(countries)} countries, seed {seed}",
+                     "##N"]
+    for country, country_nodes in nodes_per_country.items():
+        file_contents.append(f"##Z{country}")
+        file_contents.extend(country_nodes)
+    file_contents.append("##ZXX")
+    file_contents.extend(x_nodes)
+    file_contents.append("##L")
+    file_contents.extend(lines)
+    file_contents.append("##T")
+    file_contents.extend(transformers)
+    return file_contents
+
+
+def write_synthetic_uct(input_file_name, n_nodes, **kwargs):
+    """Writes a synthetic grid to source_files/<input_file_name>, see create_synthetic_uct."""
+    file_contents = create_synthetic_uct(n_nodes, **kwargs)
+    fpath = Path(ROOT_DIR) / "source_files" / input_file_name
+    with open(fpath, "w") as file_out:
+        file_out.write('\n'.join(file_contents) + '\n')
+    logging.info(f"Synthetic grid of {n_nodes} nodes written to {fpath}.")
+    return fpath
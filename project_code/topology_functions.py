@@ -4,9 +4,11 @@ from pathlib import Path
 
 import sys
 
+import numpy as np
+
 from definitions import ROOT_DIR
 
-from project_code.classes import Node, Branch, BranchTypeEnum
+from project_code.classes import Node, Branch, BranchTypeEnum, GeneratorArrays
 
 
 def remove_branches_with_loop_elements(branches, nodes):
@@ -188,6 +190,15 @@ def get_most_connected_node(nodes, country):
     return most_connected_node
 
 
+def reset_rings(nodes, branches):
+    """Clears rings and connectivity, so that rings can be assigned for another country."""
+    for node in nodes:
+        node.ring = 99
+        node.connected = False
+    for branch in branches:
+        branch.ring = 99
+
+
 def assign_nodes_to_other_rings(nodes):
     ring_idx = 0
     nodes_in_ring = [node for node in nodes if node.ring == ring_idx]
@@ -201,30 +212,48 @@ def assign_nodes_to_other_rings(nodes):
 
 
 def connect_generators_to_nodes(nodes, generators):
+    """Attaches generators to their nodes through a name -> node index lookup. Generators that
+    cannot be attached are removed from the list. Returns the attached generators as arrays."""
     logging.debug("Attaching generators" + '\n')
-    generators_to_remove = []
 
-    for generator in generators:
-        node_attached_to_generator = [node for node in nodes if node.name == generator.node_name]
-        if len(node_attached_to_generator) == 1:
-            generator.node = node_attached_to_generator[0]
-            generator.country = node_attached_to_generator[0].country
-            generator.connected = True
-            node_attached_to_generator[0].generators.append(generator)
-        else:
-            generators_to_remove.append(generator)
-            logging.debug(f"     Generator {generator.name} could not be attached to node "
-                          f"{generator.node_name} : {len(node_attached_to_generator)} "
-                          f"matches found.")
+    node_idx_per_generator = get_node_indices_by_name(nodes, [gen.node_name for gen in generators])
+    is_attached = node_idx_per_generator >= 0
 
+    generators_to_remove = [gen for gen, attached in zip(generators, is_attached) if not attached]
     for generator in generators_to_remove:
-        generators.remove(generator)
-
-    for i in range(len(generators)):
-        generators[i].index = i
+        logging.debug(f"     Generator {generator.name} could not be attached to node "
+                      f"{generator.node_name} : 0 matches found.")
+    generators[:] = [gen for gen, attached in zip(generators, is_attached) if attached]
+    node_idx_per_generator = node_idx_per_generator[is_attached]
+
+    for i, generator in enumerate(generators):
+        node = nodes[node_idx_per_generator[i]]
+        generator.node = node
+        generator.country = node.country
+        generator.connected = True
+        generator.index = i
+        node.generators.append(generator)
 
     logging.info(f"{len(generators)} generators are in to the system. "
                  f"{len(generators_to_remove)} generators could not be connected and are removed.")
+    return GeneratorArrays(node_idx_per_generator,
+                           np.array([gen.country for gen in generators], dtype=str),
+                           np.array([gen.power for gen in generators], dtype=np.float64))
+
+
+def get_node_indices_by_name(nodes, node_names):
+    """Returns for each name in node_names the index of the node with that name, or -1 if no such
+    node exists. Assumes node names are unique and nodes are stored in index order."""
+    node_names = np.array(node_names, dtype=str)
+    if len(nodes) == 0 or len(node_names) == 0:
+        return -1 * np.ones(len(node_names), dtype=np.int64)
+
+    all_names = np.array([node.name for node in nodes], dtype=str)
+    order = np.argsort(all_names)
+    sorted_names = all_names[order]
+    position = np.minimum(np.searchsorted(sorted_names, node_names), len(sorted_names) - 1)
+    is_found = sorted_names[position] == node_names
+    return np.where(is_found, order[position], -1).astype(np.int64)
 
 
 def remove_non_connected_nodes_and_branches(nodes):
@@ -254,6 +283,79 @@ def remove_non_connected_nodes_and_branches(nodes):
     return connected_nodes, connected_branches
 
 
+def mark_radial_branches(nodes, branches):
+    """Marks branches whose outage splits the grid (bridges of the network graph) as radial, and
+    labels each branch with the biconnected component it belongs to. This is a structural check
+    that does not need the PTDF matrix. Assumes nodes and branches are stored in index order."""
+    node_from = [branch.node_from.index for branch in branches]
+    node_to = [branch.node_to.index for branch in branches]
+    is_bridge, biconnected_component = find_bridges_and_biconnected_components(len(nodes),
+                                                                              node_from, node_to)
+    for branch in branches:
+        branch.is_radial = is_bridge[branch.index]
+        branch.biconnected_component = biconnected_component[branch.index]
+
+    logging.info(f"{sum(is_bridge)} out of {len(branches)} branches are radial, "
+                 f"{len(set(biconnected_component) - {-1})} biconnected components found.")
+
+
+def find_bridges_and_biconnected_components(n_nodes, node_from, node_to):
+    """Iterative version of Tarjan's algorithm on a multigraph with n_nodes nodes and edges
+    (node_from[e], node_to[e]). Parallel edges are never bridges. Returns per edge whether it is a
+    bridge, and the label of its biconnected component (-1 for self-loops)."""
+    n_edges = len(node_from)
+    adjacency = [[] for _ in range(n_nodes)]
+    for edge, (u, v) in enumerate(zip(node_from, node_to)):
+        adjacency[u].append((v, edge))
+        adjacency[v].append((u, edge))
+
+    discovery = [-1] * n_nodes
+    low = [0] * n_nodes
+    is_bridge = [False] * n_edges
+    biconnected_component = [-1] * n_edges
+    n_components = 0
+    edge_stack = []
+    timer = 0
+
+    for root in range(n_nodes):
+        if discovery[root] != -1:
+            continue
+        discovery[root] = low[root] = timer
+        timer += 1
+        dfs_stack = [(root, -1, iter(adjacency[root]))]
+        while dfs_stack:
+            u, parent_edge, neighbours = dfs_stack[-1]
+            for v, edge in neighbours:
+                if edge == parent_edge:
+                    continue
+                if discovery[v] == -1:  # tree edge: descend
+                    edge_stack.append(edge)
+                    discovery[v] = low[v] = timer
+                    timer += 1
+                    dfs_stack.append((v, edge, iter(adjacency[v])))
+                    break
+                elif discovery[v] < discovery[u]:  # back edge (or parallel edge) to an ancestor
+                    edge_stack.append(edge)
+                    low[u] = min(low[u], discovery[v])
+            else:  # all neighbours visited: return to parent
+                dfs_stack.pop()
+                if not dfs_stack:
+                    continue
+                parent = dfs_stack[-1][0]
+                low[parent] = min(low[parent], low[u])
+                if low[u] >= discovery[parent]:  # parent separates the subtree of u
+                    while True:
+                        component_edge = edge_stack.pop()
+                        biconnected_component[component_edge] = n_components
+                        if component_edge == parent_edge:
+                            break
+                    n_components += 1
+                    if low[u] > discovery[parent]:
+                        is_bridge[parent_edge] = True
+
+    return is_bridge, biconnected_component
+
+
 def validate_topology(nodes, branches, generators=None):
     # check that branches are internally consistent
     for branch in branches:
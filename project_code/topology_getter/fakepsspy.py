@@ -0,0 +1,510 @@
+""" In-process stand-in for psspy, serving a case read from a PSSE RAW file (version 33 subset)
+
+It implements the API calls used by pssetopology.extract_components_from_case and the status
+of its components, with the return values and error codes of psspy, and counts the calls made
+to each API function, so that extraction can be run, tested and profiled without PSSE.
+
+Read from the RAW file: bus, load, generator, non-transformer branch, two- and three-winding
+transformer and multi-section line grouping data. Other sections are skipped. Records must be
+comma separated.
+
+    >>> fake_psspy = FakePssPy()
+    >>> with installed(fake_psspy):
+    ...     topology = pssetopology.get_full_topology({0: 'case.raw'})
+    >>> fake_psspy.call_counts.most_common()
+
+"""
+import collections
+import contextlib
+import csv
+import functools
+
+import monsterpsspy
+
+RAW_SECTIONS = [
+    'bus', 'load', 'fixed_shunt', 'generator', 'branch', 'transformer', 'area', 'two_terminal_dc',
+    'vsc_dc', 'impedance_correction', 'multi_terminal_dc', 'multi_section_line', 'zone',
+    'inter_area_transfer', 'owner', 'facts', 'switched_shunt', 'gne', 'induction_machine'
+]
+
+
+@contextlib.contextmanager
+def installed(fake_psspy):
+    """ Makes MonsterPssPy call fake_psspy instead of psspy (if imported) within the context
+
+    """
+    previous_psspy = getattr(monsterpsspy, 'psspy', None)
+    monsterpsspy.psspy = fake_psspy
+    try:
+        yield fake_psspy
+    finally:
+        if previous_psspy is None:
+            del monsterpsspy.psspy
+        else:
+            monsterpsspy.psspy = previous_psspy
+
+
+def split_raw_record(line):
+    """ Returns the fields of a RAW record, without the comment following '/'
+
+    """
+    in_quotes = False
+    for idx, character in enumerate(line):
+        if character == "'":
+            in_quotes = not in_quotes
+        elif character == '/' and not in_quotes:
+            line = line[:idx]
+            break
+    if not line.strip():
+        return []
+    return [field.strip() for field in next(csv.reader([line], quotechar="'",
+                                                         skipinitialspace=True))]
+
+
+def read_raw_sections(file_path):
+    """ Returns a dict {section name: list of records} of a RAW file, each record being a list
+    of fields
+
+    """
+    with open(file_path, 'r') as raw_file:
+        lines = [line.rstrip('\n') for line in raw_file if not line.startswith('@!')]
+    sections = collections.OrderedDict((name, []) for name in RAW_SECTIONS)
+    system_base = float(split_raw_record(lines[0])[1])
+    idx_section = 0
+    for line in lines[3:]:
+        fields = split_raw_record(line)
+        if line.strip().upper() == 'Q' or idx_section >= len(RAW_SECTIONS):
+            break
+        if fields and fields[0] == '0':
+            idx_section += 1
+        elif fields:
+            sections[RAW_SECTIONS[idx_section]].append(fields)
+    return system_base, sections
+
+
+def to_system_base(resistance, reactance, impedance_code, winding_base, system_base):
+    """ Converts a transformer impedance given with code CZ (1: pu on system base, 2: pu on
+    winding base, 3: load loss in W and impedance magnitude in pu on winding base) to pu on
+    system base
+
+    """
+    if impedance_code == 3:
+        resistance = resistance / (winding_base * 1e6)
+        reactance = (reactance ** 2 - resistance ** 2) ** 0.5
+    if impedance_code in (2, 3):
+        return complex(resistance, reactance) * system_base / winding_base
+    return complex(resistance, reactance)
+
+
+def get_circuit(identificator):
+    return identificator.strip().ljust(2)
+
+
+def counted(function):
+    """ Counts the calls of an API function in call_counts
+
+    """
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwds):
+        self.call_counts[function.__name__] += 1
+        return function(self, *args, **kwds)
+    return wrapper
+
+
+class FakePssPy(object):
+    """ psspy stand-in. The case is read by case(sfile), sfile being a RAW file.
+
+    """
+
+    def __init__(self):
+        self.call_counts = collections.Counter()
+        self.file_path = None
+        self.buses = collections.OrderedDict()
+        self.loads = []
+        self.machines = []
+        self.branches = []
+        self.three_winding_transformers = []
+        self.multi_section_lines = []
+        self._branch_index = {}
+        self._three_winding_index = {}
+        self._nxtbrn_iterators = {}
+        self._nxtmsl_iterator = None
+
+    def reset_call_counts(self):
+        self.call_counts.clear()
+
+    def _read_case(self, file_path):
+        system_base, sections = read_raw_sections(file_path)
+        call_counts = self.call_counts
+        self.__init__()
+        self.call_counts = call_counts
+        self.file_path = file_path
+        for fields in sections['bus']:
+            self.buses[int(fields[0])] = {
+                'NUMBER': int(fields[0]), 'NAME': fields[1].ljust(12), 'BASE': float(fields[2]),
+                'TYPE': int(fields[3]), 'AREA': int(fields[4]), 'ZONE': int(fields[5]),
+                'PU': float(fields[7]) if len(fields) > 7 else 1.0, 'DUMMY': 0
+            }
+        for fields in sections['load']:
+            self.loads.append({'NUMBER': int(fields[0]), 'ID': get_circuit(fields[1]),
+                               'STATUS': int(fields[2])})
+        for fields in sections['generator']:
+            self.machines.append({'NUMBER': int(fields[0]), 'ID': get_circuit(fields[1]),
+                                  'STATUS': int(fields[14]), 'PMAX': float(fields[16]),
+                                  'PMIN': float(fields[17])})
+        for fields in sections['branch']:
+            self.branches.append({
+                'FROMNUMBER': abs(int(fields[0])), 'TONUMBER': abs(int(fields[1])),
+                'ID': get_circuit(fields[2]), 'RX': complex(float(fields[3]), float(fields[4])),
+                'CHARG': float(fields[5]), 'RATEA': float(fields[6]), 'RATEB': float(fields[7]),
+                'RATEC': float(fields[8]), 'STATUS': int(fields[13]),
+                'LENGTH': float(fields[15]) if len(fields) > 15 else 0.0, 'TRANSFORMER': False
+            })
+        self._read_transformers(sections['transformer'], system_base)
+        for fields in sections['multi_section_line']:
+            multi_section_line = {'FROMNUMBER': abs(int(fields[0])),
+                                  'TONUMBER': abs(int(fields[1])),
+                                  'ID': get_circuit(fields[2]),
+                                  'DUMMIES': [int(field) for field in fields[4:]]}
+            self.multi_section_lines.append(multi_section_line)
+            for dummy in multi_section_line['DUMMIES']:
+                self.buses[dummy]['DUMMY'] = 1
+        for branch in self.branches:
+            self._branch_index[self._branch_key(branch['FROMNUMBER'], branch['TONUMBER'],
+                                                branch['ID'])] = branch
+        for multi_section_line in self.multi_section_lines:
+            # a multi-section line is in service if all its sections are
+            multi_section_line['STATUS'] = int(all(
+                branch['STATUS'] for branch in self._get_sections(multi_section_line)))
+            self._branch_index[self._branch_key(multi_section_line['FROMNUMBER'],
+                                                multi_section_line['TONUMBER'],
+                                                multi_section_line['ID'])] = multi_section_line
+        for transformer in self.three_winding_transformers:
+            self._three_winding_index[self._three_winding_key(
+                *(transformer['NUMBERS'] + [transformer['ID']]))] = transformer
+
+    def _read_transformers(self, records, system_base):
+        idx = 0
+        while idx < len(records):
+            fields = records[idx]
+            numbers = [abs(int(fields[0])), abs(int(fields[1])), abs(int(fields[2]))]
+            impedance_code = int(fields[5])
+            status = int(fields[11])
+            impedances = [float(field) for field in records[idx + 1]]
+            if numbers[2] == 0:
+                rating = [float(field) for field in records[idx + 2][3:6]]
+                self.branches.append({
+                    'FROMNUMBER': numbers[0], 'TONUMBER': numbers[1], 'ID': get_circuit(fields[3]),
+                    'RX': to_system_base(impedances[0], impedances[1], impedance_code,
+                                         impedances[2], system_base),
+                    'CHARG': 0.0, 'RATEA': rating[0], 'RATEB': rating[1], 'RATEC': rating[2],
+                    'STATUS': status, 'LENGTH': 0.0, 'TRANSFORMER': True
+                })
+                idx += 4
+            else:
+                # winding impedances of the star equivalent, from the impedances between windings
+                z12, z23, z31 = [
+                    to_system_base(impedances[3 * k], impedances[3 * k + 1], impedance_code,
+                                   impedances[3 * k + 2], system_base) for k in range(3)
+                ]
+                self.three_winding_transformers.append({
+                    'NUMBERS': numbers, 'ID': get_circuit(fields[3]), 'STATUS': status,
+                    'RX': [(z12 + z31 - z23) / 2, (z12 + z23 - z31) / 2, (z23 + z31 - z12) / 2],
+                    'RATEA': [float(records[idx + k][3]) for k in range(2, 5)]
+                })
+                idx += 5
+
+    @staticmethod
+    def _branch_key(ibus, jbus, ickt):
+        return min(ibus, jbus), max(ibus, jbus), ickt.strip()
+
+    @staticmethod
+    def _three_winding_key(ibus, jbus, kbus, ickt):
+        return tuple(sorted((ibus, jbus, kbus))) + (ickt.strip(),)
+
+    @staticmethod
+    def _get_array(elements, string, error_code):
+        strings = [string] if isinstance(string, str) else list(string)
+        try:
+            return 0, [[element[name] for element in elements] for name in strings]
+        except KeyError:
+            return error_code, None
+
+    @staticmethod
+    def _select(elements, flag):
+        # odd flags select the elements in service, even flags all elements
+        if flag is not None and flag % 2 == 1:
+            return [element for element in elements if element['STATUS'] != 0]
+        return elements
+
+    def _select_branches(self, flag):
+        if flag in (1, 2):
+            branches = [branch for branch in self.branches if not branch['TRANSFORMER']]
+        elif flag in (5, 6):
+            branches = [branch for branch in self.branches if branch['TRANSFORMER']]
+        else:
+            branches = self.branches
+        return self._select(branches, flag)
+
+    def _get_buses(self, flag):
+        if flag == 1:
+            return [bus for bus in self.buses.values() if bus['TYPE'] != 4]
+        return list(self.buses.values())
+
+    @counted
+    def case(self, sfile=None):
+        self._read_case(sfile)
+        return 0
+
+    @counted
+    def abusint(self, sid=None, flag=None, string=None, **kwds):
+        return self._get_array(self._get_buses(flag), string, 6)
+
+    @counted
+    def abusreal(self, sid=None, flag=None, string=None, **kwds):
+        return self._get_array(self._get_buses(flag), string, 6)
+
+    @counted
+    def abuschar(self, sid=None, flag=None, string=None, **kwds):
+        return self._get_array(self._get_buses(flag), string, 6)
+
+    @counted
+    def abrnint(self, sid=None, owner=None, ties=None, flag=None, entry=None, string=None, **kwds):
+        return self._get_array(self._select_branches(flag), string, 9)
+
+    @counted
+    def abrnreal(self, sid=None, owner=None, ties=None, flag=None, entry=None, string=None,
+                 **kwds):
+        return self._get_array(self._select_branches(flag), string, 9)
+
+    @counted
+    def abrnchar(self, sid=None, owner=None, ties=None, flag=None, entry=None, string=None,
+                 **kwds):
+        return self._get_array(self._select_branches(flag), string, 9)
+
+    @counted
+    def abrncplx(self, sid=None, owner=None, ties=None, flag=None, entry=None, string=None,
+                 **kwds):
+        return self._get_array(self._select_branches(flag), string, 9)
+
+    @counted
+    def atrncplx(self, sid=None, owner=None, ties=None, flag=None, entry=None, string=None,
+                 **kwds):
+        strings = [string] if isinstance(string, str) else list(string)
+        strings = ['RX' if name in ('RXACT', 'RXNOM') else name for name in strings]
+        # atrn flags: 1 for the transformers in service, 2 for all transformers
+        return self._get_array(self._select_branches(5 if flag == 1 else 6), strings, 9)
+
+    @counted
+    def atr3int(self, sid=None, owner=None, ties=None, flag=None, entry=None, string=None,
+                **kwds):
+        transformers = [dict(transformer, WIND1NUMBER=transformer['NUMBERS'][0],
+                             WIND2NUMBER=transformer['NUMBERS'][1],
+                             WIND3NUMBER=transformer['NUMBERS'][2])
+                        for transformer in self._select(self.three_winding_transformers, flag)]
+        return self._get_array(transformers, string, 9)
+
+    @counted
+    def atr3char(self, sid=None, owner=None, ties=None, flag=None, entry=None, string=None,
+                 **kwds):
+        return self._get_array(self._select(self.three_winding_transformers, flag), string, 9)
+
+    @counted
+    def amachint(self, sid=None, flag=None, string=None, **kwds):
+        return self._get_array(self._select(self.machines, flag), string, 6)
+
+    @counted
+    def amachchar(self, sid=None, flag=None, string=None, **kwds):
+        return self._get_array(self._select(self.machines, flag), string, 6)
+
+    @counted
+    def aloadint(self, sid=None, flag=None, string=None, **kwds):
+        return self._get_array(self._select(self.loads, flag), string, 6)
+
+    @counted
+    def aloadchar(self, sid=None, flag=None, string=None, **kwds):
+        return self._get_array(self._select(self.loads, flag), string, 6)
+
+    @counted
+    def busint(self, ibus=None, string=None):
+        if ibus not in self.buses:
+            return 1, None
+        if string not in ('TYPE', 'AREA', 'ZONE', 'DUMMY'):
+            return 2, None
+        return 0, self.buses[ibus][string]
+
+    @counted
+    def busdat(self, ibus=None, string=None):
+        if ibus not in self.buses:
+            return 1, None
+        bus = self.buses[ibus]
+        values = {'BASE': bus['BASE'], 'PU': bus['PU'], 'KV': bus['PU'] * bus['BASE']}
+        if string not in values:
+            return 2, None
+        return 0, values[string]
+
+    @counted
+    def notona(self, ibus):
+        if ibus not in self.buses:
+            return 1, None
+        return 0, '{}{:6.1f}'.format(self.buses[ibus]['NAME'], self.buses[ibus]['BASE'])
+
+    def _get_branch(self, ibus, jbus, ickt):
+        if ibus not in self.buses or jbus not in self.buses:
+            return 1, None
+        branch = self._branch_index.get(self._branch_key(ibus, jbus, ickt))
+        if branch is None:
+            return 2, None
+        return 0, branch
+
+    @counted
+    def brnint(self, ibus=None, jbus=None, ickt=None, string=None):
+        ierr, branch = self._get_branch(ibus, jbus, ickt)
+        if ierr:
+            return ierr, None
+        if string not in ('STATUS',):
+            return 3, None
+        return 0, branch[string]
+
+    @counted
+    def brndat(self, ibus=None, jbus=None, ickt=None, string=None):
+        ierr, branch = self._get_branch(ibus, jbus, ickt)
+        if ierr:
+            return ierr, None
+        if string not in ('RATEA', 'RATEB', 'RATEC', 'LENGTH', 'CHARG') or string not in branch:
+            return 3, None
+        return 0, branch[string]
+
+    @counted
+    def brndt2(self, ibus=None, jbus=None, ickt=None, string=None):
+        ierr, branch = self._get_branch(ibus, jbus, ickt)
+        if ierr:
+            return ierr, None
+        if string != 'RX' or string not in branch:
+            return 3, None
+        return 0, branch[string]
+
+    @counted
+    def inibrx(self, ibus, single):
+        if ibus not in self.buses:
+            return 1
+        if single not in (1, 2):
+            return 2
+        if self.buses[ibus]['DUMMY']:
+            return 3
+        # single entry: each branch once, from its from bus; double entry: from both buses
+        connected = [(branch['FROMNUMBER'], branch['TONUMBER'], branch['ID'])
+                     for branch in self.branches + self.multi_section_lines]
+        self._nxtbrn_iterators[ibus] = iter(
+            [(to_bus, ickt) for from_bus, to_bus, ickt in connected if from_bus == ibus] +
+            ([(from_bus, ickt) for from_bus, to_bus, ickt in connected if to_bus == ibus]
+             if single == 2 else []))
+        return 0
+
+    @counted
+    def nxtbrn(self, ibus):
+        if ibus not in self._nxtbrn_iterators:
+            return 2, None, None
+        try:
+            jbus, ickt = next(self._nxtbrn_iterators[ibus])
+        except StopIteration:
+            return 1, None, None
+        return 0, jbus, ickt
+
+    def _get_sections(self, multi_section_line):
+        numbers = [multi_section_line['FROMNUMBER']] + multi_section_line['DUMMIES'] + \
+            [multi_section_line['TONUMBER']]
+        sections = []
+        for from_bus, to_bus in zip(numbers[:-1], numbers[1:]):
+            sections.extend(branch for branch in self.branches
+                            if self._branch_key(from_bus, to_bus, '')[:2] ==
+                            self._branch_key(branch['FROMNUMBER'], branch['TONUMBER'], '')[:2])
+        return sections
+
+    @counted
+    def inimsl(self, ibus=None, jbus=None, ickt=None, **kwds):
+        self._nxtmsl_iterator = None
+        if ibus not in self.buses or jbus not in self.buses:
+            return 1
+        if not ickt.startswith('&'):
+            return 2
+        for multi_section_line in self.multi_section_lines:
+            if self._branch_key(ibus, jbus, ickt) == self._branch_key(
+                    multi_section_line['FROMNUMBER'], multi_section_line['TONUMBER'],
+                    multi_section_line['ID']):
+                break
+        else:
+            return 3
+        self._nxtmsl_iterator = iter([(branch['FROMNUMBER'], branch['TONUMBER'], branch['ID'])
+                                      for branch in self._get_sections(multi_section_line)])
+        return 0
+
+    @counted
+    def nxtmsl(self):
+        if self._nxtmsl_iterator is None:
+            return 3, None, None, None
+        try:
+            ibus, jbus, ickt = next(self._nxtmsl_iterator)
+        except StopIteration:
+            return 1, None, None, None
+        return 0, ibus, jbus, ickt
+
+    def _get_three_winding_transformer(self, ibus, jbus, kbus, ickt):
+        if any(bus not in self.buses for bus in (ibus, jbus, kbus)):
+            return 1, None
+        transformer = self._three_winding_index.get(
+            self._three_winding_key(ibus, jbus, kbus, ickt))
+        if transformer is None:
+            return 2, None
+        return 0, transformer
+
+    @counted
+    def tr3int(self, ibus=None, jbus=None, kbus=None, ickt=None, string=None):
+        ierr, transformer = self._get_three_winding_transformer(ibus, jbus, kbus, ickt)
+        if ierr:
+            return ierr, None
+        if string != 'STATUS':
+            return 3, None
+        return 0, transformer[string]
+
+    def _get_winding_value(self, ibus, jbus, kbus, ickt, string):
+        """ Value of the winding of ibus """
+        ierr, transformer = self._get_three_winding_transformer(ibus, jbus, kbus, ickt)
+        if ierr:
+            return ierr, None
+        if string not in ('RX', 'RATEA'):
+            return 3, None
+        return 0, transformer[string][transformer['NUMBERS'].index(ibus)]
+
+    @counted
+    def wnddat(self, ibus=None, jbus=None, kbus=None, ickt=None, string=None):
+        return self._get_winding_value(ibus, jbus, kbus, ickt, string)
+
+    @counted
+    def wnddt2(self, ibus=None, jbus=None, kbus=None, ickt=None, string=None):
+        return self._get_winding_value(ibus, jbus, kbus, ickt, string)
+
+    def _get_injection(self, elements, ibus, identificator, string, names):
+        if ibus not in self.buses:
+            return 1, None
+        for element in elements:
+            if element['NUMBER'] == ibus and element['ID'].strip() == identificator.strip():
+                break
+        else:
+            return 2, None
+        if string not in names:
+            return 5, None
+        # off-line elements return their value with error code 4
+        return (0 if element['STATUS'] else 4), element[string]
+
+    @counted
+    def macint(self, ibus=None, id=None, string=None):
+        return self._get_injection(self.machines, ibus, id, string, ('STATUS',))
+
+    @counted
+    def macdat(self, ibus=None, id=None, string=None):
+        return self._get_injection(self.machines, ibus, id, string, ('PMAX', 'PMIN'))
+
+    @counted
+    def lodint(self, ibus=None, id=None, string=None):
+        return self._get_injection(self.loads, ibus, id, string, ('STATUS',))
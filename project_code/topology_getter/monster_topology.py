@@ -57,7 +57,8 @@ class MonsterTopology:
         return out
 
     def set_relay_activation(self):
-        components = self.msl_and_line_dict.values() + self.two_winding_transformer_dict.values()
+        components = list(self.msl_and_line_dict.values()) + \
+            list(self.two_winding_transformer_dict.values())
         for component in components:
             component.set_activation()
 
@@ -87,8 +88,9 @@ class MonsterTopology:
         )
 
     def _branches_dict_values(self, split_msl=False):
-        all_branches = self.line_dict.values() + self.two_winding_transformer_dict.values()
-        all_branches += self.three_winding_transformer_dict.values()
+        all_branches = list(self.line_dict.values()) + \
+            list(self.two_winding_transformer_dict.values())
+        all_branches += list(self.three_winding_transformer_dict.values())
         return all_branches
 
     def monitored_branches(self, areas):
@@ -195,12 +197,12 @@ class MonsterTopology:
         else:
             self.msl_and_line_dict.update(self.msl_parents)
 
-        all_components = self.bus_dict.values() + \
-            self.msl_and_line_dict.values() + \
-            self.two_winding_transformer_dict.values() + \
-            self.three_winding_transformer_dict.values() + \
-            self.machine_dict.values() + \
-            self.load_dict.values()
+        all_components = list(self.bus_dict.values()) + \
+            list(self.msl_and_line_dict.values()) + \
+            list(self.two_winding_transformer_dict.values()) + \
+            list(self.three_winding_transformer_dict.values()) + \
+            list(self.machine_dict.values()) + \
+            list(self.load_dict.values())
 
         return all_components
 
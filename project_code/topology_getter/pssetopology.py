@@ -11,7 +11,7 @@ import component, component_busdetails, component_base
 
 
 def get_full_topology(case_path_dict):
-    MonsterPssPy.case(case_path_dict.values()[0])
+    MonsterPssPy.case(list(case_path_dict.values())[0])
     monster_topology = extract_components_from_case(
         case_path_dict
     )
@@ -1,3 +1,4 @@
+import logging
 import pickle
 
 try:
@@ -10,6 +11,7 @@ from uuid import uuid1
 
 import execnet
 import pssetopology
+from fakepsspy import FakePssPy, installed
 
 from serviceenumsandcontants import Python27Path
 
@@ -37,6 +39,20 @@ def get_topology(case_path_dict, debug_print=True):
     return topology
 
 
+def get_topology_from_raw(case_path_dict):
+    """ Reads the topology of cases given as RAW files in this process, psspy being served by
+    FakePssPy, so without PSSE. The calls made to the psspy API are logged.
+
+    """
+    fake_psspy = FakePssPy()
+    with installed(fake_psspy):
+        topology = pssetopology.get_full_topology(case_path_dict)
+    logging.info("Topology read with {} psspy API calls.".format(
+        sum(fake_psspy.call_counts.values())))
+    logging.debug("psspy API calls: {}".format(fake_psspy.call_counts.most_common()))
+    return topology
+
+
 if __name__ == '__main__':
     # ffname = r'P:\PSS-Data\norge\norge_d08h.sav'
     # ffname = r'C:\code\relevant_assets\source_files\Norden2018_tunglast_01A.sav'
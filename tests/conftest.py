@@ -1,16 +1,25 @@
 import collections
 import pytest
 
+from project_code.classes import Branch, BranchTypeEnum, BranchSet
 from project_code.main import open_file, read_branches_and_generators, read_grid
+from project_code.matrix_and_set_functions import create_inv_susceptance_matrix, create_ISF_matrix, \
+    create_PTDF_matrix, set_PTDF_on_branches, create_LODF_matrix, create_PATL_matrix
+from project_code.read_grid import create_nodes_and_update_branches_with_node_info
 from project_code.settings import get_settings, SettingsEnum
 from project_code.topology_functions import validate_topology, apply_couplers_on_branches_and_generators, \
     merge_tie_lines, remove_branches_with_loop_elements, convert_couplers_to_lines
 
 
-@pytest.fixture(params=['PSSE full', 'PSSE test case', 'UCT example'], scope='session')
+@pytest.fixture(params=['PSSE full', 'PSSE test case', 'PSSE RAW test case', 'UCT example'], scope='session')
 def settings(request):
     if request.param == 'PSSE test case':
         return get_settings(SettingsEnum.PSSETest)
+    elif request.param == 'PSSE RAW test case':
+        # read by the psspy stand-in, so without PSSE
+        settings = get_settings(SettingsEnum.PSSETest)
+        settings.input_file_name = 'PSSETestCase.raw'
+        return settings
     elif request.param == 'UCT example':
         return get_settings(SettingsEnum.UCT0)
     elif request.param == 'PSSE full':
@@ -106,3 +115,36 @@ def branches_generators_nodes_preprocessed_nonmerged(name_file_settings):
     validate_topology(nodes, branches)
 
     return BGN(name, branches, generators, nodes, settings)
+
+
+# a new grid per test, as tests change the rings, impedances and self PTDFs of its branches
+@pytest.fixture(scope='function')
+def meshed_grid():
+    """Control area (ring 0) on nodes 1-4, ring 1 on nodes 4-7 with tie lines 2-5 and 3-7, and ring 2 on
+    nodes 6-9."""
+    branch_data = [('1', '2', 0.1, 0), ('2', '3', 0.2, 0), ('3', '1', 0.15, 0), ('3', '4', 0.3, 0),
+                   ('1', '4', 0.25, 0), ('4', '5', 0.05, 1), ('5', '6', 0.07, 1), ('6', '4', 0.11, 1),
+                   ('5', '7', 0.2, 1), ('7', '6', 0.3, 1), ('2', '5', 0.12, 1), ('3', '7', 0.18, 1),
+                   ('6', '8', 0.1, 2), ('8', '9', 0.2, 2), ('9', '7', 0.15, 2), ('7', '8', 0.3, 2)]
+    branches = []
+    for idx, (name_from, name_to, impedance, ring) in enumerate(branch_data):
+        branch = Branch(name_from, name_to, '1', impedance, 100.0 * (1 + idx % 3), 380.0,
+                        BranchTypeEnum.Line, f'{name_from}-{name_to}')
+        branch.index = idx
+        branch.ring = ring
+        branches.append(branch)
+    nodes = create_nodes_and_update_branches_with_node_info(branches)
+    for idx, node in enumerate(nodes):
+        node.index = idx
+
+    inv_B = create_inv_susceptance_matrix(branches, nodes, nodes[0])
+    ISF = create_ISF_matrix(branches, nodes, inv_B, nodes[0])
+    PTDF = create_PTDF_matrix(branches, ISF)
+    set_PTDF_on_branches(PTDF, branches, 0.001)
+    LODF = create_LODF_matrix(branches, PTDF, 0.001)
+    PATL = create_PATL_matrix(branches)
+    setT = BranchSet(branches[:5])
+    setR = BranchSet(branches[5:])
+    setI = setR + setT
+    MeshedGrid = collections.namedtuple('MeshedGrid', 'setI setT setR LODF PATL PTDF')
+    return MeshedGrid(setI, setT, setR, LODF, PATL, PTDF)
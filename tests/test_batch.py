@@ -0,0 +1,95 @@
+import os
+import time
+
+import pytest
+
+from project_code import batch, main, matrix_and_set_functions, results_database
+from project_code.batch import get_snapshot_file_names, prefetch_cases, run_batch
+from project_code.results_database import query_runs, query_IF_history, query_top_elements
+from project_code.settings import SettingsEnum, get_settings
+from project_code.synthetic_grid import create_synthetic_uct
+
+
+@pytest.fixture
+def snapshot_settings(tmp_path, monkeypatch):
+    for module in [batch, main, matrix_and_set_functions, results_database]:
+        monkeypatch.setattr(module, 'ROOT_DIR', str(tmp_path))
+    (tmp_path / 'source_files' / 'day').mkdir(parents=True)
+    file_contents = create_synthetic_uct(200, ['A', 'B'], seed=0)
+    for hour in range(3):
+        (tmp_path / 'source_files' / 'day' / f'h{hour}.uct').write_text('\n'.join(file_contents) + '\n')
+    (tmp_path / 'source_files' / 'day' / 'notes.txt').write_text('not a snapshot')
+    settings = get_settings(SettingsEnum.UCT0)
+    settings.countries = ['A', 'B']
+    return settings
+
+
+# noinspection PyShadowingNames
+def test_get_snapshot_file_names(snapshot_settings):
+    assert get_snapshot_file_names('day', snapshot_settings) == ['day/h0.uct', 'day/h1.uct', 'day/h2.uct']
+    assert get_snapshot_file_names('day/h[12].uct', snapshot_settings) == ['day/h1.uct', 'day/h2.uct']
+    with pytest.raises(FileNotFoundError):
+        get_snapshot_file_names('night', snapshot_settings)
+
+
+# noinspection PyShadowingNames
+def test_prefetch_cases_within_memory_budget(snapshot_settings, monkeypatch):
+    read_file_names = []
+    monkeypatch.setattr(batch, 'estimate_snapshot_MB', lambda input_file_name: 1.0)
+
+    class RecordedCase(batch.InfluenceCase):
+        @property
+        def topology(self):
+            read_file_names.append(self.settings.input_file_name)
+
+    monkeypatch.setattr(batch, 'InfluenceCase', RecordedCase)
+    input_file_names = get_snapshot_file_names('day', snapshot_settings)
+
+    # only the snapshot of the caller fits in the budget: no file is read ahead
+    snapshots = prefetch_cases(snapshot_settings, input_file_names, memory_budget_MB=1.5)
+    assert next(snapshots)[0] == 'day/h0.uct'
+    time.sleep(0.2)
+    assert read_file_names == ['day/h0.uct']
+    assert [input_file_name for input_file_name, _, _ in snapshots] == input_file_names[1:]
+    snapshots.close()
+
+    read_file_names.clear()
+    snapshots = prefetch_cases(snapshot_settings, input_file_names, memory_budget_MB=3.0)
+    next(snapshots)
+    t0 = time.perf_counter()
+    while len(read_file_names) < 3 and time.perf_counter() - t0 < 5:
+        time.sleep(0.01)
+    assert read_file_names == input_file_names
+    snapshots.close()
+
+
+# noinspection PyShadowingNames
+def test_run_batch(snapshot_settings, tmp_path):
+    (tmp_path / 'source_files' / 'day' / 'h1.uct').write_text('not a snapshot')
+
+    database_path = run_batch(snapshot_settings, 'day')
+
+    assert database_path == tmp_path / 'output_files' / 'Europe_batch.sqlite'
+    runs = query_runs(database_path)
+    assert [(run['input_file_name'], run['country']) for run in runs] == \
+        [('day/h0.uct', 'A'), ('day/h0.uct', 'B'), ('day/h2.uct', 'A'), ('day/h2.uct', 'B')]
+    # h2 is the same snapshot as h0, its results are the ones of h0
+    element = query_top_elements(database_path, runs[0]['run_id'], n_elements=1)[0]['element']
+    history = query_IF_history(database_path, element, country='A')
+    assert [row['input_file_name'] for row in history] == ['day/h0.uct', 'day/h2.uct']
+    assert history[0]['IF_N2'] == history[1]['IF_N2']
+
+
+# noinspection PyShadowingNames
+def test_run_batch_orders_the_history_by_snapshot_time(snapshot_settings, tmp_path):
+    # h0 is the latest snapshot according to the modification times of the files
+    for hour, modification_time in [(0, 1514800800), (1, 1514793600), (2, 1514797200)]:
+        os.utime(tmp_path / 'source_files' / 'day' / f'h{hour}.uct', (modification_time, modification_time))
+
+    database_path = run_batch(snapshot_settings, 'day')
+
+    element = query_top_elements(database_path, 1, n_elements=1)[0]['element']
+    history = query_IF_history(database_path, element, country='A')
+    assert [(row['input_file_name'], row['timestamp']) for row in history] == \
+        [('day/h1.uct', '2018-01-01T08:00:00'), ('day/h2.uct', '2018-01-01T09:00:00'),
+         ('day/h0.uct', '2018-01-01T10:00:00')]
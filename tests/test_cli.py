@@ -0,0 +1,96 @@
+import re
+import sys
+
+import pytest
+
+from project_code.cli import create_parser, get_settings_from_args, cli
+from project_code.settings import SettingsEnum, OutputFormatEnum, ScreeningEnum
+
+
+def test_get_settings_from_args():
+    args = create_parser().parse_args(['sets', 'UCT0', '--countries', 'A', 'B', '--set',
+                                       'do_reduce_network=True', 'max_ring=2', 'case_name=Test'])
+
+    settings = get_settings_from_args(args)
+
+    assert settings.settings_name == SettingsEnum.UCT0
+    assert settings.countries == ['A', 'B']
+    assert settings.do_reduce_network is True
+    assert settings.max_ring == 2
+    assert settings.case_name == 'Test'
+
+
+def test_get_settings_from_args_enum_settings():
+    args = create_parser().parse_args(['run', 'UCT0', '--set', 'output_format=hdf5',
+                                       'screening_policy=top_k', 'screening_value=5'])
+
+    settings = get_settings_from_args(args)
+
+    assert settings.output_format is OutputFormatEnum.hdf5
+    assert settings.screening_policy is ScreeningEnum.top_k
+    assert settings.screening_value == 5
+    args = create_parser().parse_args(['run', 'UCT0', '--set', 'screening_policy=None'])
+    assert get_settings_from_args(args).screening_policy is None
+
+
+@pytest.mark.parametrize('override', ['output_format=xlsx', 'screening_policy=top-k'])
+def test_get_settings_from_args_unknown_enum_member(override):
+    args = create_parser().parse_args(['run', 'UCT0', '--set', override])
+    with pytest.raises(ValueError, match='expected one of'):
+        get_settings_from_args(args)
+
+
+def test_serve_arguments():
+    args = create_parser().parse_args(['serve', 'PSSE0', '--port', '0'])
+    assert (args.host, args.port) == ('127.0.0.1', 0)
+
+
+def test_get_settings_from_args_unknown_setting():
+    args = create_parser().parse_args(['run', 'UCT0', '--set', 'unknown_setting=1'])
+    with pytest.raises(ValueError):
+        get_settings_from_args(args)
+
+
+def test_list_settings_does_not_import_heavy_modules(capsys):
+    heavy_modules = ['project_code.main', 'project_code.compute_influence_factors',
+                     'project_code.topology_getter.pssetopology_wrapper']
+    imported_before = [name for name in heavy_modules if name in sys.modules]
+
+    cli(['settings'])
+
+    assert [name for name in heavy_modules if name in sys.modules] == imported_before
+    assert [line.split(':')[0] for line in capsys.readouterr().out.splitlines()] == \
+        [settings_name.name for settings_name in SettingsEnum]
+
+
+def test_synthetic(tmp_path, monkeypatch, capsys):
+    from project_code import synthetic_grid
+    monkeypatch.setattr(synthetic_grid, 'ROOT_DIR', str(tmp_path))
+    (tmp_path / 'source_files').mkdir()
+
+    cli(['synthetic', 'synthetic.uct', '300', '--n-countries', '2', '--seed', '3'])
+
+    assert (tmp_path / 'source_files' / 'synthetic.uct').read_text().split('\n')[:-1] == \
+        synthetic_grid.create_synthetic_uct(300, ['A', 'B'], seed=3)
+    assert 'countries A, B' in capsys.readouterr().out
+
+
+def test_sets_applies_max_ring_and_screening(tmp_path, monkeypatch, capsys):
+    from project_code import main, matrix_and_set_functions
+    from project_code.synthetic_grid import create_synthetic_uct
+    for module in [main, matrix_and_set_functions]:
+        monkeypatch.setattr(module, 'ROOT_DIR', str(tmp_path))
+    (tmp_path / 'source_files').mkdir()
+    (tmp_path / 'source_files' / 'synthetic.uct').write_text(
+        '\n'.join(create_synthetic_uct(200, ['A', 'B'], seed=0)) + '\n')
+    arguments = ['sets', 'UCT0', '--countries', 'A', '--set', "input_file_name='synthetic.uct'"]
+
+    set_sizes = []
+    for overrides in [[], ['max_ring=1', 'screening_policy=top_k', 'screening_value=1']]:
+        cli(arguments + overrides)
+        output = capsys.readouterr().out.splitlines()[-1]
+        set_sizes.append({name: int(size) for name, size in re.findall(r'\b([RTI]) (\d+)', output)})
+
+    assert set_sizes[1]['T'] == set_sizes[0]['T']
+    assert set_sizes[1]['R'] < set_sizes[0]['R']
+    assert set_sizes[1]['I'] < set_sizes[0]['I']
@@ -0,0 +1,197 @@
+import numpy as np
+from numba import jit
+
+from project_code import compute_influence_factors
+from project_code.classes import BranchSet
+from project_code.compute_influence_factors import compute_IFs, compute_IF_bounds, compute_relevance, \
+    compute_IFs_multi_country, compile_kernels
+from project_code.matrix_and_set_functions import create_PTDF_matrix, set_PTDF_on_branches, create_LODF_matrix, \
+    create_PATL_matrix, create_ISF_matrix_from_sparse_factorization
+from project_code.misc_functions import sub_matrix
+
+
+def test_IF_bounds_are_upper_bounds(meshed_grid):
+    setI, setT, setR, LODF, PATL, PTDF = meshed_grid
+    results, _ = compute_IFs(setI, setT, setR, LODF, PATL, PTDF)
+
+    vPTDF_I = np.array([i.PTDF for i in setI])
+    IF_bound, norm_IF_bound = compute_IF_bounds(setI, setT, setR, vPTDF_I,
+                                                sub_matrix(setI, setT, PTDF), PATL, PTDF)
+
+    assert [result.eltR for result in results] == list(setR)
+    for idx, result in enumerate(results):
+        assert result.IFN2 <= IF_bound[idx] + 1e-12
+        assert result.nIFN2 <= norm_IF_bound[idx] + 1e-12
+
+
+def test_compute_IFs_stops_at_irrelevant_rings(meshed_grid):
+    setI, setT, setR, LODF, PATL, PTDF = meshed_grid
+    all_results, _ = compute_IFs(setI, setT, setR, LODF, PATL, PTDF)
+
+    results, results_below_threshold = compute_IFs(setI, setT, setR, LODF, PATL, PTDF,
+                                                   relevance_threshold=np.inf)
+    assert len(results) == 0
+    assert [result.eltR for result in results_below_threshold] == list(setR)
+
+    results, results_below_threshold = compute_IFs(setI, setT, setR, LODF, PATL, PTDF,
+                                                   relevance_threshold=0.0)
+    assert len(results_below_threshold) == 0
+    assert [result.IFN2 for result in results] == [result.IFN2 for result in all_results]
+
+
+def test_compute_IFs_stops_at_the_first_irrelevant_ring(monkeypatch, meshed_grid):
+    setI, setT, setR, LODF, PATL, PTDF = meshed_grid
+    vPTDF_I = np.array([i.PTDF for i in setI])
+    mxPTDF_IT = sub_matrix(setI, setT, PTDF)
+    IF_bound, norm_IF_bound = compute_IF_bounds(setI, setT, setR, vPTDF_I, mxPTDF_IT, PATL, PTDF)
+    # the bounds do not depend on the chunks of R they are computed in
+    monkeypatch.setattr(compute_influence_factors, 'R_CHUNK_SIZE', 3)
+    assert np.allclose(compute_IF_bounds(setI, setT, setR, vPTDF_I, mxPTDF_IT, PATL, PTDF),
+                       (IF_bound, norm_IF_bound))
+
+    bound = np.maximum(IF_bound, norm_IF_bound)
+    is_ring_2 = setR.rings == 2
+    assert bound[is_ring_2].max() < bound[~is_ring_2].max()
+    relevance_threshold = (bound[is_ring_2].max() + bound[~is_ring_2].max()) / 2
+    results, results_below_threshold = compute_IFs(setI, setT, setR, LODF, PATL, PTDF,
+                                                   relevance_threshold=relevance_threshold)
+    assert [result.eltR for result in results] == [r for r in setR if r.ring < 2]
+    assert [result.eltR for result in results_below_threshold] == list(setR.in_ring(2))
+    assert [result.IFN2_bound for result in results_below_threshold] == list(IF_bound[is_ring_2])
+
+
+def test_compute_relevance_agrees_with_maximum_IF(meshed_grid):
+    setI, setT, setR, LODF, PATL, PTDF = meshed_grid
+    results, _ = compute_IFs(setI, setT, setR, LODF, PATL, PTDF)
+
+    for threshold in [0.05, 0.2, 0.5]:
+        results_relevance = compute_relevance(setI, setT, setR, PATL, PTDF, threshold)
+
+        assert [result.eltR for result in results_relevance] == list(setR)
+        for result, result_relevance in zip(results, results_relevance):
+            assert result_relevance.is_relevant == (max(result.IFN2, result.nIFN2) > threshold)
+            if result_relevance.is_relevant:
+                assert result_relevance.eltI in setI
+                assert result_relevance.eltT in setT
+
+
+def test_compute_IFs_top_witnesses(meshed_grid):
+    setI, setT, setR, LODF, PATL, PTDF = meshed_grid
+    n_top = 4
+
+    results, _ = compute_IFs(setI, setT, setR, LODF, PATL, PTDF, n_top_witnesses=n_top)
+
+    for result in results:
+        r = result.eltR
+        all_IFs = []
+        all_norm_IFs = []
+        for i in setI:
+            denominator = (1 - i.PTDF) * (1 - r.PTDF) - PTDF[r.index, i.index] * PTDF[i.index, r.index]
+            if i is r or abs(denominator) <= 0.00001:
+                continue
+            for t in setT:
+                if t is r or t is i:
+                    continue
+                IF = abs((PTDF[t.index, i.index] * PTDF[i.index, r.index] +
+                          (1 - i.PTDF) * PTDF[t.index, r.index]) / denominator)
+                all_IFs.append(IF)
+                all_norm_IFs.append(PATL[t.index, r.index] * IF)
+        witnesses = result.witnesses
+        assert witnesses.eltR is r
+        assert np.allclose(witnesses.IFs, sorted(all_IFs, reverse=True)[:n_top])
+        assert np.allclose(witnesses.norm_IFs, sorted(all_norm_IFs, reverse=True)[:n_top])
+        assert witnesses.IFs[0] == result.IFN2
+        assert witnesses.norm_IFs[0] == result.nIFN2
+
+
+def test_compute_IFs_rating_sets(meshed_grid):
+    setI, setT, setR, LODF, PATL, PTDF = meshed_grid
+    branches = sorted(list(setT) + list(setR), key=lambda branch: branch.index)
+    grid_PATL = np.array([branch.PATL for branch in branches])
+    ratings = np.array([grid_PATL, grid_PATL * np.linspace(0.5, 1.5, len(branches))])
+
+    results, _ = compute_IFs(setI, setT, setR, LODF, PATL, PTDF, ratings=ratings)
+
+    for idx_rating, rating in enumerate(ratings):
+        for branch in branches:
+            branch.PATL = rating[branch.index]
+        expected_results, _ = compute_IFs(setI, setT, setR, LODF, create_PATL_matrix(branches),
+                                          PTDF)
+        for result, expected_result in zip(results, expected_results):
+            rating_result = result.rating_results[idx_rating]
+            assert rating_result.IFN2 == result.IFN2
+            assert np.isclose(rating_result.nIFN2, expected_result.nIFN2)
+            assert rating_result.get_PATL(result.eltR) == expected_result.eltR.PATL
+
+
+def test_compute_IFs_multi_country_agrees_with_single_country(meshed_grid):
+    setI, setT, setR, LODF, PATL, PTDF = meshed_grid
+    branches = sorted(list(setT) + list(setR), key=lambda branch: branch.index)
+    rings_second_country = [1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1]
+    for branch, ring in zip(branches, rings_second_country):
+        branch.ring = ring
+    setT_2 = BranchSet(branches[5:10])
+    setR_2 = BranchSet(branches[:5] + branches[10:])
+    setI_2 = setR_2 + setT_2
+    sets_per_country = {'A': (setI, setT, setR), 'B': (setI_2, setT_2, setR_2)}
+
+    results_per_country = compute_IFs_multi_country(sets_per_country, LODF, PATL, PTDF)
+
+    for country, (set_i, set_t, set_r) in sets_per_country.items():
+        expected_results, _ = compute_IFs(set_i, set_t, set_r, LODF, PATL, PTDF)
+        results = results_per_country[country]
+        assert [result.eltR for result in results] == [result.eltR for result in expected_results]
+        for result, expected_result in zip(results, expected_results):
+            assert (result.IFN1, result.nIFN1) == (expected_result.IFN1, expected_result.nIFN1)
+            assert (result.IFN2, result.nIFN2) == (expected_result.IFN2, expected_result.nIFN2)
+            assert (result.eltI, result.eltT) == (expected_result.eltI, expected_result.eltT)
+            assert (result.eltIn, result.eltTn) == (expected_result.eltIn, expected_result.eltTn)
+
+
+def test_compute_IFs_with_max_ring_agrees_with_full_network(meshed_grid):
+    setI, setT, setR, LODF, PATL, PTDF = meshed_grid
+    expected_results, _ = compute_IFs(setI, setT, setR, LODF, PATL, PTDF)
+    branches = sorted(list(setT) + list(setR), key=lambda branch: branch.index)
+    nodes = sorted({node.index: node for branch in branches for node in (branch.node_from, branch.node_to)
+                    }.values(), key=lambda node: node.index)
+
+    ISF = create_ISF_matrix_from_sparse_factorization(branches, nodes, nodes[0])
+    PTDF_sparse = create_PTDF_matrix(branches, ISF)
+    set_PTDF_on_branches(PTDF_sparse, branches, 0.001)
+    LODF_sparse = create_LODF_matrix(branches, PTDF_sparse, 0.001)
+    setR_ring_1 = BranchSet([branch for branch in setR if branch.ring <= 1])
+    results, _ = compute_IFs(setI, setT, setR_ring_1, LODF_sparse, PATL, PTDF_sparse)
+
+    # the contingencies of ring 2 are kept: the IFs of the elements up to ring 1 are unchanged
+    assert len(setR_ring_1) < len(setR)
+    assert any(result.eltI.ring == 2 for result in expected_results if result.eltR.ring <= 1)
+    assert [result.eltR for result in results] == list(setR_ring_1)
+    for result, expected_result in zip(results, expected_results):
+        assert np.isclose(result.IFN1, expected_result.IFN1)
+        assert np.isclose(result.nIFN1, expected_result.nIFN1)
+        assert np.isclose(result.IFN2, expected_result.IFN2)
+        assert np.isclose(result.nIFN2, expected_result.nIFN2)
+        assert (result.eltI, result.eltT) == (expected_result.eltI, expected_result.eltT)
+        assert (result.eltIn, result.eltTn) == (expected_result.eltIn, expected_result.eltTn)
+
+
+KERNELS = ['push_bounded_heap', 'compute_relevance_CPU', 'compute_IF_CPU', 'compute_IF_multi_country_CPU',
+           'get_max_results']
+
+
+def test_compile_kernels_matches_the_signatures_used_by_the_callers(meshed_grid, monkeypatch):
+    # fresh dispatchers without any compiled specialization, so the test does not depend on the test order
+    for name in KERNELS:
+        kernel = getattr(compute_influence_factors, name)
+        monkeypatch.setattr(compute_influence_factors, name,
+                            jit(**kernel.targetoptions)(kernel.py_func))
+    compile_kernels()
+    signatures = {name: list(getattr(compute_influence_factors, name).signatures) for name in KERNELS}
+
+    setI, setT, setR, LODF, PATL, PTDF = meshed_grid
+    compute_IFs(setI, setT, setR, LODF, PATL, PTDF, n_top_witnesses=2)
+    compute_IFs(setI, setT, setR, LODF, PATL, PTDF, relevance_threshold=0.01)
+    compute_relevance(setI, setT, setR, PATL, PTDF, 0.01)
+    compute_IFs_multi_country({'A': (setI, setT, setR)}, LODF, PATL, PTDF)
+
+    assert {name: list(getattr(compute_influence_factors, name).signatures) for name in KERNELS} == signatures
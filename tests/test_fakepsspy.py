@@ -0,0 +1,80 @@
+from pathlib import Path
+
+import pytest
+
+from definitions import ROOT_DIR
+import project_code.topology_getter  # noqa: F401, adds the topology_getter modules to the path
+import fakepsspy
+import pssetopology
+from monsterexceptions import PsseBrndatException, PsseNxtMslException
+from monsterpsspy import MonsterPssPy
+
+RAW_FILE = str(Path(ROOT_DIR) / "source_files" / "PSSETestCase.raw")
+
+
+@pytest.fixture
+def fake_psspy():
+    fake_psspy = fakepsspy.FakePssPy()
+    with fakepsspy.installed(fake_psspy):
+        MonsterPssPy.case(RAW_FILE)
+        yield fake_psspy
+
+
+def test_split_raw_record():
+    assert fakepsspy.split_raw_record("  1,'A/B 1 ', 400.0,3 / comment, 'x'") == \
+        ['1', 'A/B 1', '400.0', '3']
+    assert fakepsspy.split_raw_record("2,'',1") == ['2', '', '1']
+
+
+# noinspection PyShadowingNames
+def test_array_and_single_element_calls(fake_psspy):
+    (bus_numbers, dummies) = MonsterPssPy.abusint(-1, flag=2, string=['NUMBER', 'DUMMY'])
+    assert len(bus_numbers) == len(fake_psspy.buses)
+    assert [bus for bus, dummy in zip(bus_numbers, dummies) if dummy] == [50, 51]
+
+    # flag 2: all non-transformer branches, flag 6: all two winding transformers
+    (from_buses,) = MonsterPssPy.abrnint(-1, flag=2, ties=3, string='FROMNUMBER')
+    (from_buses_transformers,) = MonsterPssPy.abrnint(-1, flag=6, ties=3, string='FROMNUMBER')
+    assert len(from_buses) + len(from_buses_transformers) == len(fake_psspy.branches)
+    assert sorted(from_buses_transformers) == [8, 124, 127, 204]
+
+    assert MonsterPssPy.brndat(3, 4, '2', 'RATEA') == 1600.0
+    assert MonsterPssPy.brnint(3, 4, '2', 'STATUS') == 0
+    with pytest.raises(PsseBrndatException):
+        MonsterPssPy.brndat(3, 5, '1', 'RATEA')
+
+    # three winding transformer 2-20-21 given on winding bases: star impedances on system base
+    assert MonsterPssPy.wnddt2(20, 2, 21, '1', 'RX') == pytest.approx(0.0003333 + 0.0183333j, rel=1e-3)
+    assert MonsterPssPy.wnddat(21, 2, 20, '1', 'RATEA') == 300.0
+
+    MonsterPssPy.inimsl(3, 6, '&1')
+    sections = []
+    with pytest.raises(PsseNxtMslException):
+        while True:
+            sections.append(MonsterPssPy.nxtmsl())
+    assert sections == [(3, 50, '1 '), (50, 51, '1 '), (51, 6, '1 ')]
+
+
+# noinspection PyShadowingNames
+def test_extraction_call_counts(fake_psspy):
+    fake_psspy.reset_call_counts()
+    topology = pssetopology.extract_components_from_case({0: RAW_FILE})
+
+    assert len(topology.msl_parents) == 1
+    assert len(topology.msl_children) == 3
+    assert len(topology.two_winding_transformer_dict) == 4
+    assert len(topology.three_winding_transformer_dict) == 1
+    assert len(topology.machine_dict) == len(fake_psspy.machines)
+    # the array calls are made once per kind of component, the status once per component
+    assert fake_psspy.call_counts['abuschar'] == 1
+    assert fake_psspy.call_counts['busint'] == len(topology.bus_dict)
+    assert fake_psspy.call_counts['macint'] == len(topology.machine_dict)
+    assert fake_psspy.call_counts['inibrx'] == len(topology.bus_dict)
+    assert fake_psspy.call_counts['case'] == 1
+
+
+def test_installed_restores_psspy():
+    had_psspy = hasattr(fakepsspy.monsterpsspy, 'psspy')
+    with fakepsspy.installed(fakepsspy.FakePssPy()) as fake_psspy:
+        assert fakepsspy.monsterpsspy.psspy is fake_psspy
+    assert hasattr(fakepsspy.monsterpsspy, 'psspy') == had_psspy
@@ -0,0 +1,147 @@
+from pathlib import Path
+
+import pytest
+
+from definitions import ROOT_DIR
+from project_code.compute_influence_factors import compute_IFs
+from project_code import main, matrix_and_set_functions
+from project_code.influence_case import InfluenceCase
+from project_code.main import open_file, read_grid, create_and_preprocess_topology, create_system_matrices, \
+    create_sets
+from project_code.settings import SettingsEnum
+from project_code.synthetic_grid import create_synthetic_uct
+
+
+@pytest.fixture
+def output_dir(tmp_path, monkeypatch):
+    """Redirects the output_files of the runs to tmp_path, reading the grids of source_files."""
+    (tmp_path / 'source_files').symlink_to(Path(ROOT_DIR) / 'source_files')
+    monkeypatch.setattr(main, 'ROOT_DIR', str(tmp_path))
+    monkeypatch.setattr(matrix_and_set_functions, 'ROOT_DIR', str(tmp_path))
+    return tmp_path / 'output_files'
+
+
+def test_stages_are_computed_once(output_dir):
+    case = InfluenceCase.from_file('PSSETestCase.raw', SettingsEnum.PSSETest)
+    assert case._lodf is None
+    lodf = case.lodf
+    assert case._topology is not None and case._ptdf is not None
+    assert case.lodf is lodf
+    assert case.topology.branches[0].index == 0
+    assert case.susceptance_factor.shape == (len(case.topology.nodes) - 1,) * 2
+    assert case.sets('A') is case.sets('A')
+    assert case.influence('A') is case.influence('A')
+    assert case.countries == ['A', 'B', 'C']
+    with pytest.raises(ValueError):
+        case.sets('D')
+    # the sets of a case are not written over the ones of the runs of main
+    assert not output_dir.exists()
+
+
+def test_influence_matches_a_run(output_dir):
+    case = InfluenceCase.from_file('PSSETestCase.raw', SettingsEnum.PSSETest)
+    settings = case.settings
+    branches, generators, nodes = read_grid(open_file(settings), settings)
+    branches, nodes, _ = create_and_preprocess_topology(branches, generators, nodes, 'B', settings)
+    _, PTDF, LODF, PATL = create_system_matrices(branches, nodes, 'B', settings.eps)
+    setI, setT, setR, _ = create_sets(branches, generators, LODF, PATL, 'B', settings.eps, settings)
+    expected = {result.eltR.name_branch: result.IFN2 for result in
+                compute_IFs(setI, setT, setR, LODF, PATL, PTDF)[0]}
+
+    results = case.influence('B')
+    assert {result.eltR.name_branch: result.IFN2 for result in results} == pytest.approx(expected)
+    assert {branch.name_branch for branch in case.sets('B')[1]} == {branch.name_branch for branch in setT}
+
+    element = results[-1].eltR.name_branch
+    assert case.influence('B', R=[element]) == [results[-1]]
+    # ad-hoc T restricted to the monitored element on which the IF is reached: same IF
+    adhoc_result, = case.influence('B', R=[element], T=[results[-1].eltT.name_branch])
+    assert adhoc_result.IFN2 == pytest.approx(results[-1].IFN2)
+    with pytest.raises(ValueError):
+        case.influence('B', R=['unknown branch'], I=[results[0].eltI.name_branch])
+
+
+def test_what_if(output_dir):
+    case = InfluenceCase.from_file('PSSETestCase.raw', SettingsEnum.PSSETest)
+    results = case.influence('A')
+    lodf = case.lodf
+
+    unchanged = case.what_if('A', impedances={results[0].eltR.name_branch: results[0].eltR.impedance})
+    assert [result.IFN2 for result in unchanged] == pytest.approx([result.IFN2 for result in results])
+
+    opened = results[0].eltR.name_branch
+    results_opened = case.what_if('A', opened=[opened])
+    # the opened branch and the branches it leaves radial are left out
+    assert {result.eltR.name_branch for result in results_opened} <= \
+        {result.eltR.name_branch for result in results} - {opened}
+    assert case.lodf is lodf and case.influence('A') is results
+    with pytest.raises(ValueError):
+        case.what_if('A', impedances={opened: 0.0})
+
+
+def edit_uct_line(file_contents, name_branch, start, end, value):
+    """Copy of file_contents with columns start:end of the line name_branch set to value."""
+    file_contents = list(file_contents)
+    i = file_contents.index('##L') + 1
+    while f"{file_contents[i][0:8]} {file_contents[i][9:17]} {file_contents[i][18]}" != name_branch:
+        i += 1
+    file_contents[i] = file_contents[i][:start] + value.rjust(end - start) + file_contents[i][end:]
+    return file_contents
+
+
+def get_results_by_name(results):
+    results_by_name = {}
+    for result in results:
+        name = result.eltR.name_branch
+        results_by_name.update({(name, 'IFN2'): result.IFN2, (name, 'nIFN1'): result.nIFN1,
+                                (name, 'nIFN2'): result.nIFN2})
+    return results_by_name
+
+
+def test_update_from_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'ROOT_DIR', str(tmp_path))
+    monkeypatch.setattr(matrix_and_set_functions, 'ROOT_DIR', str(tmp_path))
+    (tmp_path / 'source_files').mkdir()
+    file_contents = create_synthetic_uct(300, ['A', 'B'], seed=0)
+
+    def write_snapshot(input_file_name, snapshot_contents):
+        (tmp_path / 'source_files' / input_file_name).write_text('\n'.join(snapshot_contents) + '\n')
+        return input_file_name
+
+    case = InfluenceCase.from_file(write_snapshot('h0.uct', file_contents), countries=['A', 'B'])
+    results = case.influence('A')
+    setI, setT, setR, _ = case.sets('A')
+
+    same_case = case.update_from_file(write_snapshot('h1.uct', file_contents))
+    assert same_case.snapshot_update == 'unchanged'
+    assert same_case.lodf is case.lodf
+    assert get_results_by_name(same_case.influence('A')) == get_results_by_name(results)
+    assert same_case.influence('A')[0].eltR is same_case.branches_by_name[results[0].eltR.name_branch]
+
+    line_names = {line for line in file_contents[file_contents.index('##L') + 1:file_contents.index('##T')]}
+    line_names = {f"{line[0:8]} {line[9:17]} {line[18]}" for line in line_names}
+    setT_names = {branch.name_branch for branch in setT}
+    r = next(branch for branch in setR if branch.name_branch in line_names - setT_names and branch.PATL > 0)
+    rated_case = case.update_from_file(write_snapshot('h2.uct', edit_uct_line(
+        file_contents, r.name_branch, 45, 51, '1234')))
+    assert rated_case.snapshot_update == 'ratings'
+    assert list(rated_case.snapshot_diff.ratings) == [r.name_branch]
+    # normalized IF rescaled without a new sweep
+    assert 'A' in rated_case._influence
+    assert get_results_by_name(rated_case.influence('A')) == \
+        pytest.approx(get_results_by_name(InfluenceCase(rated_case.settings).influence('A')))
+
+    opened = next(branch for branch in setI if branch.name_branch in line_names - {r.name_branch}
+                  and not branch.is_radial)
+    changed_contents = edit_uct_line(edit_uct_line(file_contents, opened.name_branch, 20, 21, '8'),
+                                     r.name_branch, 29, 35, '12.000')
+    changed_case = case.update_from_file(write_snapshot('h3.uct', changed_contents))
+    assert changed_case.snapshot_update == 'low rank'
+    assert changed_case.snapshot_diff.removed == [opened.name_branch]
+    assert list(changed_case.snapshot_diff.impedances) == [r.name_branch]
+    new_case = InfluenceCase(changed_case.settings)
+    assert changed_case.ptdf == pytest.approx(new_case.ptdf)
+    assert get_results_by_name(changed_case.influence('A')) == \
+        pytest.approx(get_results_by_name(new_case.influence('A')))
+
+    assert changed_case.update_from_file('h0.uct').snapshot_update == 'full'
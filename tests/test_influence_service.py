@@ -0,0 +1,82 @@
+import json
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+from definitions import ROOT_DIR
+from project_code import main, matrix_and_set_functions
+from project_code.influence_service import load_case, create_server
+from project_code.settings import SettingsEnum, get_settings
+
+
+@pytest.fixture(scope='module')
+def case(tmp_path_factory):
+    # output_files of the case in a temporary directory, the grid is read from source_files
+    tmp_path = tmp_path_factory.mktemp('influence_service')
+    (tmp_path / 'source_files').symlink_to(Path(ROOT_DIR) / 'source_files')
+    settings = get_settings(SettingsEnum.PSSETest)
+    settings.input_file_name = 'PSSETestCase.raw'
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(main, 'ROOT_DIR', str(tmp_path))
+        monkeypatch.setattr(matrix_and_set_functions, 'ROOT_DIR', str(tmp_path))
+        yield load_case(settings)
+
+
+# noinspection PyShadowingNames
+@pytest.fixture
+def url(case):
+    server = create_server(case, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# noinspection PyShadowingNames
+def test_server(url):
+    with urllib.request.urlopen(f"{url}/countries") as response:
+        assert set(json.loads(response.read())['countries']) == {'A', 'B', 'C'}
+
+    with urllib.request.urlopen(f"{url}/influence?country=A") as response:
+        results = json.loads(response.read())['results']
+    element = results[0]['element']
+    query = urllib.parse.urlencode({'country': 'A', 'element': element})
+    with urllib.request.urlopen(f"{url}/influence?{query}") as response:
+        assert json.loads(response.read())['results'] == results[:1]
+
+    request = urllib.request.Request(f"{url}/influence", method='POST', data=json.dumps(
+        {'country': 'A', 'R': [element], 'I': [results[0]['I']]}).encode('utf-8'))
+    with urllib.request.urlopen(request) as response:
+        assert json.loads(response.read())['results'][0]['IF_N2'] == \
+            pytest.approx(results[0]['IF_N2'])
+
+    request = urllib.request.Request(f"{url}/what_if", method='POST', data=json.dumps(
+        {'country': 'A', 'opened': [results[0]['I']]}).encode('utf-8'))
+    with urllib.request.urlopen(request) as response:
+        assert results[0]['I'] not in {result['I'] for result in json.loads(response.read())['results']}
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(f"{url}/influence?country=D")
+    assert error.value.code == 400
+    assert 'not connected' in json.loads(error.value.read())['error']
+
+
+# noinspection PyShadowingNames
+@pytest.mark.parametrize('path,body', [('/influence', b'{"country": "A", "R": '),
+                                       ('/influence', b'{"country": "A", "R": 5}'),
+                                       ('/influence', b'{"country": "A", "R": [["A1", "A2"]]}'),
+                                       ('/what_if', b'{"country": "A", "opened": ["no such branch"]}'),
+                                       ('/what_if', b'{"country": "A", "impedances": [1, 2]}')])
+def test_server_malformed_query(url, path, body):
+    request = urllib.request.Request(f"{url}{path}", method='POST', data=body)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(request)
+    assert error.value.code == 400
+    assert json.loads(error.value.read())['error']
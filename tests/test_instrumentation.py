@@ -0,0 +1,62 @@
+import json
+import tracemalloc
+
+import numpy as np
+
+from project_code import instrumentation
+from project_code.instrumentation import start_run_report, stop_run_report, stage_timer, report_stage, \
+    set_counter, increment_counter
+from project_code.settings import SettingsEnum, get_settings
+
+
+@report_stage
+def allocate(n_values):
+    return np.ones(n_values).tolist()
+
+
+def test_run_report(tmp_path, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'ROOT_DIR', str(tmp_path))
+    settings = get_settings(SettingsEnum.UCT0)
+
+    start_run_report('A', settings, do_trace_memory=True)
+    with stage_timer('outer'):
+        allocate(100000)
+        allocate(10)
+    set_counter('size_R', 3)
+    increment_counter('kernel_IR_pairs', 6)
+    increment_counter('kernel_IR_pairs', 4)
+    report = stop_run_report('A', settings)
+
+    assert [(stage['name'], stage['parent']) for stage in report['stages']] == \
+        [('allocate', 'outer'), ('allocate', 'outer'), ('outer', None)]
+    large, small, outer = report['stages']
+    assert large['peak_traced_MB'] > 10 * small['peak_traced_MB']
+    assert outer['peak_traced_MB'] >= large['peak_traced_MB']
+    assert outer['duration_s'] >= large['duration_s'] + small['duration_s']
+    assert not tracemalloc.is_tracing()
+    assert all('process_peak_rss_MB' in stage for stage in report['stages'])
+    assert report['counters'] == {'size_R': 3, 'kernel_IR_pairs': 10}
+
+    report_path = tmp_path / 'output_files' / 'Europe_example_uct' / 'A' / 'A_run_report.json'
+    assert json.loads(report_path.read_text()) == report
+
+
+def test_run_report_leaves_tracing_of_the_caller_running(tmp_path, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'ROOT_DIR', str(tmp_path))
+    settings = get_settings(SettingsEnum.UCT0)
+
+    tracemalloc.start()
+    try:
+        start_run_report('A', settings, do_trace_memory=True)
+        allocate(10)
+        report = stop_run_report('A', settings)
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+    assert 'peak_traced_MB' in report['stages'][0]
+
+
+def test_stages_outside_of_a_run_report_are_not_recorded():
+    assert allocate(3) == [1.0, 1.0, 1.0]
+    set_counter('size_R', 3)
+    assert stop_run_report('A', None) is None
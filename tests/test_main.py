@@ -114,3 +114,64 @@ def test_full_run_test_case(settings):
 
 
     main(settings=settings)
+
+
+def test_full_run_stores_screened_contingencies(tmp_path, monkeypatch):
+    from project_code import main as main_module, matrix_and_set_functions, misc_functions, instrumentation, \
+        results_database, store_functions, topology_functions
+    from project_code.results_database import query_runs, query_set_members
+    from project_code.settings import ScreeningEnum, get_settings
+    from project_code.synthetic_grid import create_synthetic_uct
+    for module in [main_module, matrix_and_set_functions, misc_functions, instrumentation, results_database,
+                   store_functions, topology_functions]:
+        monkeypatch.setattr(module, 'ROOT_DIR', str(tmp_path))
+    (tmp_path / 'source_files').mkdir()
+    (tmp_path / 'source_files' / 'synthetic.uct').write_text(
+        '\n'.join(create_synthetic_uct(200, ['A', 'B'], seed=0)) + '\n')
+    settings = get_settings(SettingsEnum.UCT0)
+    settings.input_file_name = 'synthetic.uct'
+    settings.countries = ['A']
+    settings.do_calculate_generator_IF = False
+    settings.screening_policy = ScreeningEnum.top_k
+    settings.screening_value = 2
+    settings.results_database = 'results.sqlite'
+
+    main(settings)
+
+    database_path = tmp_path / 'output_files' / 'results.sqlite'
+    run_id = query_runs(database_path)[0]['run_id']
+    setI_file = tmp_path / 'output_files' / 'Europe_synthetic_uct' / 'A' / 'A_sets_I.csv'
+    n_unscreened = len(setI_file.read_text().splitlines())
+    setI = query_set_members(database_path, run_id, 'I')
+    assert len(setI) < n_unscreened
+    assert set(query_set_members(database_path, run_id, 'T')) <= set(setI)
+
+
+@pytest.mark.parametrize('mode', ['do_stop_at_irrelevant_rings', 'do_relevance_only'])
+def test_relevance_modes_require_a_threshold(mode):
+    from project_code.settings import get_settings
+    settings = get_settings(SettingsEnum.UCT0)
+    setattr(settings, mode, True)
+
+    with pytest.raises(ValueError, match='relevance_threshold'):
+        main(settings)
+
+
+def test_relevance_modes_cannot_be_combined():
+    from project_code.settings import get_settings
+    settings = get_settings(SettingsEnum.UCT0)
+    settings.relevance_threshold = 0.05
+    settings.do_stop_at_irrelevant_rings = True
+    settings.do_relevance_only = True
+
+    with pytest.raises(ValueError, match='cannot be combined'):
+        main(settings)
+
+
+def test_screening_policy_requires_a_screening_value():
+    from project_code.settings import get_settings, ScreeningEnum
+    settings = get_settings(SettingsEnum.UCT0)
+    settings.screening_policy = ScreeningEnum.top_k
+
+    with pytest.raises(ValueError, match='screening_value'):
+        main(settings)
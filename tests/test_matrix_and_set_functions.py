@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from project_code.classes import Branch, BranchTypeEnum, BranchSet
+from project_code.matrix_and_set_functions import screen_contingencies, update_PTDF_matrix, \
+    create_inv_susceptance_matrix, create_ISF_matrix, create_PTDF_matrix
+from project_code.settings import ScreeningEnum
+
+
+def create_sets():
+    """Branches 0-1 form T (ring 0), branches 2-5 are external contingencies in rings 1 and 2."""
+    rings = [0, 0, 1, 1, 2, 2]
+    branches = []
+    for idx, ring in enumerate(rings):
+        branch = Branch('A', 'B', str(idx), 0.1, 100.0, 380.0, BranchTypeEnum.Line, 'A-B')
+        branch.index = idx
+        branch.ring = ring
+        branches.append(branch)
+    setT = BranchSet(branches[:2])
+    setI = BranchSet(branches[2:] + branches[:2])
+    LODF = np.zeros((6, 6))
+    LODF[0, 2:] = [0.5, 0.01, 0.2, 0.1]
+    LODF[1, 2:] = [-0.1, -0.02, 0.0, -0.3]
+    PATL = np.ones((6, 6))
+    return setI, setT, LODF, PATL
+
+
+def test_screen_contingencies_threshold():
+    setI, setT, LODF, PATL = create_sets()
+
+    screened_setI = screen_contingencies(setI, setT, LODF, PATL, ScreeningEnum.threshold, 0.15)
+
+    assert list(screened_setI.indices) == [2, 4, 5, 0, 1]
+
+
+def test_screen_contingencies_top_k():
+    setI, setT, LODF, PATL = create_sets()
+
+    screened_setI = screen_contingencies(setI, setT, LODF, PATL, ScreeningEnum.top_k, 1)
+
+    assert list(screened_setI.indices) == [2, 5, 0, 1]
+
+
+def test_screen_contingencies_cumulative():
+    setI, setT, LODF, PATL = create_sets()
+
+    screened_setI = screen_contingencies(setI, setT, LODF, PATL, ScreeningEnum.cumulative, 0.6)
+
+    assert list(screened_setI.indices) == [2, 5, 0, 1]
+
+
+def test_update_PTDF_matrix_matches_a_new_inversion(meshed_grid):
+    setI, _, _, _, _, PTDF = meshed_grid
+    branches = sorted(setI, key=lambda branch: branch.index)
+    nodes = sorted({branch.node_from for branch in branches} | {branch.node_to for branch in branches},
+                   key=lambda node: node.index)
+    impedance = np.array([branch.impedance for branch in branches])
+    changed_idx, new_impedance = [1, 6, 12], [np.inf, 0.02, 0.6]
+
+    updated_PTDF = update_PTDF_matrix(PTDF, impedance, changed_idx, new_impedance)
+
+    for idx, branch_impedance in zip(changed_idx, new_impedance):
+        branches[idx].impedance = 1e12 if np.isinf(branch_impedance) else branch_impedance
+    inv_B = create_inv_susceptance_matrix(branches, nodes, nodes[0])
+    expected_PTDF = create_PTDF_matrix(branches, create_ISF_matrix(branches, nodes, inv_B, nodes[0]))
+    assert np.allclose(updated_PTDF, expected_PTDF, atol=1e-9)
+    assert not updated_PTDF[1, :].any()
+
+    # nodes 1 to 3 are only connected to the rest of the grid by branches 3-4, 1-4, 2-5 and 3-7
+    with pytest.raises(ValueError):
+        update_PTDF_matrix(PTDF, impedance, [3, 4, 10, 11], [np.inf] * 4)
@@ -0,0 +1,40 @@
+import numpy as np
+
+from project_code.classes import Branch, BranchTypeEnum, BranchSet
+from project_code.misc_functions import sub_matrix, combine_sets
+
+
+def create_branch_set(indices, ring=1):
+    branches = []
+    for idx in indices:
+        branch = Branch('A', 'B', str(idx), 0.1, 100.0, 380.0, BranchTypeEnum.Line, 'A-B')
+        branch.index = idx
+        branch.ring = ring
+        branches.append(branch)
+    return BranchSet(branches)
+
+
+def test_sub_matrix():
+    matrix = np.arange(36, dtype=float).reshape(6, 6)
+    set_rows = create_branch_set([4, 1])
+    set_columns = create_branch_set([0, 5, 2])
+
+    result = sub_matrix(set_columns, set_rows, matrix)
+
+    assert np.array_equal(result, [[24., 29., 26.], [6., 11., 8.]])
+
+
+def test_combine_sets():
+    setA = create_branch_set([3, 0, 7])
+    setB = BranchSet([setA[2], setA[0]] + list(create_branch_set([9])))
+
+    assert list(combine_sets(setA, setB)) == [1, -1, 0]
+    assert list(combine_sets(setA, BranchSet([]))) == [-1, -1, -1]
+
+
+def test_branch_set_in_ring():
+    branch_set = create_branch_set([0, 1], ring=1) + create_branch_set([2], ring=2)
+
+    assert list(branch_set.in_ring(1).indices) == [0, 1]
+    assert list(branch_set.in_ring(2).indices) == [2]
+    assert len(branch_set.in_ring(3)) == 0
@@ -0,0 +1,63 @@
+import numpy as np
+
+from project_code.classes import Branch, BranchTypeEnum
+from project_code.matrix_and_set_functions import create_inv_susceptance_matrix, create_ISF_matrix, \
+    create_ISF_matrix_from_sparse_factorization
+from project_code.network_reduction import reduce_network, create_ISF_matrix_from_reduced_network
+from project_code.read_grid import create_nodes_and_update_branches_with_node_info
+
+
+def create_small_grid():
+    """Meshed core 1-2-3-4 with a series chain 1-5-6-3, a dangling tree 2-7-8 / 7-9 and a tree
+    hanging from chain node 5 (5-10)."""
+    branch_data = [('1', '2', 0.1), ('2', '3', 0.2), ('3', '4', 0.15), ('4', '1', 0.3),
+                   ('2', '4', 0.25), ('1', '5', 0.05), ('6', '5', 0.07), ('6', '3', 0.11),
+                   ('7', '2', 0.4), ('7', '8', 0.2), ('9', '7', 0.3), ('5', '10', 0.1)]
+    branches = [Branch(name_from, name_to, '1', impedance, 100.0, 380.0, BranchTypeEnum.Line,
+                       f'{name_from}-{name_to}')
+                for (name_from, name_to, impedance) in branch_data]
+    nodes = create_nodes_and_update_branches_with_node_info(branches)
+    for idx, branch in enumerate(branches):
+        branch.index = idx
+    for idx, node in enumerate(nodes):
+        node.index = idx
+    return branches, nodes
+
+
+def test_reduce_network_sizes():
+    branches, nodes = create_small_grid()
+    slack_node = nodes[0]
+
+    reduction = reduce_network(nodes, branches, slack_node)
+
+    assert reduction.n_reduced_nodes == 4
+    assert reduction.n_reduced_branches == 6
+    tree_branches = [b.name_branch for b in branches if reduction.branch_to_reduced[b.index] < 0]
+    assert sorted(tree_branches) == ['5 10 1', '7 2 1', '7 8 1', '9 7 1']
+    chain = set(reduction.branch_to_reduced[[5, 6, 7]])
+    assert len(chain) == 1
+
+
+def test_ISF_from_reduced_network_equals_full_ISF():
+    branches, nodes = create_small_grid()
+    for slack_node in [nodes[0], nodes[2]]:
+        inv_B = create_inv_susceptance_matrix(branches, nodes, slack_node)
+        ISF_full = create_ISF_matrix(branches, nodes, inv_B, slack_node)
+
+        reduction = reduce_network(nodes, branches, slack_node)
+        ISF_reduced = create_ISF_matrix_from_reduced_network(reduction)
+
+        assert ISF_reduced.shape == ISF_full.shape
+        assert np.allclose(ISF_reduced, ISF_full, atol=1e-12)
+
+
+def test_ISF_from_sparse_factorization_equals_full_ISF():
+    branches, nodes = create_small_grid()
+    for slack_node in [nodes[0], nodes[2]]:
+        inv_B = create_inv_susceptance_matrix(branches, nodes, slack_node)
+        ISF_full = create_ISF_matrix(branches, nodes, inv_B, slack_node)
+
+        ISF_sparse = create_ISF_matrix_from_sparse_factorization(branches, nodes, slack_node)
+
+        assert ISF_sparse.shape == ISF_full.shape
+        assert np.allclose(ISF_sparse, ISF_full, atol=1e-12)
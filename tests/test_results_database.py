@@ -0,0 +1,59 @@
+import os
+
+from project_code import results_database
+from project_code.classes import Result_IF_generators
+from project_code.compute_influence_factors import compute_IFs
+from project_code.results_database import add_run, add_set_members, add_results, add_results_generators, \
+    query_runs, query_IF_history, query_generator_IF_history, query_set_members, query_top_elements, \
+    get_snapshot_time
+from project_code.settings import SettingsEnum, get_settings
+
+
+def test_results_database_queries(tmp_path, monkeypatch, meshed_grid):
+    monkeypatch.setattr(results_database, 'ROOT_DIR', str(tmp_path))
+    settings = get_settings(SettingsEnum.UCT0)
+    settings.results_database = 'results.db'
+    database_path = tmp_path / 'output_files' / 'results.db'
+    setI, setT, setR, LODF, PATL, PTDF = meshed_grid
+    results, _ = compute_IFs(setI, setT, setR, LODF, PATL, PTDF)
+
+    for timestamp, country in [('2018-01-01T00:00:00', 'A'), ('2018-01-01T01:00:00', 'A'),
+                               ('2018-01-01T01:00:00', 'B')]:
+        run_id = add_run(settings, country, timestamp)
+        add_set_members(settings, run_id, {'R': setR, 'T': setT, 'I': setI})
+        add_results(settings, run_id, results)
+        add_results_generators(settings, run_id, [Result_IF_generators('G1', 100.0, 0.5, [], [], 0.25,
+                                                                       [], [])])
+
+    runs = query_runs(database_path, country='A')
+    assert [(run['run_id'], run['settings_name']) for run in runs] == [(1, 'UCT0'), (2, 'UCT0')]
+    assert len(query_runs(database_path, since='2018-01-01T00:30:00')) == 2
+
+    element = results[0].eltR.name_branch
+    history = query_IF_history(database_path, element, case_name='Europe', country='A')
+    assert [row['timestamp'] for row in history] == ['2018-01-01T00:00:00', '2018-01-01T01:00:00']
+    assert [row['IF_N2'] for row in history] == [results[0].IFN2] * 2
+    assert history[0]['T_norm'] == results[0].eltTn.name_branch
+
+    assert len(query_generator_IF_history(database_path, 'G1', until='2018-01-01T00:30:00')) == 1
+    assert query_set_members(database_path, 3, 'T') == [branch.name_branch for branch in setT]
+    top = query_top_elements(database_path, 1, n_elements=2, do_normalized=True)
+    assert [row['norm_IF_N2'] for row in top] == sorted([result.nIFN2 for result in results],
+                                                        reverse=True)[:2]
+
+
+def test_get_snapshot_time(tmp_path, monkeypatch):
+    monkeypatch.setattr(results_database, 'ROOT_DIR', str(tmp_path))
+    (tmp_path / 'source_files').mkdir()
+    (tmp_path / 'source_files' / 'snapshot.uct').touch()
+    os.utime(tmp_path / 'source_files' / 'snapshot.uct', (1514800800, 1514800800))
+    settings = get_settings(SettingsEnum.UCT0)
+
+    settings.input_file_name = 'snapshot.uct'
+    assert get_snapshot_time(settings) == '2018-01-01T10:00:00'
+    settings.input_file_name = 'hourly/20180101_1030_SN1_UX0.uct'
+    assert get_snapshot_time(settings) == '2018-01-01T10:30:00'
+    settings.input_file_name = 'missing_99999999_9999.uct'
+    assert get_snapshot_time(settings) is None
+    settings.snapshot_time = '2018-06-01T12:00:00'
+    assert get_snapshot_time(settings) == '2018-06-01T12:00:00'
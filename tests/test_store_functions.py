@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from project_code import store_functions
+from project_code.classes import Result_IF_generators
+from project_code.compute_influence_factors import compute_IFs
+from project_code.settings import SettingsEnum, get_settings
+from project_code.store_functions import store_results_hdf5, store_results_generators_hdf5, read_table_hdf5, \
+    create_pair_maxima_hdf5, read_pair_maxima_hdf5, get_results_file_path
+
+
+def test_store_results_hdf5_round_trip(tmp_path, monkeypatch, meshed_grid):
+    monkeypatch.setattr(store_functions, 'ROOT_DIR', str(tmp_path))
+    settings = get_settings(SettingsEnum.UCT0)
+    setI, setT, setR, LODF, PATL, PTDF = meshed_grid
+    branches = list(setT) + list(setR)
+    results, _ = compute_IFs(setI, setT, setR, LODF, PATL, PTDF, n_top_witnesses=2)
+    results_generators = [Result_IF_generators('G1', 100.0, 0.5, [branches[0].name_branch],
+                                               [branches[1].name_branch, [branches[2].name_branch]],
+                                               0.25, [branches[3].name_branch],
+                                               [branches[4].name_branch])]
+
+    store_results_hdf5(results, branches, 'A', settings)
+    store_results_generators_hdf5(results_generators, branches, 'A', settings)
+
+    names = read_table_hdf5('A', settings, 'branches')
+    table = read_table_hdf5('A', settings, 'results')
+    assert list(names['name'].astype(str)) == [branch.name_branch for branch in branches]
+    assert list(names['index']) == [branch.index for branch in branches]
+    assert list(table['R']) == [result.eltR.index for result in results]
+    assert np.array_equal(table['IF'], [result.IFN2 for result in results])
+    assert np.array_equal(table['norm_IF'], [result.nIFN2 for result in results])
+    assert list(table['I_norm']) == [result.eltIn.index for result in results]
+    assert list(table['T']) == [result.eltT.index for result in results]
+
+    witnesses = read_table_hdf5('A', settings, 'top_witnesses')
+    assert len(witnesses) == 2 * len(results)
+    assert np.array_equal(witnesses['IF'][witnesses['rank'] == 1], table['IF'])
+
+    generator_witnesses = read_table_hdf5('A', settings, 'generator_witnesses')
+    assert read_table_hdf5('A', settings, 'results_generators')['IF'][0] == 0.5
+    assert [tuple(row) for row in generator_witnesses] == [(0, 0, 0, 0), (0, 0, 1, 1), (0, 0, 1, 2),
+                                                            (0, 1, 0, 3), (0, 1, 1, 4)]
+
+
+def test_pair_maxima_hdf5(tmp_path, monkeypatch, meshed_grid):
+    monkeypatch.setattr(store_functions, 'ROOT_DIR', str(tmp_path))
+    monkeypatch.setattr(store_functions, 'PAIR_MAXIMA_CHUNK_SHAPE', (2, 2))
+    settings = get_settings(SettingsEnum.UCT0)
+    setI, setT, setR, LODF, PATL, PTDF = meshed_grid
+
+    branches = list(setT) + list(setR)
+
+    pair_maxima_file = create_pair_maxima_hdf5(setI, branches, 'A', settings)
+    results, _ = compute_IFs(setI, setT, setR, LODF, PATL, PTDF, pair_maxima_file=pair_maxima_file)
+    pair_maxima_file.close()
+
+    file_path = get_results_file_path('A', settings, 'pair_maxima')
+    indices_I, indices_R, matrices = read_pair_maxima_hdf5(file_path)
+    assert list(indices_I) == list(setI.indices)
+    names = read_table_hdf5('A', settings, 'branches', 'pair_maxima')
+    name_per_index = dict(zip(names['index'], names['name'].astype(str)))
+    assert [name_per_index[index] for index in indices_I] == [i.name_branch for i in setI]
+    assert list(indices_R) == [result.eltR.index for result in results]
+    assert np.allclose(matrices['IF'].max(axis=0), [result.IFN2 for result in results])
+    assert np.allclose(matrices['norm_IF'].max(axis=0), [result.nIFN2 for result in results])
+
+    result = results[1]
+    indices_I, indices_R, matrices = read_pair_maxima_hdf5(file_path, r=result.eltR.index)
+    assert list(indices_R) == [result.eltR.index]
+    i_position = list(indices_I).index(result.eltIn.index)
+    assert matrices['norm_IF'][i_position, 0] == result.nIFN2
+    assert matrices['norm_T'][i_position, 0] == result.eltTn.index
+
+    indices_I, indices_R, matrices = read_pair_maxima_hdf5(file_path, i=result.eltI.index,
+                                                           r=result.eltR.index)
+    assert matrices['IF'].shape == (1, 1)
+    assert matrices['IF'][0, 0] == result.IFN2
+    assert matrices['T'][0, 0] == result.eltT.index
+    with pytest.raises(KeyError):
+        read_pair_maxima_hdf5(file_path, r=setT[0].index)
@@ -0,0 +1,62 @@
+import collections
+
+import pytest
+
+from project_code import matrix_and_set_functions
+from project_code.classes import BranchTypeEnum
+from project_code.main import read_grid, create_and_preprocess_topology, create_system_matrices, create_sets
+from project_code.settings import SettingsEnum, get_settings
+from project_code.synthetic_grid import create_synthetic_uct, encode_base36, get_node_name
+from project_code.topology_functions import validate_topology
+
+
+@pytest.fixture(scope='module')
+def synthetic_settings():
+    settings = get_settings(SettingsEnum.UCT0)
+    settings.countries = ['A', 'B', 'C', 'D2']
+    return settings
+
+
+def test_get_node_name():
+    assert get_node_name('A', 37, 380) == 'A000111A'
+    assert get_node_name('D2', 37, 220, 'B') == 'D200112B'
+    with pytest.raises(ValueError):
+        encode_base36(36 ** 4, 4)
+
+
+def test_create_synthetic_uct(synthetic_settings):
+    file_contents = create_synthetic_uct(800, synthetic_settings.countries, seed=1)
+    assert file_contents == create_synthetic_uct(800, synthetic_settings.countries, seed=1)
+    assert file_contents != create_synthetic_uct(800, synthetic_settings.countries, seed=2)
+
+    branches, generators, nodes = read_grid(file_contents, synthetic_settings)
+    validate_topology(nodes, branches)
+
+    nodes_per_country = collections.Counter(node.country for node in nodes)
+    # 2 * 2 countries: 4 borders of 3 tie lines
+    assert nodes_per_country.pop('X') == 12
+    assert set(nodes_per_country) == {'A', 'B', 'C', 'D2'}
+    assert all(180 <= n_nodes <= 220 for n_nodes in nodes_per_country.values())
+    assert 1.5 <= len(branches) / len(nodes) <= 1.7
+    branch_types = collections.Counter(branch.type for branch in branches)
+    assert branch_types[BranchTypeEnum.Coupler] > 0
+    assert branch_types[BranchTypeEnum.Transformer] > 0
+    assert {branch.v_base for branch in branches} == {380.0, 220.0}
+    assert len(generators) > 0
+    assert all(generator.power > 0 for generator in generators)
+
+
+def test_synthetic_grid_sets(synthetic_settings, tmp_path, monkeypatch):
+    monkeypatch.setattr(matrix_and_set_functions, 'ROOT_DIR', str(tmp_path))
+    branches, generators, nodes = read_grid(create_synthetic_uct(400, synthetic_settings.countries),
+                                            synthetic_settings)
+    branches, nodes, _ = create_and_preprocess_topology(branches, generators, nodes, 'C',
+                                                        synthetic_settings)
+    assert not any(node.is_x_node() for node in nodes)
+    assert len([branch for branch in branches if branch.is_tie_line]) == 12
+
+    _, _, LODF, PATL = create_system_matrices(branches, nodes, 'C', synthetic_settings.eps)
+    setI, setT, setR, setR_gens = create_sets(branches, generators, LODF, PATL, 'C',
+                                              synthetic_settings.eps, synthetic_settings)
+    assert min(len(setI), len(setT), len(setR), len(setR_gens)) > 0
+    assert (tmp_path / 'output_files' / 'Europe_example_uct' / 'C' / 'C_sets_T.csv').exists()
@@ -3,11 +3,12 @@ import collections
 import numpy as np
 import pytest
 
-from project_code.classes import BranchTypeEnum
+from project_code.classes import BranchTypeEnum, GenerationUnit, Node
 from project_code.topology_functions import create_coupler_mapping, \
     apply_couplers_on_branches_and_generators, remove_branches_with_loop_elements, \
     merge_tie_lines, get_most_connected_node, assign_nodes_to_ring_0, assign_nodes_to_other_rings, \
-    remove_non_connected_nodes_and_branches, validate_topology, convert_couplers_to_lines
+    remove_non_connected_nodes_and_branches, validate_topology, convert_couplers_to_lines, \
+    connect_generators_to_nodes, find_bridges_and_biconnected_components
 
 
 def test_branches_generators(branches_generators_nodes):
@@ -283,6 +284,40 @@ def test_remove_non_connected_nodes_and_branches(branches_generators_nodes):
         reset_connectivity(branches, nodes)  # only for testing
 
 
+def test_connect_generators_to_nodes():
+    nodes = [Node(name) for name in ['N3', 'N1', 'N2']]
+    for idx, node in enumerate(nodes):
+        node.index = idx
+        node.country = 'A' if idx < 2 else 'B'
+    generators = [GenerationUnit('N2', 100.0, ''), GenerationUnit('N9', 50.0, ''),
+                  GenerationUnit('N3', 200.0, '1'), GenerationUnit('N3', 300.0, '2')]
+
+    generator_arrays = connect_generators_to_nodes(nodes, generators)
+
+    assert [gen.name for gen in generators] == ['N2', 'N3_1', 'N3_2']
+    assert [gen.index for gen in generators] == [0, 1, 2]
+    assert all([gen.node.name == gen.node_name for gen in generators])
+    assert len(nodes[0].generators) == 2
+    assert len(generator_arrays) == 3
+    assert list(generator_arrays.node_index) == [2, 0, 0]
+    assert list(generator_arrays.country) == ['B', 'A', 'A']
+    assert list(generator_arrays.power) == [100.0, 200.0, 300.0]
+
+
+def test_find_bridges_and_biconnected_components():
+    # triangle 0-1-2, spur 2-3, parallel branches 3-4, chain 4-5-6, self-loop 6-6
+    node_from = [0, 1, 2, 2, 3, 3, 4, 5, 6]
+    node_to = [1, 2, 0, 3, 4, 4, 5, 6, 6]
+
+    is_bridge, component = find_bridges_and_biconnected_components(7, node_from, node_to)
+
+    assert is_bridge == [False, False, False, True, False, False, True, True, False]
+    assert component[0] == component[1] == component[2]
+    assert component[4] == component[5]
+    assert len(set(component[:8])) == 5
+    assert component[8] == -1
+
+
 def print_examples(name, lst, asset_type):
     print(f"\n {name}: {len(lst)} {asset_type}s")
     print(lst[0])